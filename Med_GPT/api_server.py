@@ -0,0 +1,157 @@
+"""
+Medical RAG Assistant - headless HTTP API
+Run with: python api_server.py --port 8000
+      or: uvicorn api_server:app --host 0.0.0.0 --port 8000 --workers 2
+
+Serves the same pipeline as app.py (utils/rag_pipeline.py):
+  POST /query   {"query": "..."}            → answer + source chunk + timings
+  POST /batch   {"queries": ["...", ...]}   → one result per query, in order
+  GET  /health                              → backend, index and load state
+  GET  /metrics                             → Prometheus metrics (stage latency histograms, ...)
+
+At most MEDGPT_API_CONCURRENCY questions are answered at once per worker;
+requests that cannot get a slot within MEDGPT_API_QUEUE_TIMEOUT_S get 503,
+and answers not ready within MEDGPT_API_TIMEOUT_S get 504 (the Ollama
+request is cancelled with the task, so it does not keep the model busy).
+Each uvicorn worker loads its own pipeline; with the default mmap load
+mode they share the index and docstore pages through the OS page cache.
+"""
+import argparse
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from utils.rag_pipeline import RAGPipeline, VECTORSTORE_DIR
+from utils.tracing import counter, histogram, metrics_text
+
+# ---------- Constants ----------
+MAX_CONCURRENT = int(os.getenv("MEDGPT_API_CONCURRENCY", "8"))  # questions answered at once per worker
+QUEUE_TIMEOUT_S = float(os.getenv("MEDGPT_API_QUEUE_TIMEOUT_S", "30"))  # wait for a slot before 503
+REQUEST_TIMEOUT_S = float(os.getenv("MEDGPT_API_TIMEOUT_S", "120"))  # per question, once admitted
+MAX_BATCH = int(os.getenv("MEDGPT_API_MAX_BATCH", "32"))
+MAX_QUERY_CHARS = 2000
+
+class QueryRequest(BaseModel):
+    query: str
+
+class BatchRequest(BaseModel):
+    queries: List[str]
+
+pipeline = None
+limiter = None
+in_flight = 0
+queue_wait = {"total_s": 0.0, "max_s": 0.0}
+REQUEST_OUTCOMES = ("accepted", "rejected", "timed_out", "completed", "failed")
+API_REQUESTS = counter("medgpt_api_requests_total", "API questions by admission outcome", labels=("outcome",))
+QUEUE_WAIT = histogram("medgpt_api_queue_wait_seconds", "Time a question waited for a concurrency slot")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global pipeline, limiter
+    limiter = asyncio.Semaphore(MAX_CONCURRENT)
+    # Load before accepting traffic; the embedding model keeps loading in the background
+    pipeline = await asyncio.to_thread(RAGPipeline, VECTORSTORE_DIR)
+    await asyncio.to_thread(pipeline.load)
+    print(f"✓ API ready ({pipeline.vs.index.ntotal} chunks, {pipeline.handler.backend} backend, "
+          f"{MAX_CONCURRENT} concurrent)")
+    yield
+    await pipeline.aclose()
+
+app = FastAPI(title="Medical RAG Assistant API", lifespan=lifespan)
+
+def _check_query(query: str) -> str:
+    query = query.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="query is empty")
+    if len(query) > MAX_QUERY_CHARS:
+        raise HTTPException(status_code=400, detail=f"query longer than {MAX_QUERY_CHARS} characters")
+    return query
+
+async def _answer_limited(query: str) -> dict:
+    """Answer one question once a concurrency slot is free, or raise 503."""
+    global in_flight
+    t0 = time.perf_counter()
+    try:
+        await asyncio.wait_for(limiter.acquire(), QUEUE_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        API_REQUESTS.inc("rejected")
+        raise HTTPException(status_code=503, detail="Server busy, retry later",
+                            headers={"Retry-After": str(int(QUEUE_TIMEOUT_S))})
+    waited = time.perf_counter() - t0
+    queue_wait["total_s"] += waited
+    queue_wait["max_s"] = max(queue_wait["max_s"], waited)
+    QUEUE_WAIT.observe(waited)
+    API_REQUESTS.inc("accepted")
+    in_flight += 1
+    try:
+        result = await asyncio.wait_for(pipeline.aanswer(query), REQUEST_TIMEOUT_S)
+        API_REQUESTS.inc("completed")
+        return result
+    except asyncio.TimeoutError:
+        API_REQUESTS.inc("timed_out")
+        raise HTTPException(status_code=504, detail=f"No answer within {REQUEST_TIMEOUT_S:g}s")
+    except Exception:
+        API_REQUESTS.inc("failed")
+        raise
+    finally:
+        in_flight -= 1
+        limiter.release()
+
+@app.post("/query")
+async def query(req: QueryRequest):
+    return await _answer_limited(_check_query(req.query))
+
+@app.post("/batch")
+async def batch(req: BatchRequest):
+    if len(req.queries) > MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"at most {MAX_BATCH} queries per batch")
+    queries = [_check_query(q) for q in req.queries]
+    if not queries:
+        return {"results": []}
+    # One batched embedding call; the per-question lookups below hit the retriever's memo
+    if pipeline.retriever.embeddings_ready:
+        await asyncio.to_thread(pipeline.retriever.embed_queries, queries)
+    results = await asyncio.gather(*(_answer_limited(q) for q in queries), return_exceptions=True)
+    out = []
+    for q, r in zip(queries, results):
+        if isinstance(r, HTTPException):
+            out.append({"query": q, "error": r.detail, "status": r.status_code})
+        elif isinstance(r, Exception):
+            out.append({"query": q, "error": str(r), "status": 500})
+        else:
+            out.append(r)
+    return {"results": out}
+
+@app.get("/health")
+async def health():
+    status = pipeline.health()
+    accepted = API_REQUESTS.value("accepted")
+    status.update({"status": "ok" if pipeline.loaded else "loading",
+                   "in_flight": in_flight, "max_concurrent": MAX_CONCURRENT,
+                   "requests": {outcome: API_REQUESTS.value(outcome) for outcome in REQUEST_OUTCOMES},
+                   "queue_wait_avg_s": queue_wait["total_s"] / accepted if accepted else 0.0,
+                   "queue_wait_max_s": queue_wait["max_s"]})
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metrics_text(), media_type="text/plain; version=0.0.4")
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the RAG pipeline over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    args = parser.parse_args()
+    uvicorn.run("api_server:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -5,34 +5,35 @@ Run with: streamlit run app.py
 
 import os
 import time
-import threading
 from pathlib import Path
 import sys
 ROOT = Path(__file__).resolve().parent
 sys.path.insert(0, str(ROOT))
 sys.path.insert(0, str(ROOT / "utils"))
-from utils.llm_handler import LLMHandler
 
 import streamlit as st
-import fitz  # PyMuPDF
 
-# === LangChain imports (new packages with graceful fallback) ===
-try:
-    from langchain_huggingface import HuggingFaceEmbeddings
-except ImportError:
-    from langchain_community.embeddings import HuggingFaceEmbeddings  # fallback
+# Heavy modules (faiss, torch, sentence-transformers, PyMuPDF, LangChain) are imported
+# lazily by the pipeline and renderer, so the page renders before they load
+from utils.mmap_store import Document
 
-from langchain_community.vectorstores import FAISS
-
-# === Local LLM handler (fast, HTTP, with fallback) ===
-from llm_handler import LLMHandler
+# === Shared RAG pipeline (also served headless by api_server.py) ===
+from utils.rag_pipeline import (
+    RAGPipeline, EMBED_MODEL, EMBED_BACKEND, VECTORSTORE_DIR, TOP_K,
+    INDEX_TYPE, IVF_NPROBE, HNSW_EF_SEARCH, LOAD_MODE, RETRIEVAL_MODE, HYBRID_CANDIDATES,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+from utils.micro_batcher import BATCH_WINDOW_MS, MAX_BATCH
+from utils.deadline_executor import DeadlineExceeded, DeadlineExecutor, Rejected
+from utils.context_builder import CONTEXT_TOKEN_BUDGET
+from utils.tracing import start_trace, start_metrics_server, STAGE_SECONDS
+from utils.pdf_render_cache import PageRenderCache
 
 # ---------- Constants ----------
-EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  # must match preprocessing
-VECTORSTORE_DIR = "vectorstore"
-TOP_K = 1
 RETRIEVAL_TIMEOUT_S = 120.0   # hard timeout for retrieval step
 LLM_TIMEOUT_S = 120.0        # llm_handler has 30s HTTP timeout; we also guard the call
+STREAM_RENDER_INTERVAL_S = 0.05  # throttle answer-pane redraws while streaming
+PDF_PAGE_CACHE_DIR = ".cache/pdf_pages"  # rendered viewer pages (memory LRU + this disk tier)
 
 # ---------- Page config ----------
 st.set_page_config(
@@ -79,69 +80,65 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ---------- Small helpers ----------
-def _run_with_timeout(fn, timeout_s, *args, **kwargs):
-    """Run callable in background thread and return (result, error) or (None, TimeoutError)."""
-    box = {"out": None, "err": None}
-    def _target():
-        try:
-            box["out"] = fn(*args, **kwargs)
-        except Exception as e:
-            box["err"] = e
-    t = threading.Thread(target=_target, daemon=True)
-    t.start()
-    t.join(timeout_s)
-    if t.is_alive():
-        return None, TimeoutError(f"Operation exceeded {timeout_s} seconds")
-    return box["out"], box["err"]
-
 # ---------- Caches ----------
 @st.cache_resource(show_spinner=False)
-def load_vectorstore():
-    """Load pre-processed FAISS store."""
-    path = Path(VECTORSTORE_DIR)
-    if not path.exists():
-        st.error("❌ Vectorstore not found! Run: `python preprocess_documents.py`")
-        st.stop()
-    embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
-    vs = FAISS.load_local(str(path), embeddings, allow_dangerous_deserialization=True)
-    return vs
+def get_executor():
+    # Bounded, shared by all sessions: timed-out steps are cancelled, not leaked
+    return DeadlineExecutor()
 
 @st.cache_resource(show_spinner=False)
-def get_retriever():
-    vs = load_vectorstore()
-    return vs, vs.as_retriever(search_kwargs={"k": TOP_K})
+def get_metrics_server():
+    # Prometheus /metrics on MEDGPT_METRICS_PORT (off by default), one per process
+    return start_metrics_server()
 
 @st.cache_resource(show_spinner=False)
+def get_pipeline():
+    # Vectorstore, retriever, answer cache and LLM handler, loaded once per process
+    return RAGPipeline(VECTORSTORE_DIR)
+
+def get_retriever():
+    """(vectorstore, retriever) from the shared pipeline."""
+    try:
+        return get_pipeline().load()
+    except FileNotFoundError:
+        st.error("❌ Vectorstore not found! Run: `python preprocess_documents.py`")
+        st.stop()
+
+def load_vectorstore():
+    return get_retriever()[0]
+
 def get_llm_handler():
-    # One LLMHandler for the session (detects Ollama/Claude/fallback once)
-    return LLMHandler()
+    return get_pipeline().handler
+
+def get_answer_cache():
+    return get_pipeline().answer_cache
 
 # ---------- PDF rendering ----------
+@st.cache_resource(show_spinner=False)
+def get_page_cache():
+    # Rendered pages survive reruns; open PDFs are pooled across them
+    return PageRenderCache(PDF_PAGE_CACHE_DIR)
+
+def pdf_view_args(src):
+    """(pdf_path, page, highlight) the viewer renders for a source, or None if not a PDF."""
+    file_path = src.metadata.get("file_path") or src.metadata.get("source", "")
+    if not file_path or not file_path.lower().endswith(".pdf") or not Path(file_path).exists():
+        return None
+    page = src.metadata.get("page", 0)
+    return file_path, page if isinstance(page, int) else 0, (src.page_content or "")[:120]
+
+def prefetch_pages(sources):
+    """Render the viewer pages for these sources in the background."""
+    items = [args for args in (pdf_view_args(s) for s in sources if s is not None) if args]
+    if items:
+        get_page_cache().prefetch(items)
+
 def display_pdf_page(pdf_path, page_num, highlight_text=None):
-    doc = None
     try:
-        doc = fitz.open(pdf_path)
-        if not isinstance(page_num, int) or not (0 <= page_num < len(doc)):
-            page_num = 0
-        page = doc[page_num]
-
-        if highlight_text:
-            search_text = highlight_text[:120].strip()
-            if search_text:
-                try:
-                    for inst in page.search_for(search_text)[:3]:
-                        page.add_highlight_annot(inst)
-                except Exception:
-                    pass
-
-        pix = page.get_pixmap(matrix=fitz.Matrix(2.5, 2.5))
-        st.image(pix.tobytes("png"), use_container_width=True)
+        png = get_page_cache().get_png(pdf_path, page_num, highlight_text)
+        st.image(png, use_container_width=True)
     except Exception as e:
         st.error(f"Error displaying PDF: {e}")
-    finally:
-        if doc is not None:
-            doc.close()
 
 # ---------- Session state ----------
 if "chat_history" not in st.session_state:
@@ -181,72 +178,137 @@ with col1:
 
     if search_btn and query:
         status = st.status("🔎 Searching medical documents...", state="running")
+        # Stage timings go to the trace log and /metrics; executor tasks inherit the trace
+        trace = start_trace("query", frontend="streamlit", mode=RETRIEVAL_MODE)
         try:
             t0 = time.perf_counter()
             # Load vectorstore + retriever
-            vs, retriever = get_retriever()
+            get_retriever()
             t1 = time.perf_counter()
             status.update(label=f"📚 Index loaded in {t1 - t0:.2f}s… retrieving top match")
 
-            # Retrieval with timeout guard
-            docs, err = _run_with_timeout(retriever.get_relevant_documents, RETRIEVAL_TIMEOUT_S, query)
+            # Answer cache (exact question, then nearest previously seen one), retrieval and
+            # context packing run as one executor task under the retrieval deadline. The task
+            # gets the token, so it stops at the next stage (or model wait) once it expires
+            pipeline = get_pipeline()
+            handler = pipeline.handler
+            with trace.activate():
+                prep, err = get_executor().run(pipeline.prepare, query, timeout_s=RETRIEVAL_TIMEOUT_S,
+                                               pass_token=True)
             t2 = time.perf_counter()
-
+            if isinstance(err, Rejected):
+                trace.finish("rejected")
+                status.update(label="⏳ Server is busy, please try again in a moment.", state="error")
+                st.stop()
             if err is not None:
+                trace.finish("error")
                 status.update(label=f"⚠️ Retrieval error: {err}", state="error")
                 st.stop()
 
+            cached = prep["cached"]
+            if cached is not None:
+                result = pipeline.finish(query, prep, trace)
+                src = result["source"]
+                source_doc = Document(page_content=src["page_content"], metadata=src["metadata"]) if src else None
+                st.session_state.chat_history.insert(0, {
+                    "query": query,
+                    "answer": result["answer"],
+                    "source": source_doc
+                })
+                st.session_state.current_source = source_doc
+                match = "exact" if cached["match"] == "exact" else f"similar {cached['score']:.2f}"
+                status.update(label=f"⚡ Cached answer ({match}) in {(t2 - t1) * 1000:.0f} ms", state="complete")
+                st.rerun()
+
+            docs = prep["docs"]
             if not docs:
+                result = pipeline.finish(query, prep, trace)
                 status.update(label=f"ℹ️ No matching chunks (index {t1-t0:.2f}s, retrieve {t2-t1:.2f}s).", state="complete")
                 st.warning("No relevant context found in your documents.")
                 st.session_state.chat_history.insert(0, {
                     "query": query,
-                    "answer": "I couldn’t find relevant context in the indexed documents.",
+                    "answer": result["answer"],
                     "source": None
                 })
                 st.rerun()
 
-            # Context preview
-            top = docs[0]
-            context = top.page_content
-            source_doc = top
-            src_name = top.metadata.get("source", "Unknown")
-            st.caption(f"✅ Retrieved 1 chunk in {t2-t1:.2f}s from **{src_name}**")
+            # Viewer pages for the hits render while the LLM answers
+            prefetch_pages(docs[:1])
+
+            # Context: query-relevant sentences of the top chunks, within the token budget
+            packed = prep["packed"]
+            context = packed["text"]
+            source_doc = docs[0]
+            src_name = source_doc.metadata.get("source", "Unknown")
+            st.caption(f"✅ Retrieved {len(docs)} chunks in {t2-t1:.2f}s (top: **{src_name}**) • "
+                       f"{packed['sentences']} sentences from {len(packed['sources'])} chunks packed into "
+                       f"{packed['tokens']} tokens")
             with st.expander("🔎 Retrieved context preview", expanded=False):
-                st.write(context[:600])
+                st.write(context)
 
-            # LLM answer via handler
+            # LLM answer via handler, rendered as tokens arrive
             status.update(label="🤖 Generating answer (LLM)…")
-            handler = get_llm_handler()
 
-            def _answer():
-                return handler.generate_answer(query, context)
-
-            answer, aerr = _run_with_timeout(_answer, LLM_TIMEOUT_S)
+            answer_box = st.empty()
+            llm_stats = {}
+            parts = []
+            last_render = 0.0
+            # Generation is an executor task like retrieval; tokens arrive here through a queue.
+            # At the deadline the watchdog closes the Ollama response, which ends the stream
+            try:
+                stream, deadline = get_executor().stream(handler.stream_answer, query, context,
+                                                         stats=llm_stats, timeout_s=LLM_TIMEOUT_S)
+            except Rejected:
+                trace.finish("rejected")
+                status.update(label="⏳ Server is busy, please try again in a moment.", state="error")
+                st.stop()
+            try:
+                for token in stream:
+                    parts.append(token)
+                    now = time.perf_counter()
+                    if now - last_render > STREAM_RENDER_INTERVAL_S:
+                        answer_box.markdown(f"<div class='assistant-message'>{''.join(parts)}▌</div>", unsafe_allow_html=True)
+                        last_render = now
+            except DeadlineExceeded:
+                pass  # expired while queued; reported as a timeout below
+            finally:
+                stream.close()
+            llm_stats["timed_out"] = deadline.timed_out
+            answer = handler.clean_answer("".join(parts)).strip()
             t3 = time.perf_counter()
+            answer_box.empty()
 
-            if aerr is not None:
-                status.update(label=f"⚠️ LLM error: {aerr}", state="error")
-                st.stop()
+            # Caches a real model answer (not fallback text) and records the trace outcome
+            pipeline.finish(query, prep, trace, answer, llm_stats)
 
-            if answer is None or not str(answer).strip():
+            if deadline.timed_out:
                 status.update(label=f"⏱️ LLM exceeded {LLM_TIMEOUT_S}s (index {t1-t0:.2f}s • retrieve {t2-t1:.2f}s).", state="complete")
                 st.warning("The model took too long to respond. Please try again.")
                 st.stop()
 
-            st.caption(f"🤖 Answer generated in {t3 - t2:.2f}s using {handler.backend.upper()} → {handler.ollama_model or 'fallback'}")
+            if not answer:
+                status.update(label=f"⚠️ LLM returned no answer (index {t1-t0:.2f}s • retrieve {t2-t1:.2f}s).", state="error")
+                st.warning("The model returned an empty answer. Please try again.")
+                st.stop()
+
+            ttft = llm_stats.get("ttft_s")
+            tps = llm_stats.get("tokens_per_s")
+            llm_rate = f" • TTFT {ttft:.2f}s" if ttft is not None else ""
+            llm_rate += f" • {tps:.1f} tok/s" if tps else ""
+            st.caption(f"🤖 Answer generated in {t3 - t2:.2f}s{llm_rate} using {handler.backend.upper()} → {handler.ollama_model or 'fallback'}")
 
             st.session_state.chat_history.insert(0, {
                 "query": query,
-                "answer": answer.strip(),
+                "answer": answer,
                 "source": source_doc
             })
             st.session_state.current_source = source_doc
 
-            status.update(label=f"✅ Done (index {t1-t0:.2f}s • retrieve {t2-t1:.2f}s • LLM {t3-t2:.2f}s)", state="complete")
+            status.update(label=f"✅ Done (index {t1-t0:.2f}s • retrieve {t2-t1:.2f}s • LLM {t3-t2:.2f}s{llm_rate})", state="complete")
             st.rerun()
 
         except Exception as e:
+            trace.finish("error")
             status.update(label="❌ Error during search", state="error")
             st.error(f"{e}")
 
@@ -261,6 +323,7 @@ with col1:
         </div>
         """, unsafe_allow_html=True)
     else:
+        prefetch_pages(chat["source"] for chat in st.session_state.chat_history[:5])
         for idx, chat in enumerate(st.session_state.chat_history[:5]):
             st.markdown(f"<div class='user-message'><strong>Q:</strong> {chat['query']}</div>", unsafe_allow_html=True)
             st.markdown(f"<div class='assistant-message'>{chat['answer']}</div>", unsafe_allow_html=True)
@@ -294,7 +357,7 @@ with col2:
         st.markdown("#### 📄 Full Document Page")
         if file_path and Path(file_path).exists():
             if file_path.lower().endswith(".pdf"):
-                display_pdf_page(file_path, page if isinstance(page, int) else 0, content[:120])
+                display_pdf_page(*pdf_view_args(src))
             else:
                 st.info("📄 Full preview available only for PDF files")
                 st.text_area("Document Content", content, height=400)
@@ -341,15 +404,36 @@ with st.sidebar:
     st.markdown("---")
     handler = get_llm_handler()
     st.markdown("### 🤖 LLM Backend")
-    st.info(f"**Backend:** {handler.backend.upper()}  \n**Model:** {handler.ollama_model or '—'}")
+    warming = "" if handler.warm.is_set() else " (warming up…)"
+    st.info(f"**Backend:** {handler.backend.upper()}  \n**Model:** {handler.ollama_model or '—'}{warming}")
+
+    try:
+        cache_stats = get_answer_cache().stats()
+        st.caption(f"⚡ Answer cache: {cache_stats['entries']} entries • "
+                   f"{cache_stats['exact']} exact / {cache_stats['semantic']} similar hits")
+        st.caption(f"🖼️ Page cache: {get_page_cache().summary()}")
+        st.caption(f"🧵 Pipeline: {get_executor().summary()}")
+        get_metrics_server()
+        stages = STAGE_SECONDS.summary()
+        if stages:
+            slowest = sorted(stages.items(), key=lambda kv: -kv[1]["avg"])[:4]
+            st.caption("⏱️ Avg stage latency: " + " • ".join(
+                f"{stage} {m['avg'] * 1000:.0f} ms" for stage, m in slowest if stage != "total"))
+    except Exception:
+        pass
 
     st.markdown("---")
     st.markdown("### ⚙️ Settings")
     st.markdown(f"""
-    - **Top Results:** {TOP_K}
-    - **Embedding Model:** `{EMBED_MODEL}`
+    - **Top Results:** {TOP_K} (packed into {CONTEXT_TOKEN_BUDGET} context tokens)
+    - **Index:** {INDEX_TYPE} (nprobe {IVF_NPROBE}, efSearch {HNSW_EF_SEARCH})
+    - **Load Mode:** {LOAD_MODE}
+    - **Retrieval:** {RETRIEVAL_MODE} ({HYBRID_CANDIDATES} BM25 candidates)
+    - **Query Batching:** {BATCH_WINDOW_MS:g} ms window, up to {MAX_BATCH} queries
+    - **Embedding Model:** `{EMBED_MODEL}` ({EMBED_BACKEND})
     - **Retrieval Timeout:** {RETRIEVAL_TIMEOUT_S}s
     - **LLM Timeout:** {LLM_TIMEOUT_S}s
+    - **Semantic Cache Threshold:** {SEMANTIC_CACHE_THRESHOLD}
     """)
 
     st.markdown("""
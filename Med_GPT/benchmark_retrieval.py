@@ -0,0 +1,319 @@
+"""
+Offline retrieval benchmark driven by queries.json
+
+Queries go through the same CachedRetriever (dense, hybrid BM25 + RRF, or
+lexical) the app builds in utils/rag_pipeline, with its defaults for the
+load mode, retrieval mode and top-k. Timings are for one caller: the
+micro-batcher and the background model load are not used.
+
+Usage:  python benchmark_retrieval.py --label baseline
+        python benchmark_retrieval.py --retrieval-mode dense --label dense
+        python benchmark_retrieval.py --compare bench_results/a.json bench_results/b.json
+        python benchmark_retrieval.py --import-time            (startup import cost per module)
+"""
+import argparse
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from utils.rag_pipeline import (EMBED_BACKEND, EMBED_MODEL, HNSW_EF_SEARCH, HYBRID_CANDIDATES, INDEX_TYPE,
+                                IVF_NPROBE, LOAD_MODE, RETRIEVAL_MODE, TOP_K, VECTORSTORE_DIR)
+from utils.retriever import RETRIEVAL_MODES
+
+QUERIES_FILE = "queries.json"
+RESULTS_DIR = "bench_results"
+ROOT = Path(__file__).resolve().parent
+IMPORT_TARGETS = ("utils.rag_pipeline", "utils.pdf_render_cache", "api_server")  # what app.py / the API import
+HEAVY_MODULES = ("streamlit", "langchain_core", "langchain_community", "langchain_huggingface",
+                 "torch", "sentence_transformers", "faiss", "fitz")
+
+def percentile(values, pct):
+    """Nearest-rank percentile (values need not be sorted)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def summarize(samples_ms):
+    return {
+        "mean_ms": sum(samples_ms) / len(samples_ms) if samples_ms else 0.0,
+        "p50_ms": percentile(samples_ms, 50),
+        "p95_ms": percentile(samples_ms, 95),
+        "p99_ms": percentile(samples_ms, 99),
+        "max_ms": max(samples_ms) if samples_ms else 0.0,
+    }
+
+def load_queries(path=QUERIES_FILE, limit=None):
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    queries = [(str(q.get("query_num", i)), q["query"]) for i, q in enumerate(items) if q.get("query")]
+    return queries[:limit] if limit else queries
+
+def load_retriever(vs_dir=VECTORSTORE_DIR, index_type=INDEX_TYPE, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH,
+                   load_mode=LOAD_MODE, embed_backend=EMBED_BACKEND, retrieval_mode=RETRIEVAL_MODE, k=TOP_K):
+    """Load the vectorstore and build the retriever like utils/rag_pipeline; return (retriever, timings)."""
+    t0 = time.perf_counter()
+    from utils.embeddings import make_embeddings, register_langchain
+    from utils.bm25_index import BM25Index
+    from utils.retriever import CachedRetriever
+    if load_mode == "mmap":
+        from utils.mmap_store import DOCSTORE_FILE, MmapVectorStore
+    else:
+        from langchain_community.vectorstores import FAISS
+        register_langchain()
+    t1 = time.perf_counter()
+    embeddings = make_embeddings(EMBED_MODEL, backend=embed_backend)
+    t2 = time.perf_counter()
+    if load_mode == "mmap":
+        if not (Path(vs_dir) / DOCSTORE_FILE).exists():
+            raise SystemExit(f"❌ No {DOCSTORE_FILE} in {vs_dir}. Run: python utils/mmap_store.py {vs_dir} "
+                             f"(or use --load-mode full)")
+        vs = MmapVectorStore(vs_dir, embeddings)
+    else:
+        vs = FAISS.load_local(str(vs_dir), embeddings, allow_dangerous_deserialization=True)
+    if index_type != "flat":
+        from utils.ann_index import load_ann_index, set_search_params
+        ann = load_ann_index(vs_dir, index_type, expected_ntotal=vs.index.ntotal, mmap=load_mode == "mmap")
+        if ann is None:
+            raise SystemExit(f"❌ No usable {index_type} index. Run: python utils/preprocess_documents.py --index-type {index_type}")
+        vs.index = set_search_params(ann, nprobe=nprobe, ef_search=ef_search)
+    bm25 = None
+    if retrieval_mode != "dense":
+        bm25 = BM25Index.load(vs_dir, expected_n_docs=vs.index.ntotal)
+        if bm25 is None:
+            raise SystemExit(f"❌ {retrieval_mode} retrieval needs a current BM25 index. "
+                             f"Run: python utils/preprocess_documents.py")
+    retriever = CachedRetriever(vs, k=k, bm25=bm25, mode=retrieval_mode, candidates=HYBRID_CANDIDATES)
+    t3 = time.perf_counter()
+    return retriever, {
+        "import_s": t1 - t0,
+        "embedding_model_s": t2 - t1,
+        "index_load_s": t3 - t2,
+        "cold_load_s": t3 - t0,
+    }
+
+def run_benchmark(retriever, queries, k=TOP_K, warmup=3):
+    lexical = retriever.mode == "lexical"
+
+    # Warm-up passes are excluded from the statistics (first call pays lazy init)
+    first_query_ms = None
+    for _, q in queries[:warmup]:
+        t0 = time.perf_counter()
+        retriever.get_relevant_documents(q, k)
+        if first_query_ms is None:
+            first_query_ms = (time.perf_counter() - t0) * 1000
+    retriever.clear()  # measured queries must not hit the warm-up's memoized results
+
+    per_query = []
+    t_start = time.perf_counter()
+    for qnum, q in queries:
+        t0 = time.perf_counter()
+        if not lexical:
+            retriever.embed_query(q)  # memoized, so the search below reuses it
+        t1 = time.perf_counter()
+        docs = retriever.get_relevant_documents(q, k)
+        t2 = time.perf_counter()
+        top = docs[0].metadata if docs else {}
+        per_query.append({
+            "query_num": qnum,
+            "embed_ms": (t1 - t0) * 1000,
+            "search_ms": (t2 - t1) * 1000,
+            "total_ms": (t2 - t0) * 1000,
+            "top_source": top.get("source"),
+            "top_page": top.get("page"),
+        })
+    wall_s = time.perf_counter() - t_start
+
+    return per_query, {
+        "queries": len(per_query),
+        "first_query_ms": first_query_ms,
+        "wall_s": wall_s,
+        "queries_per_s": len(per_query) / wall_s if wall_s > 0 else 0.0,
+        "embed": summarize([r["embed_ms"] for r in per_query]),
+        "search": summarize([r["search_ms"] for r in per_query]),
+        "total": summarize([r["total_ms"] for r in per_query]),
+    }
+
+def index_info(vs, vs_dir=VECTORSTORE_DIR):
+    index_file = Path(vs_dir) / "index.faiss"
+    return {
+        "index_type": type(vs.index).__name__,
+        "ntotal": int(getattr(vs.index, "ntotal", 0)),
+        "dim": int(getattr(vs.index, "d", 0)),
+        "index_file_mb": index_file.stat().st_size / (1024 * 1024) if index_file.exists() else None,
+    }
+
+def print_summary(result):
+    s = result["summary"]
+    print(f"\n📚 Cold load: {result['load']['cold_load_s']:.2f}s "
+          f"(imports {result['load']['import_s']:.2f}s • model {result['load']['embedding_model_s']:.2f}s "
+          f"• index {result['load']['index_load_s']:.2f}s)")
+    print(f"📊 {s['queries']} queries • {s['queries_per_s']:.1f} q/s • first query {s['first_query_ms'] or 0:.1f} ms")
+    print(f"  {'stage':<8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for stage in ("embed", "search", "total"):
+        row = s[stage]
+        print(f"  {stage:<8} {row['p50_ms']:>7.2f}ms {row['p95_ms']:>7.2f}ms {row['p99_ms']:>7.2f}ms {row['max_ms']:>7.2f}ms")
+
+def measure_imports(targets=IMPORT_TARGETS, repeat=3):
+    """
+    Import each module in a fresh interpreter under -X importtime (best of
+    repeat). Returns {module: {"import_ms", "heavy": HEAVY_MODULES it pulled
+    in, "packages": {top-level package: cumulative ms}}}.
+    """
+    # __import__, not importlib.import_module: -X importtime does not time the latter's outer module
+    code = ("import sys; __import__(sys.argv[1]); "
+            "print('HEAVY', *(m for m in sys.argv[2:] if m in sys.modules))")
+    results = {}
+    for target in targets:
+        best = None
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code, target, *HEAVY_MODULES],
+                                  cwd=ROOT, capture_output=True, text=True)
+            if proc.returncode != 0:
+                best = {"error": (proc.stderr.strip().splitlines() or ["failed"])[-1]}
+                break
+            rows = []  # (depth, cumulative us, module) in the order Python finished importing them
+            for line in proc.stderr.splitlines():
+                fields = line.removeprefix("import time:").split("|")
+                if len(fields) != 3 or not fields[1].strip().isdigit():
+                    continue  # header or other stderr output
+                name = fields[2].rstrip()
+                rows.append(((len(name) - len(name.lstrip()) - 1) // 2, int(fields[1]), name.strip()))
+            # Interpreter startup ends with site; the top-level entries after it, up to
+            # the target itself, are what importing the target cost
+            start = next((i + 1 for i, (depth, _, name) in enumerate(rows) if depth == 0 and name == "site"), 0)
+            end = max(i for i, (depth, _, name) in enumerate(rows) if depth == 0 and name == target)
+            total_us = sum(us for depth, us, _ in rows[start:end + 1] if depth == 0)
+            packages = {}
+            for _, us, name in rows[start:end + 1]:
+                package = name.split(".")[0]
+                packages[package] = max(packages.get(package, 0), us)
+            run = {
+                "import_ms": total_us / 1000,
+                "heavy": next((l.split()[1:] for l in proc.stdout.splitlines() if l.startswith("HEAVY")), []),
+                "packages": {p: us / 1000 for p, us in packages.items() if p != target.split(".")[0]},
+            }
+            if best is None or run["import_ms"] < best["import_ms"]:
+                best = run
+        results[target] = best
+    return results
+
+def print_imports(results, top=5):
+    print("\n⏱️  Import time (fresh interpreter per run, best run)")
+    for target, r in results.items():
+        if "error" in r:
+            print(f"  {target:<26} ❌ {r['error']}")
+            continue
+        print(f"  {target:<26} {r['import_ms']:>7.0f} ms   heavy: {', '.join(r['heavy']) or 'none'}")
+        costly = sorted(r["packages"].items(), key=lambda kv: -kv[1])[:top]
+        print("      " + " • ".join(f"{p} {ms:.0f} ms" for p, ms in costly))
+
+def compare(path_a, path_b):
+    with open(path_a, "r", encoding="utf-8") as f:
+        a = json.load(f)
+    with open(path_b, "r", encoding="utf-8") as f:
+        b = json.load(f)
+
+    print(f"\n🔬 Comparing  A={a['label']}  vs  B={b['label']}\n")
+    rows = [("cold_load_s", a["load"]["cold_load_s"], b["load"]["cold_load_s"]),
+            ("queries_per_s", a["summary"]["queries_per_s"], b["summary"]["queries_per_s"])]
+    for stage in ("embed", "search", "total"):
+        for pct in ("p50_ms", "p95_ms", "p99_ms"):
+            rows.append((f"{stage}.{pct}", a["summary"][stage][pct], b["summary"][stage][pct]))
+
+    print(f"  {'metric':<18} {'A':>10} {'B':>10} {'delta':>9}")
+    for name, va, vb in rows:
+        delta = f"{(vb - va) / va * 100:+.1f}%" if va else "n/a"
+        print(f"  {name:<18} {va:>10.3f} {vb:>10.3f} {delta:>9}")
+
+    # Top-1 agreement tells whether a faster build still returns the same chunks
+    top_a = {r["query_num"]: (r["top_source"], r["top_page"]) for r in a["per_query"]}
+    top_b = {r["query_num"]: (r["top_source"], r["top_page"]) for r in b["per_query"]}
+    shared = [q for q in top_a if q in top_b]
+    if shared:
+        same = sum(1 for q in shared if top_a[q] == top_b[q])
+        print(f"\n🎯 Top-1 agreement: {same}/{len(shared)} ({same / len(shared) * 100:.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS retrieval over queries.json")
+    parser.add_argument("--label", default=None, help="Name for this run (results file name)")
+    parser.add_argument("--vectorstore", default=VECTORSTORE_DIR)
+    parser.add_argument("--queries", default=QUERIES_FILE)
+    parser.add_argument("--k", type=int, default=TOP_K, help="Chunks per query (default: the app's, %(default)s)")
+    parser.add_argument("--index-type", default=INDEX_TYPE, help="flat | ivf | hnsw | ivfpq")
+    parser.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    parser.add_argument("--ef-search", type=int, default=HNSW_EF_SEARCH)
+    parser.add_argument("--embed-backend", choices=("torch", "int8", "onnx"), default=EMBED_BACKEND,
+                        help="Query embedding backend (see utils/embeddings.py)")
+    parser.add_argument("--load-mode", choices=("full", "mmap"), default=LOAD_MODE,
+                        help="full = FAISS.load_local, mmap = mapped index + SQLite docstore "
+                             "(default: the app's, %(default)s)")
+    parser.add_argument("--retrieval-mode", choices=RETRIEVAL_MODES, default=RETRIEVAL_MODE,
+                        help="hybrid = BM25 candidates + dense rescoring (RRF), dense = FAISS only, "
+                             "lexical = BM25 only")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N queries")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--out-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"), help="Compare two results files")
+    parser.add_argument("--import-time", nargs="*", metavar="MODULE", default=None,
+                        help=f"Measure import cost instead (default: {' '.join(IMPORT_TARGETS)})")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.import_time is not None:
+        print_imports(measure_imports(args.import_time or IMPORT_TARGETS))
+        return
+
+    if not Path(args.vectorstore).exists():
+        print(f"❌ Vectorstore not found: {args.vectorstore}. Run: python utils/preprocess_documents.py")
+        return
+
+    queries = load_queries(args.queries, args.limit)
+    print(f"\n=== Retrieval Benchmark ({len(queries)} queries, k={args.k}, {args.retrieval_mode}, "
+          f"{args.load_mode} load) ===")
+
+    retriever, load = load_retriever(args.vectorstore, args.index_type, args.nprobe, args.ef_search,
+                                     args.load_mode, args.embed_backend, args.retrieval_mode, args.k)
+    per_query, summary = run_benchmark(retriever, queries, k=args.k, warmup=args.warmup)
+
+    label = args.label or datetime.now().strftime("run_%Y%m%d_%H%M%S")
+    result = {
+        "label": label,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "embed_model": EMBED_MODEL,
+            "vectorstore": str(args.vectorstore),
+            "k": args.k,
+            "nprobe": args.nprobe,
+            "ef_search": args.ef_search,
+            "load_mode": args.load_mode,
+            "retrieval_mode": args.retrieval_mode,
+            "embed_backend": args.embed_backend,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            **index_info(retriever.vectorstore, args.vectorstore),
+        },
+        "load": load,
+        "summary": summary,
+        "per_query": per_query,
+    }
+    print_summary(result)
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(exist_ok=True)
+    out_file = out_dir / f"{label}.json"
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n💾 Results saved to {out_file}")
+    print(f"   Compare with: python benchmark_retrieval.py --compare {out_file} <other.json>")
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,24 @@
 """
 Build vector store cache for deployment
 Run this once: python build_cache.py
+Profile it:    python build_cache.py --profile   (time/memory per stage, see utils/profiling.py)
 """
+import argparse
 from pathlib import Path
+from utils.checkpoint import IngestCheckpoint
 from utils.document_processor import DocumentProcessor
-from utils.vector_store import VectorStore
+from utils.profiling import PROFILE_DIR, profiled, stage
+from vector_store_persistent import VectorStore
+
+CHECKPOINT_DIR = "vector_cache/.checkpoint"
 
 def build_cache():
     print("=" * 60)
     print("🏗️  Building Vector Store Cache for Deployment")
     print("=" * 60)
     
-    # Initialize
-    processor = DocumentProcessor()
+    # Initialize (PDF extraction resumes from CHECKPOINT_DIR after an interruption)
+    processor = DocumentProcessor(checkpoint_dir=CHECKPOINT_DIR)
     vector_store = VectorStore()
     
     # Find documents
@@ -56,11 +62,14 @@ def build_cache():
     
     # Build vector store
     print(f"\n🔨 Building vector index from {len(all_chunks)} chunks...")
-    vector_store.add_documents(all_chunks)
+    with stage("embed"):
+        vector_store.add_documents(all_chunks)
     
     # Save cache
     print("\n💾 Saving cache...")
-    cache_file = vector_store.save("medical_docs")
+    with stage("index_write"):
+        cache_dir = vector_store.save("medical_docs")
+    IngestCheckpoint(CHECKPOINT_DIR).clear()
     
     # Summary
     print("\n" + "=" * 60)
@@ -69,8 +78,8 @@ def build_cache():
     print(f"\n📊 Statistics:")
     print(f"  • Documents: {len(all_files)}")
     print(f"  • Chunks: {len(all_chunks)}")
-    print(f"  • Cache file: {cache_file}")
-    print(f"  • Size: {cache_file.stat().st_size / (1024 * 1024):.2f} MB")
+    print(f"  • Cache dir: {cache_dir}")
+    print(f"  • Size: {vector_store.cache_size('medical_docs') / (1024 * 1024):.2f} MB")
     
     print("\n🚀 Deployment Ready!")
     print("  1. Include 'vector_cache/' folder in deployment")
@@ -83,4 +92,13 @@ def build_cache():
     return True
 
 if __name__ == "__main__":
-    build_cache()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the TF-IDF vector cache for deployment")
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="DIR",
+                        help=f"Record time, CPU samples and peak memory per stage "
+                             f"(report + flamegraph stacks in DIR, default {PROFILE_DIR}/<timestamp>)")
+    args = parser.parse_args()
+    with profiled(args.profile or None, enabled=args.profile is not None):
+        try:
+            build_cache()
+        except KeyboardInterrupt:
+            print(f"\n⏸️  Interrupted. Extracted pages are saved in {CHECKPOINT_DIR}; re-run to resume.")
\ No newline at end of file
@@ -0,0 +1,51 @@
+import sys
+import zlib
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# Tests import the app's modules the way app.py does (utils.* from the project root)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+CHUNKS = [
+    "Metformin is the first-line therapy for type 2 diabetes.",
+    "The usual starting dose of metformin is 500 mg twice daily.",
+    "Hypertension is diagnosed when blood pressure stays above 140/90.",
+    "ACE inhibitors are recommended for hypertension with diabetes.",
+    "Amoxicillin treats community-acquired pneumonia in adults.",
+    "Insulin is added when HbA1c stays above target on oral therapy.",
+]
+
+class HashEmbeddings:
+    """Deterministic bag-of-words embeddings; no model download"""
+    dim = 32
+
+    def embed_query(self, text):
+        from utils.bm25_index import tokenize
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            vec[zlib.crc32(token.encode()) % self.dim] += 1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+@pytest.fixture
+def tiny_store(tmp_path):
+    """index.faiss + docstore.sqlite + BM25 files for CHUNKS; returns (vs_dir, embeddings)."""
+    faiss = pytest.importorskip("faiss")
+    from utils.bm25_index import BM25Index
+    from utils.mmap_store import Document, export_docstore
+
+    embeddings = HashEmbeddings()
+    index = faiss.IndexFlatL2(HashEmbeddings.dim)
+    index.add(np.asarray(embeddings.embed_documents(CHUNKS), dtype=np.float32))
+    faiss.write_index(index, str(tmp_path / "index.faiss"))
+    docs = {str(i): Document(text, {"source": "guide.pdf", "page": i}) for i, text in enumerate(CHUNKS)}
+    export_docstore(SimpleNamespace(index=index, index_to_docstore_id={i: str(i) for i in range(len(CHUNKS))},
+                                    docstore=SimpleNamespace(search=docs.get)), tmp_path)
+    BM25Index.build(CHUNKS).save(tmp_path)
+    return tmp_path, embeddings
@@ -0,0 +1,87 @@
+import shutil
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from utils.ann_index import (build_index, flat_vectors, load_ann_index, recall_report, set_search_params,
+                             write_ann_index)
+from utils.bm25_index import BM25Index, flat_stamp
+
+def _write_hnsw(vs_dir):
+    flat = faiss.read_index(str(vs_dir / "index.faiss"))
+    write_ann_index(build_index(flat_vectors(flat), "hnsw"), vs_dir, "hnsw", {"flat_stamp": flat_stamp(vs_dir)})
+    return flat
+
+def test_copied_vectorstore_keeps_its_derived_indexes(tiny_store, tmp_path_factory):
+    vs_dir, _ = tiny_store
+    _write_hnsw(vs_dir)
+    BM25Index.load(vs_dir).save(vs_dir)  # re-stamp with the current index.faiss
+    clone = tmp_path_factory.mktemp("copy") / "vectorstore"
+    shutil.copytree(vs_dir, clone, copy_function=shutil.copy)  # fresh mtimes, like a git checkout
+    assert load_ann_index(clone, "hnsw", expected_ntotal=6) is not None
+    assert BM25Index.is_current(clone, expected_n_docs=6)
+
+def test_rewritten_flat_index_makes_the_ann_index_stale(tiny_store, capsys):
+    vs_dir, _ = tiny_store
+    flat = _write_hnsw(vs_dir)
+    rebuilt = faiss.IndexFlatL2(flat.d)
+    rebuilt.add(np.ones((flat.ntotal, flat.d), dtype=np.float32))  # same count, other vectors
+    faiss.write_index(rebuilt, str(vs_dir / "index.faiss"))
+    assert load_ann_index(vs_dir, "hnsw", expected_ntotal=6) is None
+    assert "stale" in capsys.readouterr().out
+
+@pytest.fixture
+def random_store(tmp_path):
+    """index.faiss over 2000 random 32-d vectors; returns (vs_dir, vectors)."""
+    vectors = np.random.default_rng(0).standard_normal((2000, 32)).astype(np.float32)
+    flat = faiss.IndexFlatL2(32)
+    flat.add(vectors)
+    faiss.write_index(flat, str(tmp_path / "index.faiss"))
+    return tmp_path, vectors
+
+@pytest.mark.parametrize("index_type, cls", [("ivf", "IndexIVFFlat"), ("hnsw", "IndexHNSWFlat"),
+                                             ("ivfpq", "IndexIVFPQ")])
+def test_build_index_keeps_the_flat_order(random_store, index_type, cls):
+    _, vectors = random_store
+    index = build_index(vectors, index_type, nlist=16)
+    assert type(index).__name__ == cls and index.ntotal == len(vectors)
+    set_search_params(index, nprobe=16, ef_search=128)
+    _, ids = index.search(vectors[:50], 1)
+    assert (ids[:, 0] == np.arange(50)).mean() >= 0.9  # positions map to the same docstore rows
+
+@pytest.mark.parametrize("mmap", [False, True])
+@pytest.mark.parametrize("index_type", ["ivf", "hnsw", "ivfpq"])
+def test_saved_ann_index_loads_and_searches_the_same(random_store, index_type, mmap):
+    vs_dir, vectors = random_store
+    built = build_index(vectors, index_type, nlist=16)
+    write_ann_index(built, vs_dir, index_type, {"flat_stamp": flat_stamp(vs_dir)})
+    loaded = load_ann_index(vs_dir, index_type, expected_ntotal=len(vectors), mmap=mmap)
+    assert loaded is not None and loaded.ntotal == len(vectors)
+    set_search_params(built, nprobe=4, ef_search=64)
+    set_search_params(loaded, nprobe=4, ef_search=64)
+    assert np.array_equal(loaded.search(vectors[:20], 5)[1], built.search(vectors[:20], 5)[1])
+
+def test_ann_index_for_another_vector_count_is_stale(random_store, capsys):
+    vs_dir, vectors = random_store
+    write_ann_index(build_index(vectors, "ivf", nlist=16), vs_dir, "ivf", {"flat_stamp": flat_stamp(vs_dir)})
+    assert load_ann_index(vs_dir, "ivf", expected_ntotal=len(vectors) + 1) is None
+    assert load_ann_index(vs_dir, "hnsw", expected_ntotal=len(vectors)) is None  # never built
+    out = capsys.readouterr().out
+    assert "ivf index is stale" in out and "No hnsw index" in out
+
+def test_recall_report_sweeps_the_search_knob(random_store):
+    _, vectors = random_store
+    flat = faiss.IndexFlatL2(32)
+    flat.add(vectors)
+    queries = vectors[:40] + 0.01
+
+    ivf_rows = recall_report(flat, build_index(vectors, "ivf", nlist=16), queries, k=5)
+    assert [(r["knob"], r["value"]) for r in ivf_rows] == [("nprobe", 1), ("nprobe", 4), ("nprobe", 16)]
+    assert ivf_rows[-1]["recall"] == 1.0  # every list scanned: exact
+    assert ivf_rows[0]["recall"] <= ivf_rows[-1]["recall"]
+
+    hnsw_rows = recall_report(flat, build_index(vectors, "hnsw"), queries, k=5, sweep=[16, 256])
+    assert [r["value"] for r in hnsw_rows] == [16, 256] and hnsw_rows[-1]["recall"] >= 0.95
+    assert all(r["ann_ms"] > 0 and r["flat_ms"] > 0 for r in hnsw_rows)
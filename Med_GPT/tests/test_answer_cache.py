@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils.answer_cache import AnswerCache, normalize_query, vectorstore_fingerprint
+
+def _vec(*xs):
+    return np.asarray(xs, dtype=np.float32)
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnswerCache(tmp_path / "answers.sqlite", similarity_threshold=0.9)
+
+def test_exact_match_ignores_case_and_punctuation(cache):
+    cache.put("What is the metformin dose?", "500 mg", embedding=_vec(1, 0, 0))
+    assert normalize_query("  what is the METFORMIN dose ") == "what is the metformin dose"
+    assert cache.get_exact("what is the metformin dose")["answer"] == "500 mg"
+
+def test_similar_skips_an_expired_best_match(cache):
+    cache.put("best", "expired answer", embedding=_vec(1, 0, 0))
+    cache.put("runner-up", "valid answer", embedding=_vec(0.95, 0.3, 0))
+    cache._conn.execute("UPDATE entries SET created = ? WHERE key = 'best'", (time.time() - 2 * cache.ttl_s,))
+    hit = cache.get_similar(_vec(1, 0, 0))
+    assert hit["answer"] == "valid answer" and hit["score"] >= 0.9
+
+def test_similar_below_threshold_is_a_miss(cache):
+    cache.put("q", "a", embedding=_vec(1, 0, 0))
+    assert cache.get_similar(_vec(0, 1, 0)) is None
+    assert cache.stats()["miss"] == 1
+
+def test_put_updates_the_matrix_without_reloading(cache, monkeypatch):
+    monkeypatch.setattr(cache, "_load_matrix", lambda: pytest.fail("matrix reloaded from SQLite"))
+    for i in range(40):
+        vec = np.zeros(40, dtype=np.float32)
+        vec[i] = 1.0
+        cache.put(f"question {i}", f"answer {i}", embedding=vec)
+    probe = np.zeros(40, dtype=np.float32)
+    probe[33] = 1.0
+    assert cache.get_similar(probe)["answer"] == "answer 33"
+    cache.put("question 33", "answer 33b", embedding=_vec(*probe))  # replaced in place
+    assert cache.get_similar(probe)["answer"] == "answer 33b"
+
+def test_evicted_entries_leave_the_matrix(tmp_path):
+    cache = AnswerCache(tmp_path / "answers.sqlite", max_entries=2, similarity_threshold=0.9)
+    for i, vec in enumerate([_vec(1, 0, 0), _vec(0, 1, 0), _vec(0, 0, 1)]):
+        cache.put(f"q{i}", f"a{i}", embedding=vec)
+        time.sleep(0.01)  # distinct last_used
+    assert cache.get_similar(_vec(1, 0, 0)) is None
+    assert cache.get_similar(_vec(0, 0, 1))["answer"] == "a2"
+    assert cache.stats()["entries"] == 2
+    reopened = AnswerCache(tmp_path / "answers.sqlite", max_entries=2, similarity_threshold=0.9)
+    assert reopened.get_similar(_vec(0, 1, 0))["answer"] == "a1"
+
+def test_fingerprint_ignores_files_the_app_derives(tmp_path):
+    (tmp_path / "index.faiss").write_bytes(b"index")
+    (tmp_path / "manifest.json").write_text("{}")
+    before = vectorstore_fingerprint(tmp_path)
+    (tmp_path / "docstore.sqlite").write_bytes(b"exported later")
+    (tmp_path / "bm25.json").write_text("{}")
+    assert vectorstore_fingerprint(tmp_path) == before
+    (tmp_path / "index.faiss").write_bytes(b"rebuilt index")
+    os.utime(tmp_path / "index.faiss", ns=(1, 1))
+    assert vectorstore_fingerprint(tmp_path) != before
+
+def test_concurrent_lookups_count_every_hit(cache):
+    cache.put("q", "a", embedding=_vec(1, 0, 0))
+
+    def lookups():
+        for _ in range(200):
+            cache.get_exact("q")
+            cache.get_similar(_vec(1, 0, 0))
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.stats()["exact"] == 1600 and cache.stats()["semantic"] == 1600
@@ -0,0 +1,16 @@
+from benchmark_retrieval import run_benchmark
+from utils.bm25_index import BM25Index
+from utils.mmap_store import MmapVectorStore
+from utils.retriever import CachedRetriever
+
+def test_benchmark_times_the_hybrid_retriever_without_warmup_hits(tiny_store):
+    vs_dir, embeddings = tiny_store
+    vs = MmapVectorStore(vs_dir, embeddings)
+    retriever = CachedRetriever(vs, k=2, bm25=BM25Index.load(vs_dir), mode="hybrid", candidates=4)
+    queries = [("1", "metformin dose"), ("2", "amoxicillin pneumonia"), ("3", "hypertension treatment")]
+
+    per_query, summary = run_benchmark(retriever, queries, k=2, warmup=2)
+
+    assert summary["queries"] == 3
+    assert [r["top_page"] for r in per_query[:2]] == [1, 4]
+    assert retriever.stats()["result_hits"] == 0  # warm-up results were not reused
@@ -0,0 +1,49 @@
+import numpy as np
+
+from utils.checkpoint import IngestCheckpoint
+
+SETTINGS = {"embed_model": "test", "chunk_size": 500}
+
+def _vec(seed, dim=4):
+    return np.full(dim, seed, dtype=np.float32)
+
+def test_vectors_round_trip(tmp_path):
+    ckpt = IngestCheckpoint(tmp_path, settings=SETTINGS)
+    ckpt.append_vectors("k", ["a", "b"], [_vec(1), _vec(2)])
+    saved = IngestCheckpoint(tmp_path, settings=SETTINGS).load_vectors("k")
+    assert list(saved) == ["a", "b"]
+    assert np.array_equal(saved["b"], _vec(2))
+
+def test_crash_between_vector_and_id_writes_keeps_rows_aligned(tmp_path):
+    ckpt = IngestCheckpoint(tmp_path, settings=SETTINGS)
+    ckpt.append_vectors("k", ["a"], [_vec(1)])
+    # Crash after the .f32 write of the next batch, before its ids were written
+    with open(tmp_path / "vec_k.f32", "ab") as f:
+        np.asarray([_vec(99), _vec(98)], dtype=np.float32).tofile(f)
+
+    resumed = IngestCheckpoint(tmp_path, settings=SETTINGS)
+    resumed.append_vectors("k", ["b", "c"], [_vec(2), _vec(3)])
+    saved = resumed.load_vectors("k")
+    assert list(saved) == ["a", "b", "c"]
+    for cid, seed in (("a", 1), ("b", 2), ("c", 3)):
+        assert np.array_equal(saved[cid], _vec(seed)), cid
+
+def test_torn_id_line_is_dropped(tmp_path):
+    ckpt = IngestCheckpoint(tmp_path, settings=SETTINGS)
+    ckpt.append_vectors("k", ["a", "b"], [_vec(1), _vec(2)])
+    with open(tmp_path / "vec_k.ids", "a", encoding="utf-8") as f:
+        f.write("half-writ")
+
+    resumed = IngestCheckpoint(tmp_path, settings=SETTINGS)
+    resumed.append_vectors("k", ["c"], [_vec(3)])
+    saved = resumed.load_vectors("k")
+    assert list(saved) == ["a", "b", "c"]
+    assert np.array_equal(saved["c"], _vec(3))
+
+def test_pages_resume_after_torn_line(tmp_path):
+    ckpt = IngestCheckpoint(tmp_path, settings=SETTINGS)
+    ckpt.append_pages("k", [{"page": 0, "text": "one"}])
+    with open(tmp_path / "pages_k.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"page": 1, "te')
+    ckpt.append_pages("k", [{"page": 1, "text": "two"}])
+    assert [p["text"] for p in ckpt.load_pages("k")] == ["one", "two"]
@@ -0,0 +1,30 @@
+from utils.context_builder import ContextBuilder, count_tokens
+from utils.mmap_store import Document
+
+def _doc(text, page=0):
+    return Document(text, {"source": "guide.pdf", "page": page})
+
+def test_best_matching_sentence_wins_a_tight_budget():
+    docs = [_doc("Metformin is first-line therapy for diabetes. Hypertension needs ACE inhibitors."),
+            _doc("The metformin dose starts at 500 mg daily. Amoxicillin treats pneumonia.", page=1)]
+    packed = ContextBuilder(token_budget=15).build("metformin dose", docs)
+    assert packed["text"] == "[guide.pdf, page 2]\nThe metformin dose starts at 500 mg daily."
+    assert packed["sources"] == [docs[1]]
+
+def test_unmatched_sentences_fill_the_remaining_budget_in_rank_order():
+    docs = [_doc("Metformin lowers glucose. Lactic acidosis is a rare but serious complication.")]
+    packed = ContextBuilder(token_budget=200).build("metformin", docs)
+    assert "Lactic acidosis" in packed["text"]
+    assert packed["sentences"] == 2
+
+def test_chunk_of_short_fragments_falls_back_to_the_top_chunk():
+    docs = [_doc("Dose: 5 mg.\n- Max 10 mg.\n- Renal: avoid."), _doc("Other chunk text.", page=3)]
+    packed = ContextBuilder(token_budget=200).build("dose", docs)
+    assert packed["text"] == "[guide.pdf, page 1]\nDose: 5 mg. - Max 10 mg. - Renal: avoid."
+    assert packed["sources"] == [docs[0]]
+
+def test_top_chunk_fallback_is_cut_to_the_budget():
+    long_sentence = "Metformin " + "and " * 300 + "more."
+    packed = ContextBuilder(token_budget=40).build("metformin", [_doc(long_sentence)])
+    assert packed["text"].startswith("[guide.pdf, page 1]\nMetformin and")
+    assert count_tokens(packed["text"]) <= 41
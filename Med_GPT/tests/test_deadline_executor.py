@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from utils.deadline_executor import CancelToken, DeadlineExceeded, DeadlineExecutor, Rejected
+from utils.tracing import metrics_text
+
+@pytest.fixture
+def executor():
+    ex = DeadlineExecutor(max_workers=1, max_queue=0, name="test")
+    yield ex
+    ex.shutdown()
+
+def test_rejects_beyond_capacity(executor):
+    release = threading.Event()
+    future, _ = executor.submit(release.wait)
+    with pytest.raises(Rejected):
+        executor.submit(lambda: None)
+    release.set()
+    future.result(timeout=1)
+    assert executor.metrics()["rejected"] == 1
+
+def test_timed_out_task_keeps_its_slot_until_the_worker_returns(executor):
+    release = threading.Event()
+    result, err = executor.run(release.wait, 5, timeout_s=0.05)
+    assert result is None and isinstance(err, DeadlineExceeded)
+    m = executor.metrics()
+    assert m["timed_out"] == 1 and m["running"] == 1 and m["overdue"] == 1
+    _, err = executor.run(lambda: None, timeout_s=1)
+    assert isinstance(err, Rejected)  # the slot is still taken
+
+    release.set()
+    deadline = time.monotonic() + 2
+    while executor.metrics()["running"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    m = executor.metrics()
+    assert m["running"] == 0 and m["completed"] == 0 and m["timed_out"] == 1
+    assert executor.run(lambda: 42, timeout_s=1) == (42, None)
+
+def test_stream_hands_over_items_in_order(executor):
+    def gen(n, cancel):
+        for i in range(n):
+            yield i
+
+    stream, token = executor.stream(gen, 3, timeout_s=1)
+    assert list(stream) == [0, 1, 2]
+    assert not token.timed_out
+    assert executor.metrics()["completed"] == 1
+
+def test_stream_stops_at_the_deadline(executor):
+    def gen(cancel: CancelToken):
+        yield "first"
+        while not cancel.cancelled:
+            time.sleep(0.01)
+
+    stream, token = executor.stream(gen, timeout_s=0.1)
+    assert list(stream) == ["first"]
+    assert token.timed_out
+
+def test_stream_expired_in_queue_never_runs():
+    busy = DeadlineExecutor(max_workers=1, max_queue=1, name="test-queue")
+    release = threading.Event()
+    started = []
+
+    def gen(cancel):
+        started.append(True)
+        yield "late"
+
+    try:
+        busy.submit(release.wait)
+        stream, token = busy.stream(gen, timeout_s=0.05)
+        time.sleep(0.1)
+        release.set()
+        with pytest.raises(DeadlineExceeded):
+            list(stream)
+        assert token.timed_out and not started
+    finally:
+        release.set()
+        busy.shutdown()
+
+def test_admission_outcomes_reach_the_metrics_endpoint():
+    ex = DeadlineExecutor(max_workers=1, max_queue=0, name="metrics-test")
+    try:
+        release = threading.Event()
+        future, _ = ex.submit(release.wait, 5)
+        with pytest.raises(Rejected):
+            ex.submit(lambda: None)
+        release.set()
+        future.result(timeout=1)
+        text = metrics_text()
+    finally:
+        ex.shutdown()
+    assert 'medgpt_executor_tasks_total{executor="metrics-test",outcome="submitted"} 1' in text
+    assert 'medgpt_executor_tasks_total{executor="metrics-test",outcome="rejected"} 1' in text
+    assert 'medgpt_executor_tasks_total{executor="metrics-test",outcome="completed"} 1' in text
+    assert 'medgpt_executor_queue_wait_seconds_count{executor="metrics-test"} 1' in text
@@ -0,0 +1,13 @@
+from utils import embeddings
+from utils.embeddings import auto_batch_size
+
+def test_batch_size_follows_chunk_length():
+    assert auto_batch_size(["What is the metformin dose?"]) == 256
+    assert auto_batch_size(["x" * 500] * 50) == 32
+    assert auto_batch_size(["x" * 2000] * 50) == 16  # truncated to MAX_SEQ_TOKENS
+
+def test_batch_size_is_capped_by_free_memory(monkeypatch):
+    monkeypatch.setattr(embeddings, "available_memory_bytes", lambda: 256 << 20)
+    chunks = ["x" * 500] * 50
+    assert auto_batch_size(chunks) == 16
+    assert auto_batch_size(chunks, workers=4) == 8  # never below min_size
@@ -0,0 +1,89 @@
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils import llm_handler
+from utils.deadline_executor import CancelToken
+from utils.llm_handler import LLMHandler
+from utils.rag_pipeline import RAGPipeline
+
+@pytest.fixture
+def handler(monkeypatch):
+    # Nothing listens here, so the handler starts on the fallback backend
+    monkeypatch.setenv("OLLAMA_BASE_URL", "http://127.0.0.1:9")
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    h = LLMHandler(max_retries=0)
+    yield h
+    h.close()
+
+def test_idle_rewarm_waits_off_the_event_loop(handler, monkeypatch):
+    handler.backend = "ollama"
+    handler._keep_alive_s = 1.0
+    handler._last_used = time.monotonic() - 60  # the model has likely been unloaded
+    monkeypatch.setattr(handler, "start_warmup", handler.warm.clear)
+
+    async def main():
+        ticks = 0
+        waiting = asyncio.create_task(handler._aensure_warm())
+        while not waiting.done():
+            ticks += 1
+            if ticks == 3:
+                handler.warm.set()  # the warm-up finishes while the loop keeps running
+            await asyncio.sleep(0.05)
+        return ticks
+
+    assert asyncio.run(main()) >= 3
+
+def test_keep_alive_zero_does_not_rewarm(handler, monkeypatch):
+    handler.backend = "ollama"
+    handler._keep_alive_s = llm_handler.keep_alive_seconds("0")
+    handler._last_used = time.monotonic() - 60
+    monkeypatch.setattr(handler, "start_warmup", lambda: pytest.fail("re-warmed with keep_alive 0"))
+    handler._ensure_warm()
+
+def test_cancelled_stream_sends_no_request(handler, monkeypatch):
+    handler.backend = "ollama"
+    monkeypatch.setattr(handler.session, "post", lambda *a, **kw: pytest.fail("request sent after cancel"))
+    token = CancelToken()
+    token.cancel()
+    stats = {}
+    assert list(handler.stream_answer("q", "context", stats=stats, cancel=token)) == []
+    assert stats["cancelled"]
+
+def _claude(handler, monkeypatch, anthropic_module):
+    handler.backend = "claude"
+    handler.api_key = "test-key"
+    monkeypatch.setitem(sys.modules, "anthropic", anthropic_module)
+    return handler
+
+def _fake_anthropic(text):
+    class Messages:
+        def create(self, **kwargs):
+            return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)])
+
+    return SimpleNamespace(Anthropic=lambda api_key: SimpleNamespace(messages=Messages()))
+
+def test_claude_failure_is_flagged_and_never_cached(handler, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    _claude(handler, monkeypatch, None)  # the import fails like a missing SDK
+    stats = {}
+    answer = "".join(handler.stream_answer("What is the dose?", "Metformin dose is 500 mg.", stats=stats))
+    assert answer and stats["fallback"] and stats["error"]
+
+    pipeline = RAGPipeline(handler=handler)
+    pipeline.remember("What is the dose?", answer, [1.0, 0.0], None, stats)
+    assert pipeline.answer_cache.get_exact("What is the dose?") is None
+
+def test_claude_answer_is_cached(handler, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    _claude(handler, monkeypatch, _fake_anthropic("Start with 500 mg daily."))
+    stats = {}
+    answer = handler.generate_answer("What is the dose?", "Metformin dose is 500 mg.", stats=stats)
+    assert answer == "Start with 500 mg daily." and not stats.get("fallback")
+
+    pipeline = RAGPipeline(handler=handler)
+    pipeline.remember("What is the dose?", answer, [1.0, 0.0], None, stats)
+    assert pipeline.answer_cache.get_exact("What is the dose?")["answer"] == answer
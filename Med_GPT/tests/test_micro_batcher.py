@@ -0,0 +1,66 @@
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import CHUNKS
+from utils.micro_batcher import MicroBatcher
+from utils.mmap_store import MmapVectorStore
+from utils.retriever import CachedRetriever
+
+QUERIES = ["metformin dose", "hypertension diabetes", "pneumonia antibiotic", "insulin target",
+           "blood pressure", "first-line therapy"]
+
+def _concurrently(fn, args):
+    results = [None] * len(args)
+    start = threading.Barrier(len(args))
+
+    def call(i):
+        start.wait()
+        results[i] = fn(*args[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(args))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+    return results
+
+def test_concurrent_lookups_are_coalesced_with_unbatched_results(tiny_store):
+    vs_dir, embeddings = tiny_store
+    batched = CachedRetriever(MmapVectorStore(vs_dir, embeddings), k=3, batch_window_ms=100)
+    plain = CachedRetriever(MmapVectorStore(vs_dir, embeddings), k=3)
+
+    docs = _concurrently(batched.get_relevant_documents, [(q,) for q in QUERIES])
+
+    for query, got in zip(QUERIES, docs):
+        assert [d.page_content for d in got] == [d.page_content for d in plain.get_relevant_documents(query)]
+    stats = batched.batcher.stats
+    assert stats["queries"] == len(QUERIES) and stats["batches"] < len(QUERIES)
+
+def test_each_caller_gets_its_own_k_and_embedding(tiny_store):
+    _, embeddings = tiny_store
+    index = MmapVectorStore(tiny_store[0], embeddings).index
+    batcher = MicroBatcher(lambda: index, embeddings.embed_documents, window_ms=100)
+
+    results = _concurrently(batcher.submit, [("metformin dose", 1), ("metformin dose", 4), ("insulin", 0)])
+
+    (v1, hits1), (v4, hits4), (v0, hits0) = results
+    assert hits1 == hits4[:1] and len(hits4) == 4 and hits0 == []
+    assert np.allclose(v0, embeddings.embed_query("insulin"))
+    assert all(0 <= p < len(CHUNKS) for p in hits4)
+
+def test_batch_failure_reaches_every_caller():
+    def broken(queries):
+        raise RuntimeError("encoder crashed")
+
+    batcher = MicroBatcher(lambda: None, broken, window_ms=50)
+    errors = []
+
+    def call(q):
+        with pytest.raises(RuntimeError, match="encoder crashed"):
+            batcher.embed(q)
+        errors.append(q)
+
+    _concurrently(call, [("a",), ("b",), ("c",)])
+    assert sorted(errors) == ["a", "b", "c"]
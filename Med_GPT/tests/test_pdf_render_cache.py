@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+pymupdf = pytest.importorskip("pymupdf")
+
+from utils.pdf_render_cache import PageRenderCache
+
+@pytest.fixture
+def pdf(tmp_path):
+    doc = pymupdf.open()
+    for i in range(3):
+        doc.new_page().insert_text((72, 72), f"Page {i}: metformin is first-line therapy.")
+    fp = tmp_path / "guide.pdf"
+    doc.save(str(fp))
+    return str(fp)
+
+@pytest.fixture
+def make_cache(tmp_path):
+    caches = []
+
+    def make(**kwargs):
+        cache = PageRenderCache(tmp_path / "pages", zoom=0.5, **kwargs)
+        caches.append(cache)
+        return cache
+
+    yield make
+    for cache in caches:
+        cache.close()
+
+def test_memory_tier_evicts_least_recently_used_by_bytes(pdf, make_cache):
+    sizes = [len(make_cache().get_png(pdf, i)) for i in range(3)]
+    cache = make_cache(max_memory_bytes=sizes[0] + sizes[1])
+    cache.get_png(pdf, 0)
+    cache.get_png(pdf, 1)
+    cache.get_png(pdf, 0)  # page 1 is now the least recently used
+    cache.get_png(pdf, 2)
+    assert cache._memory_bytes <= cache.max_memory_bytes
+    assert cache._from_memory(cache.key(pdf, 1)) is None
+    assert cache._from_memory(cache.key(pdf, 2)) is not None
+
+def test_disk_tier_evicts_the_oldest_mtime_first(pdf, make_cache):
+    cache = make_cache()
+    files = []
+    for i, mtime in enumerate((1000, 2000, 3000)):
+        cache.get_png(pdf, i)
+        fp = cache.cache_dir / f"{cache.key(pdf, i)}.png"
+        os.utime(fp, (mtime, mtime))
+        files.append(fp)
+
+    fresh = make_cache()  # empty memory tier: the next read comes from disk and refreshes the mtime
+    fresh.get_png(pdf, 0)
+    assert fresh.stats["disk_hits"] == 1 and fresh.stats["renders"] == 0
+    fresh.max_disk_bytes = sum(fp.stat().st_size for fp in files) - 1
+    fresh._evict_disk()
+    assert [fp.exists() for fp in files] == [True, False, True]
+
+def test_prefetched_page_is_a_memory_hit(pdf, make_cache):
+    cache = make_cache()
+    cache.prefetch([(pdf, 1, "metformin")])
+    cache._prefetcher.submit(lambda: None).result(timeout=10)  # single worker: runs after the prefetch
+    cache.get_png(pdf, 1, "metformin")
+    assert cache.stats["renders"] == 1 and cache.stats["memory_hits"] == 1
+
+def test_highlights_are_removed_from_the_pooled_document(pdf, make_cache):
+    cache = make_cache()
+    highlighted = cache.get_png(pdf, 0, "metformin")
+    page = cache._docs.get(pdf)[0]
+    assert list(page.annots()) == []
+    assert cache.get_png(pdf, 0) != highlighted  # the plain render shows no highlight
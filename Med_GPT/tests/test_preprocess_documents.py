@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from conftest import HashEmbeddings
+from utils import preprocess_documents as pre
+from utils.embeddings import register_langchain
+
+class FakeBackendEmbeddings(HashEmbeddings):
+    def __init__(self, backend="torch", quantization="fp32"):
+        self.backend = backend
+        self.quantization = quantization
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    register_langchain(FakeBackendEmbeddings)
+    docs = tmp_path / "documents"
+    docs.mkdir()
+    (docs / "a.txt").write_text("Metformin is the first-line therapy for type 2 diabetes.", encoding="utf-8")
+    (docs / "b.txt").write_text("Amoxicillin treats community-acquired pneumonia.", encoding="utf-8")
+    return docs, tmp_path / "vectorstore"
+
+def _sync(corpus, monkeypatch, backend, quantization):
+    docs, vs_dir = corpus
+    monkeypatch.setattr(pre, "make_embeddings",
+                        lambda *a, **kw: FakeBackendEmbeddings(backend, quantization))
+    return pre.update_vectorstore(str(docs), str(vs_dir), workers=1, use_checkpoint=False)
+
+def test_manifest_records_the_embedding_backend(corpus, monkeypatch):
+    _sync(corpus, monkeypatch, "int8", "dynamic-qint8")
+    manifest = pre.load_manifest(corpus[1])
+    assert manifest["embed_backend"] == "int8" and manifest["embed_quantization"] == "dynamic-qint8"
+
+def test_unchanged_backend_is_incremental(corpus, monkeypatch, capsys):
+    _sync(corpus, monkeypatch, "torch", "fp32")
+    capsys.readouterr()
+    _sync(corpus, monkeypatch, "torch", "fp32")
+    assert "0 new • 0 changed • 0 deleted • 2 unchanged" in capsys.readouterr().out
+
+def test_backend_change_forces_a_full_rebuild(corpus, monkeypatch, capsys):
+    _sync(corpus, monkeypatch, "torch", "fp32")
+    capsys.readouterr()
+    vs = _sync(corpus, monkeypatch, "onnx", "onnx/model_qint8_avx2.onnx")
+    out = capsys.readouterr().out
+    assert "Embedding settings changed" in out and "2 new" in out
+    assert vs.index.ntotal == 2  # old vectors are not mixed in
+
+def test_manifest_without_backend_counts_as_fp32_torch():
+    settings = {"embed_model": pre.EMBED_MODEL, "embed_backend": "torch", "embed_quantization": "fp32"}
+    assert pre.manifest_matches({"embed_model": pre.EMBED_MODEL, "files": {}}, settings)
+    assert not pre.manifest_matches({"embed_model": pre.EMBED_MODEL, "files": {}},
+                                    {**settings, "embed_backend": "int8"})
+
+class RecordingPool(HashEmbeddings):
+    """EmbeddingPool stand-in: submit() returns at once, gather() does the encoding"""
+
+    def __init__(self):
+        self.events = []
+
+    def submit(self, texts):
+        self.events.append(("submit", texts[0].split()[0]))
+        return texts
+
+    def gather(self, texts):
+        self.events.append(("gather", texts[0].split()[0]))
+        return np.asarray(self.embed_documents(texts), dtype=np.float32)
+
+def test_pool_encodes_the_next_batch_while_the_previous_is_indexed(corpus):
+    docs, _ = corpus
+    (docs / "c.txt").write_text("Insulin is added when HbA1c stays high.", encoding="utf-8")
+    files = [(fp, pre.file_sha256(fp)) for fp in sorted(docs.iterdir())]
+    pool, done = RecordingPool(), []
+    vs, added, failed = pre.run_ingest_pipeline(files, FakeBackendEmbeddings(), workers=0, batch_size=1,
+                                                encoder=pool, on_file_done=lambda name, *_: done.append(name))
+
+    # Batch 2 is submitted before batch 1 is collected and indexed
+    assert pool.events == [("submit", "Metformin"), ("submit", "Amoxicillin"), ("gather", "Metformin"),
+                           ("submit", "Insulin"), ("gather", "Amoxicillin"), ("gather", "Insulin")]
+    assert added == 3 and not failed and sorted(done) == ["a.txt", "b.txt", "c.txt"]
+    texts = [vs.docstore.search(vs.index_to_docstore_id[i]).page_content for i in range(3)]
+    expected = np.asarray(HashEmbeddings().embed_documents(texts), dtype=np.float32)
+    assert np.allclose(vs.index.reconstruct_n(0, 3), expected)
+
+@pytest.fixture
+def guide_pdf(tmp_path):
+    pymupdf = pytest.importorskip("pymupdf")
+    doc = pymupdf.open()
+    for i in range(3):
+        doc.new_page().insert_text((72, 72), f"Page {i}: metformin is first-line therapy.")
+    doc.set_metadata({"title": "Diabetes guide", "author": "WHO"})
+    fp = tmp_path / "guide.pdf"
+    doc.save(str(fp))
+    return fp
+
+def test_checkpointed_pdf_pages_match_pypdfloader(guide_pdf, tmp_path):
+    expected = pre.load_file(guide_pdf)
+    ckpt = pre.IngestCheckpoint(tmp_path / "ckpt")
+    pages = pre.load_pdf_pages(guide_pdf, ckpt, "guide")
+    assert [(d.page_content, d.metadata) for d in pages] == [(d.page_content, d.metadata) for d in expected]
+    assert pages[0].metadata["source"] == "guide.pdf" and pages[2].metadata["page"] == 2
+
+    # A resumed run reads the saved pages back and must produce the same documents
+    resumed = pre.load_pdf_pages(guide_pdf, pre.IngestCheckpoint(tmp_path / "ckpt"), "guide")
+    assert [(d.page_content, d.metadata) for d in resumed] == [(d.page_content, d.metadata) for d in expected]
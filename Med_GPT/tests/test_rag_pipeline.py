@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import HashEmbeddings
+from utils import rag_pipeline
+from utils.deadline_executor import CancelToken, DeadlineExceeded, DeadlineExecutor
+from utils.rag_pipeline import RAGPipeline
+from utils.tracing import TRACES, start_trace
+
+class FakeHandler:
+    backend = "ollama"
+    ollama_model = "test-model"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def agenerate_answer(self, question, context, stats=None):
+        self.calls += 1
+        stats["total_s"] = 0.01
+        return "Start metformin at 500 mg twice daily."
+
+    async def aclose(self):
+        pass
+
+@pytest.fixture
+def pipeline(tiny_store, monkeypatch):
+    vs_dir, _ = tiny_store
+    monkeypatch.chdir(vs_dir)  # answer cache and trace log go under tmp_path
+    monkeypatch.setattr(rag_pipeline, "make_embeddings", lambda *a, **kw: HashEmbeddings())
+    monkeypatch.setattr(rag_pipeline, "INDEX_TYPE", "flat")
+    p = RAGPipeline(vs_dir, handler=FakeHandler())
+    p.load()[0].embeddings.wait()
+    return p
+
+def test_aanswer_generates_once_then_replays_from_cache(pipeline):
+    first = asyncio.run(pipeline.aanswer("metformin dose"))
+    assert first["cached"] is None and first["answer"].startswith("Start metformin")
+    assert first["source"]["metadata"]["page"] == 1
+    assert first["context_tokens"] > 0
+    assert {"cache_lookup", "retrieve", "context_build"} <= set(first["timings"])
+
+    second = asyncio.run(pipeline.aanswer("metformin dose"))
+    assert second["cached"] == "exact" and second["answer"] == first["answer"]
+    assert pipeline.handler.calls == 1
+
+def test_prepare_then_finish_records_a_timeout_without_caching(pipeline):
+    trace = start_trace("query")
+    with trace.activate():
+        prep = pipeline.prepare("metformin dose")
+    assert prep["cached"] is None and prep["packed"]["tokens"] > 0
+    before = TRACES.value("query", "timeout")
+
+    result = pipeline.finish("metformin dose", prep, trace, "Start metf", {"timed_out": True})
+    assert result["answer"] == "Start metf"
+    assert TRACES.value("query", "timeout") == before + 1
+    assert pipeline.answer_cache.get_exact("metformin dose") is None
+
+def test_retrieval_deadline_frees_the_worker_while_the_model_loads(tiny_store, monkeypatch):
+    vs_dir, _ = tiny_store
+    monkeypatch.chdir(vs_dir)
+    loaded = threading.Event()
+
+    def slow_model(*args, **kwargs):
+        loaded.wait(10)
+        return HashEmbeddings()
+
+    monkeypatch.setattr(rag_pipeline, "make_embeddings", slow_model)
+    monkeypatch.setattr(rag_pipeline, "INDEX_TYPE", "flat")
+    monkeypatch.setattr(rag_pipeline, "RETRIEVAL_MODE", "dense")  # dense search has to wait for the model
+    pipeline = RAGPipeline(vs_dir, handler=FakeHandler())
+    executor = DeadlineExecutor(max_workers=1, max_queue=0)
+    try:
+        _, err = executor.run(pipeline.prepare, "metformin dose", timeout_s=0.2, pass_token=True)
+        assert isinstance(err, DeadlineExceeded)
+        deadline = time.monotonic() + 2
+        while executor.metrics()["running"] and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert executor.metrics()["running"] == 0  # the worker gave up too, not just the caller
+        assert not loaded.is_set()
+    finally:
+        loaded.set()
+        executor.shutdown()
+
+def test_prepare_stops_between_stages_once_cancelled(pipeline, monkeypatch):
+    token = CancelToken()
+    token.cancel()
+    monkeypatch.setattr(pipeline, "retrieve", lambda *a, **kw: pytest.fail("retrieved after cancel"))
+    with pytest.raises(DeadlineExceeded):
+        pipeline.prepare("metformin dose", cancel=token)
+
+def test_exact_miss_counts_while_the_model_loads(pipeline, monkeypatch):
+    monkeypatch.setattr(type(pipeline.retriever), "embeddings_ready", property(lambda self: False))
+    assert pipeline.cached_answer("metformin dose") == (None, None)
+    assert pipeline.answer_cache.stats()["miss"] == 1
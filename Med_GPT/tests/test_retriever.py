@@ -0,0 +1,39 @@
+from utils.bm25_index import BM25Index
+from utils.mmap_store import MmapVectorStore
+from utils.retriever import CachedRetriever, rrf_fuse
+
+def _retriever(tiny_store, mode, **kwargs):
+    vs_dir, embeddings = tiny_store
+    vs = MmapVectorStore(vs_dir, embeddings)
+    bm25 = BM25Index.load(vs_dir, expected_n_docs=vs.index.ntotal)
+    return CachedRetriever(vs, k=2, bm25=bm25, mode=mode, candidates=4, **kwargs)
+
+def _pages(docs):
+    return [d.metadata["page"] for d in docs]
+
+def test_rrf_fuse_prefers_items_ranked_high_in_both():
+    assert rrf_fuse([[1, 2, 3], [3, 1, 2]], k=2) == [1, 3]
+
+def test_lexical_search_needs_no_embeddings(tiny_store):
+    retriever = _retriever(tiny_store, "lexical")
+    retriever.embeddings = None  # would fail if the model were touched
+    assert _pages(retriever.get_relevant_documents("amoxicillin pneumonia")) == [4]
+
+def test_hybrid_matches_dense_on_lexical_hits(tiny_store):
+    hybrid = _retriever(tiny_store, "hybrid")
+    dense = _retriever(tiny_store, "dense")
+    query = "metformin dose"
+    assert _pages(hybrid.get_relevant_documents(query)) == [1, 0]
+    assert _pages(hybrid.get_relevant_documents(query))[0] == _pages(dense.get_relevant_documents(query))[0]
+
+def test_hybrid_without_lexical_matches_falls_back_to_dense(tiny_store):
+    hybrid = _retriever(tiny_store, "hybrid")
+    dense = _retriever(tiny_store, "dense")
+    query = "zzz unknownterm"
+    assert _pages(hybrid.get_relevant_documents(query)) == _pages(dense.get_relevant_documents(query))
+
+def test_results_are_memoized(tiny_store):
+    retriever = _retriever(tiny_store, "hybrid")
+    first = retriever.get_relevant_documents("metformin dose")
+    assert retriever.get_relevant_documents("metformin dose") is first
+    assert retriever.stats()["result_hits"] == 1
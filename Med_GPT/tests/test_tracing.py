@@ -0,0 +1,28 @@
+import json
+
+from utils import tracing
+
+def test_trace_log_rotates_at_the_size_limit(tmp_path, monkeypatch):
+    log = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_LOG_PATH", str(log))
+    monkeypatch.setattr(tracing, "TRACE_LOG_MAX_BYTES", 300)
+    monkeypatch.setattr(tracing, "TRACE_LOG_BACKUPS", 2)
+
+    for i in range(40):
+        tracing._write_log({"trace_id": i, "outcome": "ok"})
+
+    assert log.stat().st_size <= 300
+    assert (tmp_path / "traces.jsonl.1").exists() and (tmp_path / "traces.jsonl.2").exists()
+    assert not (tmp_path / "traces.jsonl.3").exists()
+    last = json.loads(log.read_text(encoding="utf-8").splitlines()[-1])
+    assert last["trace_id"] == 39
+
+def test_finished_trace_is_logged_with_its_spans(tmp_path, monkeypatch):
+    log = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_LOG_PATH", str(log))
+    trace = tracing.start_trace("query")
+    with trace.activate(), tracing.span("retrieve"):
+        pass
+    trace.finish("ok")
+    record = json.loads(log.read_text(encoding="utf-8"))
+    assert record["outcome"] == "ok" and "retrieve" in record["spans"]
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+
+from utils.vector_store import VectorStore, batch_top_k
+
+def _random_tfidf(rows, cols, seed):
+    m = sparse.random(rows, cols, density=0.3, random_state=seed, format="csr", dtype=np.float64)
+    norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1))).ravel()
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(m.multiply(1.0 / norms[:, None]))
+
+def test_batch_top_k_matches_brute_force_across_blocks():
+    docs, queries = _random_tfidf(50, 30, 0), _random_tfidf(7, 30, 1)
+    expected = cosine_similarity(queries, docs)
+    hits = batch_top_k(queries, docs, k=4, block_size=3)  # blocks of 3, 3 and 1 queries
+    assert len(hits) == 7
+    for row, query_hits in zip(expected, hits):
+        ids = [i for i, _ in query_hits]
+        assert ids == sorted(range(50), key=lambda i: -row[i])[:4]
+        assert np.allclose([s for _, s in query_hits], row[ids])
+
+def test_batch_top_k_thresholds_and_small_corpora():
+    docs, queries = _random_tfidf(3, 10, 2), _random_tfidf(2, 10, 3)
+    assert all(len(h) == 3 for h in batch_top_k(queries, docs, k=10))  # k larger than the corpus
+    assert batch_top_k(queries, docs, k=2, min_score=[2.0, -1.0])[0] == []  # per-query thresholds
+    assert len(batch_top_k(queries, docs, k=2, min_score=[2.0, -1.0])[1]) == 2
+    assert batch_top_k(queries, docs, k=0) == [[], []]
+
+def test_search_batch_matches_single_searches():
+    store = VectorStore()
+    store.add_documents([
+        {"text": "Metformin is the first-line therapy for type 2 diabetes."},
+        {"text": "Hypertension is treated with ACE inhibitors."},
+        {"text": "Amoxicillin treats community-acquired pneumonia."},
+        {"text": "Insulin is started when metformin fails to control diabetes."},
+    ])
+    queries = ["metformin diabetes", "pneumonia", "blood pressure ace inhibitors"]
+    assert store.search_batch(queries, k=2) == [store.search(q, k=2) for q in queries]
+    assert [d["text"][:9] for d in store.search("metformin diabetes", k=2)] == ["Metformin", "Insulin i"]
+
+def test_search_before_indexing_raises():
+    with pytest.raises(ValueError):
+        VectorStore().search("anything")
@@ -0,0 +1,44 @@
+import json
+
+from vector_store_persistent import VectorStore
+
+DOCS = [
+    {"text": "Metformin is the first-line therapy for type 2 diabetes.", "source": "diabetes.pdf", "page": 1},
+    {"text": "Hypertension is treated with ACE inhibitors or thiazides.", "source": "bp.pdf", "page": 4},
+    {"text": "Amoxicillin treats community-acquired pneumonia in adults.", "source": "abx.pdf", "page": 2},
+]
+
+def _built(tmp_path):
+    store = VectorStore(cache_path=tmp_path)
+    store.add_documents(DOCS)
+    return store
+
+def test_saved_cache_searches_like_the_fitted_store(tmp_path):
+    store = _built(tmp_path)
+    store.save("guide")
+    loaded = VectorStore(cache_path=tmp_path)
+    assert loaded.load("guide")
+    for query in ("metformin diabetes", "pneumonia antibiotics", "ace inhibitors"):
+        assert loaded.search(query, k=2) == store.search(query, k=2)
+    assert loaded.documents[-1] == DOCS[-1] and len(loaded.documents) == 3
+
+def test_cache_holds_no_pickles(tmp_path):
+    cache_dir = _built(tmp_path).save("guide")
+    assert not list(cache_dir.glob("*.pkl"))
+    header = json.loads((cache_dir / "header.json").read_text(encoding="utf-8"))
+    assert header["n_docs"] == 3 and header["format"] == "medgpt-tfidf"
+
+def test_incomplete_or_legacy_cache_is_not_loaded(tmp_path):
+    cache_dir = _built(tmp_path).save("guide")
+    (cache_dir / "header.json").unlink()  # write interrupted before the header
+    (tmp_path / "old.pkl").write_bytes(b"not loaded")
+    store = VectorStore(cache_path=tmp_path)
+    assert not store.cache_exists("guide")
+    assert not store.load("guide") and not store.load("old")
+
+def test_wrong_format_version_is_rejected(tmp_path):
+    cache_dir = _built(tmp_path).save("guide")
+    header = json.loads((cache_dir / "header.json").read_text(encoding="utf-8"))
+    header["version"] = 0
+    (cache_dir / "header.json").write_text(json.dumps(header), encoding="utf-8")
+    assert not VectorStore(cache_path=tmp_path).load("guide")
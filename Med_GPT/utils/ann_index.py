@@ -0,0 +1,149 @@
+"""
+Approximate FAISS index types built from the flat index.
+
+The flat L2 index written by LangChain stays the source of truth (it
+supports incremental add/remove); an optional ANN index is written next
+to it as index_<type>.faiss (+ index_<type>.json) with the same vector
+order, so positions still map through index_to_docstore_id.
+"""
+import json
+import math
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from utils.bm25_index import flat_stamp
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+def ann_paths(vs_dir, index_type: str):
+    """(index file, config file) for an ANN index type."""
+    vs_dir = Path(vs_dir)
+    return vs_dir / f"index_{index_type}.faiss", vs_dir / f"index_{index_type}.json"
+
+def read_ann_config(vs_dir, index_type: str) -> Dict:
+    _, cfg_fp = ann_paths(vs_dir, index_type)
+    if not cfg_fp.exists():
+        return {}
+    with open(cfg_fp, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def default_nlist(n: int) -> int:
+    """~4·sqrt(n) lists, keeping at least 39 training points per list."""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+
+def default_pq_m(d: int) -> int:
+    """Largest divisor of d that gives sub-vectors of at least 8 dims."""
+    for m in range(d // 8, 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+def build_index(vectors: np.ndarray, index_type: str, nlist: Optional[int] = None,
+                hnsw_m: int = 32, ef_construction: int = 200, pq_m: Optional[int] = None):
+    """Train (when needed) and fill an index of the given type."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type in ("ivf", "ivfpq"):
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            pq_m = pq_m or default_pq_m(d)
+            nbits = 8 if n >= 256 * 39 else max(4, int(math.log2(max(n // 39, 16))))
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, nbits)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown index type: {index_type} (choose from {', '.join(INDEX_TYPES)})")
+    index.add(vectors)
+    return index
+
+def set_search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Apply query-time knobs; ignored for index types they do not apply to."""
+    if nprobe is not None and hasattr(index, "nprobe"):
+        index.nprobe = nprobe
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    return index
+
+def flat_vectors(index) -> np.ndarray:
+    return index.reconstruct_n(0, index.ntotal)
+
+def write_ann_index(index, vs_dir, index_type: str, params: Dict):
+    fp, cfg_fp = ann_paths(vs_dir, index_type)
+    faiss.write_index(index, str(fp))
+    with open(cfg_fp, "w", encoding="utf-8") as f:
+        json.dump({"index_type": index_type, "ntotal": int(index.ntotal), "params": params}, f, indent=2)
+
+def load_ann_index(vs_dir, index_type: str, expected_ntotal: int, mmap: bool = False):
+    """Return the ANN index, or None if it is missing or out of date with the flat index."""
+    fp, _ = ann_paths(vs_dir, index_type)
+    cfg = read_ann_config(vs_dir, index_type)
+    if not fp.exists() or not cfg:
+        print(f"⚠️ No {index_type} index in {vs_dir}; using flat index")
+        return None
+    stamp = cfg.get("params", {}).get("flat_stamp")
+    if stamp and stamp != flat_stamp(vs_dir):
+        cfg = {}  # flat index changed after this ANN index was built
+    if cfg.get("index_type") != index_type or cfg.get("ntotal") != expected_ntotal:
+        print(f"⚠️ {index_type} index is stale (rebuild with preprocess_documents.py); using flat index")
+        return None
+    if mmap:
+        from utils.mmap_store import read_index_mmap
+        return read_index_mmap(fp)
+    return faiss.read_index(str(fp))
+
+def _timed_search(index, queries: np.ndarray, k: int):
+    t0 = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, (time.perf_counter() - t0) * 1000 / len(queries)
+
+def recall_report(flat_index, ann_index, queries, k: int = 5,
+                  sweep: Optional[List[int]] = None) -> List[Dict]:
+    """
+    Recall@k and latency of ann_index against exact flat search.
+
+    sweep: nprobe values for IVF indexes or efSearch values for HNSW.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    truth, flat_ms = _timed_search(flat_index, queries, k)
+    if hasattr(ann_index, "hnsw"):
+        knob, sweep = "efSearch", sweep or [16, 32, 64, 128, 256]
+    elif hasattr(ann_index, "nprobe"):
+        knob, sweep = "nprobe", sweep or [1, 4, 16, 64]
+    else:
+        knob, sweep = None, [None]
+
+    rows = []
+    for value in sweep:
+        if knob == "efSearch":
+            set_search_params(ann_index, ef_search=value)
+        elif knob == "nprobe":
+            if value > ann_index.nlist:
+                continue
+            set_search_params(ann_index, nprobe=value)
+        ids, ann_ms = _timed_search(ann_index, queries, k)
+        hits = sum(len(set(a) & set(t)) for a, t in zip(ids.tolist(), truth.tolist()))
+        rows.append({
+            "knob": knob, "value": value,
+            "recall": hits / (len(queries) * k),
+            "ann_ms": ann_ms, "flat_ms": flat_ms,
+            "speedup": flat_ms / ann_ms if ann_ms > 0 else float("inf"),
+        })
+    return rows
+
+def print_recall_report(rows: List[Dict], k: int):
+    print(f"\n📈 Recall@{k} vs flat index")
+    print(f"  {'setting':<14} {'recall':>7} {'ann ms/q':>9} {'flat ms/q':>10} {'speedup':>8}")
+    for r in rows:
+        setting = f"{r['knob']}={r['value']}" if r["knob"] else "-"
+        print(f"  {setting:<14} {r['recall']:>7.3f} {r['ann_ms']:>9.3f} {r['flat_ms']:>10.3f} {r['speedup']:>7.1f}x")
@@ -0,0 +1,229 @@
+"""
+Persistent answer cache in front of retrieval + generation.
+
+Two lookups, cheapest first:
+  1. exact match on the normalized question text
+  2. nearest neighbour over embeddings of previously answered questions
+
+Entries live in SQLite so they survive restarts, are evicted by TTL and
+least-recent use, and are dropped wholesale when the fingerprint
+(index.faiss + manifest + embedding model + LLM model) changes. The
+question embeddings are also kept in an in-memory matrix that puts and
+evictions update in place.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+FINGERPRINT_FILES = ("index.faiss", "manifest.json")  # what the indexed content depends on
+SIMILAR_CANDIDATES = 5  # nearest questions tried when the best one is expired or gone
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    q = re.sub(r"\s+", " ", query.strip().lower())
+    return q.rstrip(" ?.!")
+
+def vectorstore_fingerprint(vs_dir) -> str:
+    """
+    Cheap content fingerprint from the size and mtime of index.faiss and the
+    manifest. Files the app derives from them (docstore.sqlite, BM25, ANN
+    indexes) are left out, so writing those does not invalidate the cache.
+    """
+    h = hashlib.sha1()
+    p = Path(vs_dir)
+    for name in FINGERPRINT_FILES:
+        f = p / name
+        if f.is_file():
+            st = f.stat()
+            h.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+class AnswerCache:
+    """Exact + semantic answer cache backed by SQLite"""
+
+    def __init__(self, path, max_entries: int = 2000, ttl_s: float = 7 * 24 * 3600,
+                 similarity_threshold: float = 0.95):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                embedding BLOB,
+                answer TEXT NOT NULL,
+                source TEXT,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);
+        """)
+        self._conn.commit()
+        self.hits = {"exact": 0, "semantic": 0, "miss": 0}
+        self._load_matrix()
+
+    # ---------- invalidation ----------
+    def validate(self, fingerprint: str) -> bool:
+        """Clear the cache if the index/model fingerprint changed. Returns True if cleared."""
+        with self._lock:
+            row = self._conn.execute("SELECT v FROM meta WHERE k = 'fingerprint'").fetchone()
+            if row and row[0] == fingerprint:
+                return False
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('fingerprint', ?)", (fingerprint,))
+            self._conn.commit()
+            self._reset_matrix()
+        if row:
+            print("♻️ Answer cache invalidated (vectorstore or model changed)")
+        return row is not None
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._reset_matrix()
+
+    # ---------- lookups ----------
+    def get_exact(self, query: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._fetch(normalize_query(query))
+            if entry is not None:
+                self.hits["exact"] += 1
+        if entry is not None:
+            entry["match"] = "exact"
+            entry["score"] = 1.0
+        return entry
+
+    def get_similar(self, embedding) -> Optional[Dict]:
+        """Closest previously answered question above the threshold that is still valid."""
+        vec = self._normalize(embedding)
+        entry, score = None, 0.0
+        with self._lock:
+            if self._rows:
+                scores = self._matrix[:self._size] @ vec
+                n = min(SIMILAR_CANDIDATES, self._size)
+                top = np.argpartition(-scores, n - 1)[:n]
+                # The best match may have expired or been evicted; a runner-up can still qualify
+                for row in top[np.argsort(-scores[top], kind="stable")]:
+                    score = float(scores[row])
+                    if score < self.similarity_threshold:
+                        break
+                    key = self._keys[row]
+                    entry = self._fetch(key) if key is not None else None
+                    if entry is not None:
+                        break
+            self.hits["semantic" if entry is not None else "miss"] += 1
+        if entry is None:
+            return None
+        entry["match"] = "semantic"
+        entry["score"] = score
+        return entry
+
+    def record_miss(self):
+        """Count a lookup that ended after get_exact (no query embedding yet for get_similar)."""
+        with self._lock:
+            self.hits["miss"] += 1
+
+    # ---------- writes ----------
+    def put(self, query: str, answer: str, embedding=None, source: Optional[Dict] = None):
+        key = normalize_query(query)
+        now = time.time()
+        blob = self._normalize(embedding).tobytes() if embedding is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, query, embedding, answer, source, created, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, query, blob, answer, json.dumps(source) if source else None, now, now),
+            )
+            evicted = self._evict(now)
+            self._conn.commit()
+            self._drop_rows(evicted + ([key] if blob is None else []))
+            if blob is not None:
+                self._set_row(key, np.frombuffer(blob, dtype=np.float32))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            n = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {"entries": n, **self.hits}
+
+    # ---------- internals ----------
+    def _fetch(self, key: str) -> Optional[Dict]:
+        row = self._conn.execute(
+            "SELECT query, answer, source, created FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[3] > self.ttl_s:
+            return None
+        self._conn.execute("UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self._conn.commit()
+        return {"query": row[0], "answer": row[1], "source": json.loads(row[2]) if row[2] else None}
+
+    def _evict(self, now: float) -> List[str]:
+        """Delete expired and least recently used entries; returns their keys."""
+        expired = "SELECT key FROM entries WHERE created < ?"
+        overflow = "SELECT key FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?"
+        keys = [r[0] for r in self._conn.execute(expired, (now - self.ttl_s,))]
+        self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl_s,))
+        keys += [r[0] for r in self._conn.execute(overflow, (self.max_entries,))]
+        self._conn.execute(f"DELETE FROM entries WHERE key IN ({overflow})", (self.max_entries,))
+        return keys
+
+    # In-memory matrix: row i holds the embedding of _keys[i]. Rows of deleted
+    # entries are tombstoned (key None, zero vector) and compacted when they
+    # make up half the matrix; capacity doubles, so a put is amortized O(dim).
+    def _reset_matrix(self):
+        self._keys: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._matrix = None
+        self._size = 0
+
+    def _load_matrix(self):
+        self._reset_matrix()
+        for key, blob in self._conn.execute("SELECT key, embedding FROM entries WHERE embedding IS NOT NULL"):
+            self._set_row(key, np.frombuffer(blob, dtype=np.float32))
+
+    def _set_row(self, key: str, vec: np.ndarray):
+        row = self._rows.get(key)
+        if row is None:
+            if self._matrix is None or self._matrix.shape[1] != vec.shape[0]:
+                self._matrix = np.zeros((16, vec.shape[0]), dtype=np.float32)  # first entry (or new model)
+                self._keys, self._rows, self._size = [], {}, 0
+            elif self._size == len(self._matrix):
+                self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+            row = self._size
+            self._size += 1
+            self._keys.append(key)
+            self._rows[key] = row
+        self._matrix[row] = vec
+
+    def _drop_rows(self, keys: List[str]):
+        for key in keys:
+            row = self._rows.pop(key, None)
+            if row is not None:
+                self._keys[row] = None
+                self._matrix[row] = 0.0
+        if self._size and len(self._rows) * 2 < self._size:
+            live = [(k, self._matrix[r].copy()) for k, r in self._rows.items()]
+            self._reset_matrix()
+            for key, vec in live:
+                self._set_row(key, vec)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
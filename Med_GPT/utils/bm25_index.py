@@ -0,0 +1,171 @@
+"""
+BM25 inverted index stored next to the FAISS vectorstore.
+
+Used as the cheap first stage of hybrid retrieval and as a lexical-only
+fallback. Postings are kept as flat numpy arrays with the BM25 weight of
+every (term, chunk) pair precomputed, so a query is a few array slices
+and one bincount. Files (all loadable with mmap, no pickle):
+  bm25.json         header: format version, chunk count, k1/b, index.faiss content hash
+  bm25_terms.json   vocabulary in term-id order
+  bm25_ptr.npy      postings offsets per term (n_terms + 1)
+  bm25_docs.npy     chunk positions (same order as the FAISS index)
+  bm25_weights.npy  precomputed BM25 weight per posting
+"""
+import hashlib
+import json
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+BM25_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Keeps doses and drug names whole: "500mg", "0.5", "co-amoxiclav", "mg/kg"
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the their this "
+    "to was were what when which who will with how do does should can".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+_stamps: Dict[tuple, str] = {}
+
+def flat_stamp(vs_dir) -> str:
+    """
+    Content hash of index.faiss, recorded by the files derived from it (BM25,
+    ANN indexes). Unlike size + mtime it survives copying or cloning the
+    vectorstore. Each version of the file is hashed once per process.
+    """
+    fp = Path(vs_dir) / "index.faiss"
+    if not fp.exists():
+        return ""
+    st = fp.stat()
+    key = (str(fp.resolve()), st.st_size, st.st_mtime_ns)
+    if key not in _stamps:
+        h = hashlib.blake2b(digest_size=16)
+        with open(fp, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _stamps[key] = h.hexdigest()
+    return _stamps[key]
+
+class BM25Index:
+    """Okapi BM25 over chunk positions"""
+
+    def __init__(self, terms: Dict[str, int], ptr, docs, weights, n_docs: int,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.terms = terms
+        self.ptr = ptr
+        self.docs = docs
+        self.weights = weights
+        self.n_docs = n_docs
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        term_ids: Dict[str, int] = {}
+        rows, cols, tfs, doc_len = [], [], [], []
+        for pos, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                rows.append(term_ids.setdefault(term, len(term_ids)))
+                cols.append(pos)
+                tfs.append(tf)
+        n_docs = len(doc_len)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        doc_len = np.asarray(doc_len, dtype=np.float32)
+
+        # Group postings by term
+        order = np.argsort(rows, kind="stable")
+        rows, cols, tfs = rows[order], cols[order], tfs[order]
+        df = np.bincount(rows, minlength=len(term_ids))
+        ptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+
+        avgdl = float(doc_len.mean()) if n_docs and doc_len.mean() > 0 else 1.0
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * doc_len[cols] / avgdl)
+        weights = (idf[rows] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+        return cls(term_ids, ptr, cols, weights, n_docs, k1, b)
+
+    def search(self, query: str, k: int = 200) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (positions, scores), best first; empty when no query term is indexed."""
+        slices = [(self.ptr[t], self.ptr[t + 1]) for t in
+                  (self.terms.get(tok) for tok in set(tokenize(query))) if t is not None]
+        if not slices or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs = np.concatenate([self.docs[s:e] for s, e in slices])
+        weights = np.concatenate([self.weights[s:e] for s, e in slices])
+        # Sum per chunk over only the postings touched by this query
+        uniq, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+        if k < len(uniq):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(uniq))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return uniq[top].astype(np.int64), scores[top]
+
+    # ---------- persistence ----------
+    @staticmethod
+    def exists(vs_dir) -> bool:
+        return (Path(vs_dir) / "bm25.json").exists()
+
+    def save(self, vs_dir):
+        vs_dir = Path(vs_dir)
+        terms = [None] * len(self.terms)
+        for term, tid in self.terms.items():
+            terms[tid] = term
+        with open(vs_dir / "bm25_terms.json", "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        np.save(vs_dir / "bm25_ptr.npy", self.ptr)
+        np.save(vs_dir / "bm25_docs.npy", self.docs)
+        np.save(vs_dir / "bm25_weights.npy", self.weights)
+        # Header last, so a partial write is never loaded
+        with open(vs_dir / "bm25.json", "w", encoding="utf-8") as f:
+            json.dump({"version": BM25_VERSION, "n_docs": self.n_docs, "n_terms": len(terms),
+                       "k1": self.k1, "b": self.b, "flat_stamp": flat_stamp(vs_dir)}, f, indent=2)
+        print(f"✓ BM25 index saved ({len(terms)} terms, {len(self.docs)} postings)")
+
+    @staticmethod
+    def is_current(vs_dir, expected_n_docs: int = None) -> bool:
+        """True if the saved index was built for the current index.faiss."""
+        if not BM25Index.exists(vs_dir):
+            return False
+        with open(Path(vs_dir) / "bm25.json", "r", encoding="utf-8") as f:
+            header = json.load(f)
+        return (header.get("version") == BM25_VERSION
+                and header.get("flat_stamp") == flat_stamp(vs_dir)
+                and (expected_n_docs is None or header.get("n_docs") == expected_n_docs))
+
+    @classmethod
+    def load(cls, vs_dir, expected_n_docs: int = None, mmap: bool = True):
+        """Return the index, or None if it is missing or does not match the vectorstore."""
+        vs_dir = Path(vs_dir)
+        if not cls.exists(vs_dir):
+            print(f"⚠️ No BM25 index in {vs_dir} (re-run preprocess_documents.py)")
+            return None
+        if not cls.is_current(vs_dir, expected_n_docs):
+            print("⚠️ BM25 index is stale (re-run preprocess_documents.py)")
+            return None
+        with open(vs_dir / "bm25.json", "r", encoding="utf-8") as f:
+            header = json.load(f)
+        with open(vs_dir / "bm25_terms.json", "r", encoding="utf-8") as f:
+            terms = {term: tid for tid, term in enumerate(json.load(f))}
+        mode = "r" if mmap else None
+        return cls(
+            terms,
+            np.load(vs_dir / "bm25_ptr.npy", mmap_mode=mode),
+            np.load(vs_dir / "bm25_docs.npy", mmap_mode=mode),
+            np.load(vs_dir / "bm25_weights.npy", mmap_mode=mode),
+            header["n_docs"], header["k1"], header["b"],
+        )
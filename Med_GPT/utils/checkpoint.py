@@ -0,0 +1,162 @@
+"""
+On-disk checkpoints that make long ingestion runs resumable.
+
+Everything is keyed by the source file's content hash, so a restarted
+run picks up exactly where the last one stopped and a changed file never
+reuses stale work:
+  pages_<key>.jsonl   one record per processed page (appended as we go)
+  vec_<key>.ids/.f32  chunk ids + float32 embeddings (appended per batch)
+
+Vectors are written before their ids, so a crash can leave rows without
+ids (or a torn last id line). Both files are trimmed back to the complete
+pairs before anything is appended, so later rows stay aligned.
+"""
+import hashlib
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+def file_key(file_path, block_size=1 << 20) -> str:
+    """Content hash used to name checkpoint files."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+class IngestCheckpoint:
+    """Append-only page and embedding checkpoints in one directory"""
+
+    def __init__(self, root, settings: Optional[Dict] = None):
+        """
+        settings: build parameters the checkpoint depends on (model, chunking).
+        The owning process passes them; worker processes pass None to reuse
+        the directory without re-validating it.
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._repaired = set()
+        if settings is None:
+            return
+        # Checkpoints made with another model / chunking are useless: start over
+        meta_file = self.root / "settings.json"
+        if meta_file.exists():
+            with open(meta_file, "r", encoding="utf-8") as f:
+                if json.load(f) != settings:
+                    print("♻️ Checkpoint settings changed, discarding old checkpoint")
+                    self.clear()
+                    self.root.mkdir(parents=True, exist_ok=True)
+        with open(meta_file, "w", encoding="utf-8") as f:
+            json.dump(settings, f)
+        for ids_fp in self.root.glob("vec_*.ids"):
+            self._repair_vectors(ids_fp.stem[len("vec_"):])
+
+    # ---------- pages ----------
+    def load_pages(self, key: str) -> List[Dict]:
+        fp = self.root / f"pages_{key}.jsonl"
+        if not fp.exists():
+            return []
+        pages = []
+        with open(fp, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    pages.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # torn last line from an interrupted write
+        return pages
+
+    def append_pages(self, key: str, pages: Iterable[Dict]):
+        fp = self.root / f"pages_{key}.jsonl"
+        if fp.exists() and fp.stat().st_size:
+            with open(fp, "rb") as f:
+                f.seek(-1, 2)
+                torn = f.read(1) != b"\n"
+            if torn:
+                self._truncate_torn_line(fp)
+        with open(fp, "a", encoding="utf-8") as f:
+            for page in pages:
+                f.write(json.dumps(page, ensure_ascii=False) + "\n")
+            f.flush()
+
+    @staticmethod
+    def _truncate_torn_line(fp: Path):
+        data = fp.read_bytes()
+        fp.write_bytes(data[: data.rfind(b"\n") + 1])
+
+    # ---------- embeddings ----------
+    def load_vectors(self, key: str) -> Dict[str, np.ndarray]:
+        ids_fp = self.root / f"vec_{key}.ids"
+        vec_fp = self.root / f"vec_{key}.f32"
+        if not ids_fp.exists() or not vec_fp.exists():
+            return {}
+        with open(ids_fp, "r", encoding="utf-8") as f:
+            ids = [ln.rstrip("\n") for ln in f if ln.endswith("\n")]
+        if not ids:
+            return {}
+        raw = np.fromfile(vec_fp, dtype=np.float32)
+        dim = self._dim()
+        if not dim:
+            return {}
+        n = min(len(ids), raw.size // dim)  # vectors are written before ids
+        vectors = raw[: n * dim].reshape(n, dim)
+        return dict(zip(ids[:n], vectors))
+
+    def append_vectors(self, key: str, ids: List[str], vectors):
+        arr = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        self._repair_vectors(key)
+        self._set_dim(arr.shape[1])
+        with open(self.root / f"vec_{key}.f32", "ab") as f:
+            arr.tofile(f)
+            f.flush()
+        with open(self.root / f"vec_{key}.ids", "a", encoding="utf-8") as f:
+            f.write("".join(f"{i}\n" for i in ids))
+            f.flush()
+
+    def _repair_vectors(self, key: str):
+        """Trim vec_<key>.ids/.f32 to the rows that have both an id and a full vector."""
+        if key in self._repaired:
+            return
+        self._repaired.add(key)
+        ids_fp = self.root / f"vec_{key}.ids"
+        vec_fp = self.root / f"vec_{key}.f32"
+        dim = self._dim()
+        if not dim:
+            return
+        if ids_fp.exists() and ids_fp.stat().st_size:
+            with open(ids_fp, "rb") as f:
+                f.seek(-1, 2)
+                torn = f.read(1) != b"\n"
+            if torn:
+                self._truncate_torn_line(ids_fp)
+        lines = ids_fp.read_bytes().count(b"\n") if ids_fp.exists() else 0
+        rows = vec_fp.stat().st_size // (dim * 4) if vec_fp.exists() else 0
+        n = min(lines, rows)
+        if vec_fp.exists() and vec_fp.stat().st_size != n * dim * 4:
+            print(f"🩹 Dropping {rows - n} orphan checkpoint vectors for {key}")
+            with open(vec_fp, "r+b") as f:
+                f.truncate(n * dim * 4)
+        if lines > n:
+            data = ids_fp.read_bytes()
+            keep = data.split(b"\n")[:n]
+            ids_fp.write_bytes(b"".join(line + b"\n" for line in keep))
+
+    # ---------- housekeeping ----------
+    def discard(self, key: str):
+        for name in (f"pages_{key}.jsonl", f"vec_{key}.ids", f"vec_{key}.f32"):
+            (self.root / name).unlink(missing_ok=True)
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _dim(self) -> int:
+        fp = self.root / "dim"
+        return int(fp.read_text()) if fp.exists() else 0
+
+    def _set_dim(self, dim: int):
+        if self._dim() != dim:
+            (self.root / "dim").write_text(str(dim))
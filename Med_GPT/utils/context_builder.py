@@ -0,0 +1,147 @@
+"""
+Token-budgeted context packing for the LLM prompt.
+
+Instead of pasting the single best chunk, the pipeline retrieves
+CANDIDATE_K chunks and packs only what is relevant into a fixed token
+budget:
+  1. split every candidate into sentences
+  2. score sentences by overlap with the query terms (BM25 tokenizer)
+  3. drop sentences already seen, including the overlap repeated between
+     neighbouring chunks and fragments cut at chunk boundaries
+  4. add the best sentences until CONTEXT_TOKEN_BUDGET tokens are used
+     (sentences without query terms fill what is left, in rank order),
+     then print them per source in their original order
+If no sentence survives (all fragments, or each one over the budget),
+the top chunk cut to the budget is used instead.
+Prompt processing time on CPU grows with prompt length, so more evidence
+in fewer tokens means a shorter time to first token. Tokens are counted
+with tiktoken when its encoding is available, otherwise estimated.
+"""
+import os
+import re
+from typing import Dict, List
+
+from utils.bm25_index import tokenize
+
+CANDIDATE_K = int(os.getenv("MEDGPT_CANDIDATE_K", "5"))  # chunks retrieved per question
+CONTEXT_TOKEN_BUDGET = int(os.getenv("MEDGPT_CONTEXT_TOKENS", "700"))  # 0: top chunk only, unpacked
+TIKTOKEN_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4  # estimate when tiktoken is unavailable
+MIN_FRAGMENT_CHARS = 20  # shorter pieces (page numbers, headings cut mid-way) are dropped
+
+# Sentence ends, or line breaks before bullets / numbered items / headings
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\"'])|\n\s*(?=[-•*]|\d+[.)]\s|[A-Z][A-Za-z ]{2,40}:)")
+
+_encoder = None
+
+def count_tokens(text: str) -> int:
+    """Prompt tokens for text (tiktoken if its encoding loads, else ~4 chars per token)."""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception as e:
+            print(f"⚠️ tiktoken unavailable ({type(e).__name__}); estimating tokens from length")
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """text cut to at most budget tokens (counted like count_tokens)."""
+    if count_tokens(text) <= budget:
+        return text
+    if _encoder:
+        return _encoder.decode(_encoder.encode(text)[:max(0, budget)])
+    return text[:max(0, budget - 1) * CHARS_PER_TOKEN]
+
+def split_sentences(text: str) -> List[str]:
+    parts = (" ".join(p.split()) for p in SENTENCE_RE.split(text or ""))
+    return [p for p in parts if len(p) >= MIN_FRAGMENT_CHARS]
+
+def _normalize(sentence: str) -> str:
+    return " ".join(tokenize(sentence))
+
+def _source_label(doc) -> str:
+    name = doc.metadata.get("source", "Unknown")
+    page = doc.metadata.get("page")
+    return f"{name}, page {page + 1}" if isinstance(page, int) else name
+
+class ContextBuilder:
+    """Packs the query-relevant sentences of several chunks into a token budget"""
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    def build(self, query: str, docs: List) -> Dict:
+        """
+        Returns {"text", "tokens", "sources" (docs that contributed, best first),
+        "candidates", "sentences", "duplicates"}.
+        """
+        if not docs:
+            return {"text": "", "tokens": 0, "sources": [], "candidates": 0, "sentences": 0, "duplicates": 0}
+        if self.token_budget <= 0:
+            text = docs[0].page_content
+            return {"text": text, "tokens": count_tokens(text), "sources": [docs[0]],
+                    "candidates": len(docs), "sentences": 0, "duplicates": 0}
+
+        query_terms = set(tokenize(query))
+        seen_text = ""  # normalized kept sentences, to catch boundary fragments
+        seen = set()
+        duplicates = 0
+        scored = []  # (score, doc rank, sentence index, sentence)
+        for rank, doc in enumerate(docs):
+            for i, sentence in enumerate(split_sentences(doc.page_content)):
+                norm = _normalize(sentence)
+                if not norm:
+                    continue
+                if norm in seen or norm in seen_text:
+                    duplicates += 1
+                    continue
+                seen.add(norm)
+                seen_text += norm + " | "
+                terms = set(norm.split())
+                score = len(query_terms & terms) / (len(query_terms) or 1)
+                scored.append((score, rank, i, sentence))
+
+        # Best-matching sentences first; earlier (better-ranked) chunks win ties.
+        # Sentences without query terms (definitions, paraphrases) then fill the rest in rank order.
+        chosen = []
+        used = 0
+        for score, rank, i, sentence in sorted(scored, key=lambda s: (-s[0], s[1], s[2])):
+            cost = count_tokens(sentence) + 1
+            if used + cost > self.token_budget:
+                continue
+            chosen.append((rank, i, sentence))
+            used += cost
+        if not chosen:
+            return self._top_chunk(docs, duplicates)
+
+        by_doc: Dict[int, List] = {}
+        for rank, i, sentence in sorted(chosen):
+            by_doc.setdefault(rank, []).append(sentence)
+        blocks = [f"[{_source_label(docs[rank])}]\n" + " ".join(sents) for rank, sents in by_doc.items()]
+        text = "\n\n".join(blocks)
+        return {
+            "text": text,
+            "tokens": count_tokens(text),
+            "sources": [docs[rank] for rank in by_doc],
+            "candidates": len(docs),
+            "sentences": len(chosen),
+            "duplicates": duplicates,
+        }
+
+    def _top_chunk(self, docs: List, duplicates: int) -> Dict:
+        """The best chunk cut to the budget, for chunks with no usable sentences."""
+        label = f"[{_source_label(docs[0])}]\n"
+        body = truncate_tokens(" ".join(docs[0].page_content.split()), self.token_budget - count_tokens(label))
+        text = label + body if body else ""
+        return {
+            "text": text,
+            "tokens": count_tokens(text),
+            "sources": [docs[0]] if body else [],
+            "candidates": len(docs),
+            "sentences": 0,
+            "duplicates": duplicates,
+        }
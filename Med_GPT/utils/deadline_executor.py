@@ -0,0 +1,287 @@
+"""
+Bounded executor for pipeline steps that must finish by a deadline.
+
+Replaces the thread-per-call timeout helper the app used to have, which
+leaked a daemon thread (and, for the LLM, an open Ollama request) every
+time a call timed out. Here:
+  - a fixed pool of workers plus a bounded queue; submissions beyond that
+    are rejected straight away instead of piling up (admission control)
+  - every task carries a CancelToken with a deadline; one watchdog thread
+    cancels expired tokens, which runs their cleanup callbacks (e.g.
+    closing the streaming HTTP response) so the work actually stops
+  - tasks whose deadline passes while still queued are never started
+  - a timed-out task keeps its slot until its worker actually returns, and
+    is counted as timed out rather than completed
+  - stream() runs a generator (the LLM answer) as a task and hands its
+    items to the caller as they are produced
+  - counters for submitted / rejected / completed / timed out / queue wait,
+    also exported on /metrics as medgpt_executor_tasks_total{outcome=...}
+    and the medgpt_executor_queue_wait_seconds histogram (utils/tracing.py)
+"""
+import contextvars
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Optional
+
+from utils.tracing import counter, histogram
+
+PIPELINE_WORKERS = int(os.getenv("MEDGPT_PIPELINE_WORKERS", "4"))
+PIPELINE_QUEUE = int(os.getenv("MEDGPT_PIPELINE_QUEUE", "16"))  # waiting tasks allowed beyond the workers
+
+TASKS = counter("medgpt_executor_tasks_total", "Pipeline executor tasks by outcome", labels=("executor", "outcome"))
+QUEUE_WAIT = histogram("medgpt_executor_queue_wait_seconds", "Time a task waited for a pipeline worker",
+                       labels=("executor",))
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class Rejected(RuntimeError):
+    """Raised when the executor is at capacity."""
+
+class CancelToken:
+    """Deadline + cancellation flag shared between a caller and the work it started"""
+
+    def __init__(self, timeout_s: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout_s if timeout_s is not None else None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.done = False
+        self.timed_out = False  # cancelled by the watchdog rather than by the caller
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def on_cancel(self, fn: Callable[[], None]):
+        """Run fn when the token is cancelled (immediately if it already is)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn()
+
+    def cancel(self, timed_out: bool = False) -> bool:
+        """Cancel and run the callbacks; False if it was already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.timed_out = timed_out
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                print(f"⚠️ Cancel callback failed: {e}")
+        return True
+
+    def finish(self):
+        """Mark the work as done so the watchdog leaves it alone."""
+        self.done = True
+        with self._lock:
+            self._callbacks = []
+
+class DeadlineExecutor:
+    """Fixed worker pool with a bounded queue, per-task deadlines and metrics"""
+
+    def __init__(self, max_workers: int = PIPELINE_WORKERS, max_queue: int = PIPELINE_QUEUE,
+                 name: str = "pipeline"):
+        self.name = name
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._running_tokens = set()
+        self._deadlines = []  # heap of (deadline, seq, token)
+        self._seq = itertools.count()
+        self._wakeup = threading.Condition(self._lock)
+        self._watchdog = threading.Thread(target=self._watch, name=f"{name}-watchdog", daemon=True)
+        self._watchdog.start()
+        self.counters = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0,
+                         "timed_out": 0, "expired_in_queue": 0}
+        self._started = 0
+        self._queue_wait_s = 0.0
+        self._queue_wait_max_s = 0.0
+
+    # ---------- tokens ----------
+    def token(self, timeout_s: Optional[float]) -> CancelToken:
+        """A CancelToken the watchdog cancels when timeout_s has passed."""
+        token = CancelToken(timeout_s)
+        if token.deadline is not None:
+            with self._wakeup:
+                heapq.heappush(self._deadlines, (token.deadline, next(self._seq), token))
+                self._wakeup.notify()
+        return token
+
+    def _watch(self):
+        while True:
+            expired = []
+            with self._wakeup:
+                while not self._deadlines:
+                    self._wakeup.wait()
+                now = time.monotonic()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    expired.append(heapq.heappop(self._deadlines)[2])
+                if not expired:
+                    self._wakeup.wait(self._deadlines[0][0] - now)
+            for token in expired:
+                if not token.done:
+                    self._time_out(token)
+
+    def _count(self, outcome: str):
+        # Caller holds self._lock
+        self.counters[outcome] += 1
+        TASKS.inc(self.name, outcome)
+
+    def _time_out(self, token: CancelToken):
+        if token.cancel(timed_out=True):
+            with self._lock:
+                self._count("timed_out")
+
+    # ---------- submission ----------
+    def submit(self, fn: Callable, *args, timeout_s: Optional[float] = None,
+               pass_token: bool = False, **kwargs):
+        """
+        Queue fn(*args, **kwargs) and return (future, token).
+        With pass_token=True fn also gets cancel=token. Raises Rejected at capacity.
+        """
+        with self._lock:
+            if self._pending >= self.capacity:
+                self._count("rejected")
+                raise Rejected(f"pipeline busy ({self._pending} tasks in flight)")
+            self._pending += 1
+            self._count("submitted")
+        token = self.token(timeout_s)
+        if pass_token:
+            kwargs["cancel"] = token
+        # Run in the caller's context so tracing spans land in the caller's trace
+        ctx = contextvars.copy_context()
+        future = self._pool.submit(ctx.run, self._call, fn, args, kwargs, token, time.monotonic())
+        return future, token
+
+    def _call(self, fn, args, kwargs, token: CancelToken, queued_at: float):
+        waited = time.monotonic() - queued_at
+        with self._lock:
+            self._started += 1
+            self._queue_wait_s += waited
+            self._queue_wait_max_s = max(self._queue_wait_max_s, waited)
+            QUEUE_WAIT.observe(waited, self.name)
+            if token.cancelled or token.expired:
+                self._count("expired_in_queue")
+                self._pending -= 1
+                token.timed_out = True
+                token.finish()
+                raise DeadlineExceeded("deadline passed while queued")
+            self._running += 1
+            self._running_tokens.add(token)
+        outcome = "failed"
+        try:
+            result = fn(*args, **kwargs)
+            outcome = "completed"
+            return result
+        finally:
+            token.finish()
+            with self._lock:
+                # A timed-out task was counted by the watchdog; its slot is freed only now
+                if not token.timed_out:
+                    self._count(outcome)
+                self._running_tokens.discard(token)
+                self._running -= 1
+                self._pending -= 1
+
+    def run(self, fn: Callable, *args, timeout_s: Optional[float] = None,
+            pass_token: bool = False, **kwargs):
+        """Run fn with a deadline and return (result, error), like the old helper."""
+        try:
+            future, token = self.submit(fn, *args, timeout_s=timeout_s, pass_token=pass_token, **kwargs)
+        except Rejected as e:
+            return None, e
+        try:
+            return future.result(timeout=token.remaining()), None
+        except FutureTimeout:
+            # A queued task sees the cancelled token and returns without running
+            self._time_out(token)
+            return None, DeadlineExceeded(f"Operation exceeded {timeout_s} seconds")
+        except Exception as e:
+            return None, e
+
+    def stream(self, gen_fn: Callable, *args, timeout_s: Optional[float] = None, **kwargs):
+        """
+        Run the generator gen_fn(*args, cancel=token, **kwargs) as a task and return
+        (iterator over its items, token). Raises Rejected at capacity. The iterator
+        re-raises the task's error (DeadlineExceeded if it expired while queued),
+        stops once the deadline has passed and nothing more arrives, and cancels
+        the task if it is closed early.
+        """
+        items = queue.Queue()
+        end = object()
+
+        def pump(cancel):
+            try:
+                for item in gen_fn(*args, cancel=cancel, **kwargs):
+                    items.put(item)
+            finally:
+                items.put(end)
+
+        future, token = self.submit(pump, timeout_s=timeout_s, pass_token=True)
+        return self._drain(items, end, future, token), token
+
+    @staticmethod
+    def _drain(items: queue.Queue, end, future, token: CancelToken):
+        try:
+            while True:
+                try:
+                    item = items.get(timeout=0.1)
+                except queue.Empty:
+                    if future.done() and items.empty():
+                        future.result()  # never started: raises DeadlineExceeded
+                        return
+                    if token.cancelled:
+                        return  # the worker keeps its slot until it notices
+                    continue
+                if item is end:
+                    future.result()
+                    return
+                yield item
+        finally:
+            if not future.done():
+                token.cancel()
+
+    # ---------- metrics ----------
+    def metrics(self) -> Dict:
+        with self._lock:
+            started = self._started
+            return {
+                **self.counters,
+                "running": self._running,
+                "overdue": sum(t.timed_out for t in self._running_tokens),
+                "queued": self._pending - self._running,
+                "capacity": self.capacity,
+                "queue_wait_avg_s": self._queue_wait_s / started if started > 0 else 0.0,
+                "queue_wait_max_s": self._queue_wait_max_s,
+            }
+
+    def summary(self) -> str:
+        m = self.metrics()
+        overdue = f" ({m['overdue']} past deadline)" if m["overdue"] else ""
+        return (f"{m['running']} running{overdue} / {m['queued']} queued • {m['completed']} done • "
+                f"{m['timed_out']} timed out • {m['rejected']} rejected • "
+                f"wait {m['queue_wait_avg_s'] * 1000:.0f} ms avg")
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
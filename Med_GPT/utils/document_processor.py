@@ -2,24 +2,32 @@ import re
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 
+from utils.profiling import stage
+
 class DocumentProcessor:
     """Document processor with page number tracking"""
     
-    def __init__(self, chunk_size=600, chunk_overlap=100):
+    def __init__(self, chunk_size=600, chunk_overlap=100, checkpoint_dir: Optional[str] = None):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.checkpoint_dir = checkpoint_dir  # resume PDF extraction after a crash / Ctrl-C
+        self.checkpoint_every = 25  # pages per checkpoint write
     
     def process_file(self, file_path: str, source_name: str, max_pages: Optional[Tuple[int, int]] = None) -> List[Dict]:
         """Process file with page tracking"""
         ext = Path(file_path).suffix.lower()
         
         if ext == '.txt':
-            text = self._read_txt(file_path)
-            chunks = self._create_chunks(text, source_name)
+            with stage("parse"):
+                text = self._read_txt(file_path)
+            with stage("split"):
+                chunks = self._create_chunks(text, source_name)
         elif ext == '.pdf':
             # Get text with page markers
-            pages_data = self._read_pdf_with_pages(file_path, max_pages)
-            chunks = self._create_chunks_with_pages(pages_data, source_name)
+            with stage("parse"):
+                pages_data = self._read_pdf_with_pages(file_path, max_pages)
+            with stage("split"):
+                chunks = self._create_chunks_with_pages(pages_data, source_name)
         else:
             raise ValueError(f"Unsupported file type: {ext}")
         
@@ -34,6 +42,9 @@ class DocumentProcessor:
         """
         Read PDF and track which page each text came from
         
+        With checkpoint_dir set, raw page text is saved as it is extracted and
+        a restarted run skips every page that was already done.
+        
         Returns: List of {page_num: int, text: str}
         """
         try:
@@ -55,34 +66,59 @@ class DocumentProcessor:
                 end_page = total_pages
                 print(f"⚠️ Processing ALL {total_pages} pages")
             
+            # Raw text of pages finished by an earlier, interrupted run
+            checkpoint, key, saved = None, None, {}
+            if self.checkpoint_dir:
+                from utils.checkpoint import IngestCheckpoint, file_key
+                checkpoint = IngestCheckpoint(self.checkpoint_dir)
+                key = file_key(file_path)
+                saved = {rec['page_num']: rec['text'] for rec in checkpoint.load_pages(key)}
+                resumed = sum(1 for p in range(start_page + 1, end_page + 1) if p in saved)
+                if resumed:
+                    print(f"↻ Resuming: {resumed} pages restored from checkpoint")
+            
             pages_data = []
             pages_processed = 0
+            pending = []
             
-            for page_num in range(start_page, end_page):
-                try:
-                    page_text = reader.pages[page_num].extract_text()
+            try:
+                for page_num in range(start_page, end_page):
+                    try:
+                        if page_num + 1 in saved:
+                            page_text = saved[page_num + 1]
+                        else:
+                            page_text = reader.pages[page_num].extract_text() or ''
+                            if checkpoint:
+                                pending.append({'page_num': page_num + 1, 'text': page_text})
+                                if len(pending) >= self.checkpoint_every:
+                                    checkpoint.append_pages(key, pending)
+                                    pending = []
+                        
+                        # Skip pages with very little text
+                        if len(page_text.strip()) < 50:
+                            continue
+                        
+                        # Clean the text
+                        with stage("clean"):
+                            cleaned_text = self._clean_text(page_text)
+                        
+                        pages_data.append({
+                            'page_num': page_num + 1,  # Human-readable page number
+                            'text': cleaned_text
+                        })
+                        
+                        pages_processed += 1
+                        
+                        # Progress
+                        if pages_processed % 100 == 0:
+                            print(f"  ✓ Processed {pages_processed} pages...")
                     
-                    # Skip pages with very little text
-                    if len(page_text.strip()) < 50:
+                    except Exception as e:
+                        print(f"  ⚠️ Skipped page {page_num + 1}: {str(e)}")
                         continue
-                    
-                    # Clean the text
-                    cleaned_text = self._clean_text(page_text)
-                    
-                    pages_data.append({
-                        'page_num': page_num + 1,  # Human-readable page number
-                        'text': cleaned_text
-                    })
-                    
-                    pages_processed += 1
-                    
-                    # Progress
-                    if pages_processed % 100 == 0:
-                        print(f"  ✓ Processed {pages_processed} pages...")
-                
-                except Exception as e:
-                    print(f"  ⚠️ Skipped page {page_num + 1}: {str(e)}")
-                    continue
+            finally:
+                if checkpoint and pending:
+                    checkpoint.append_pages(key, pending)
             
             print(f"✅ Extracted text from {pages_processed} pages with page tracking")
             return pages_data
@@ -0,0 +1,319 @@
+"""
+Pluggable sentence-embedding backends for the app and the ingest pipeline.
+
+  torch  sentence-transformers on fp32 PyTorch (same vectors as HuggingFaceEmbeddings)
+  int8   the torch model with dynamic int8 quantization of every nn.Linear
+  onnx   ONNX Runtime through sentence-transformers' backend="onnx"
+         (optional: pip install "sentence-transformers[onnx]")
+         (MEDGPT_ONNX_FILE picks a quantized export, e.g. onnx/model_qint8_avx2.onnx)
+
+Pick one with MEDGPT_EMBED_BACKEND; MEDGPT_EMBED_BATCH and MEDGPT_EMBED_THREADS
+control the encode batch size (default: MEDGPT_EMBED_BATCH_TOKENS padded
+tokens per batch, see auto_batch_size) and CPU threads. EmbeddingPool spreads index builds over several
+processes, each pinned to its own share of the cores. Before switching an existing
+vectorstore to a quantized backend, check it still finds the same neighbours:
+    python utils/embeddings.py --backend int8
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BACKENDS = ("torch", "int8", "onnx")
+DEFAULT_BATCH_SIZE = 32
+PARITY_MIN_OVERLAP = 0.9  # mean top-k overlap a backend needs to pass the parity check
+MAX_SEQ_TOKENS = 256      # all-MiniLM-L6-v2 truncates inputs here
+CHARS_PER_TOKEN = 4       # rough WordPiece ratio for English text
+BYTES_PER_TOKEN = 64 * 1024  # conservative peak activation memory per token (MiniLM-size encoder)
+# Padded tokens per encode batch. On CPU, throughput stops improving after a
+# few thousand tokens per forward pass, while padding waste keeps growing with
+# batch size, so batches are sized by tokens rather than by count.
+BATCH_TOKENS = int(os.getenv("MEDGPT_EMBED_BATCH_TOKENS", "4096"))
+
+def available_memory_bytes() -> int:
+    """MemAvailable from /proc/meminfo, falling back to sysconf or 4 GiB."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 4 << 30
+
+def auto_batch_size(texts: List[str], workers: int = 1, memory_fraction: float = 0.5,
+                    min_size: int = 8, max_size: int = 256) -> int:
+    """
+    Largest power-of-two batch of about BATCH_TOKENS padded tokens, so
+    500-char chunks encode 32 at a time and short queries 256. Batches are
+    padded to their longest member, so sizing uses the 95th-percentile
+    length rather than the mean. The batch is also capped so its
+    activations fit in this worker's share of free memory (small hosts,
+    many workers).
+    """
+    lengths = [min(len(t) // CHARS_PER_TOKEN + 2, MAX_SEQ_TOKENS) for t in texts] or [MAX_SEQ_TOKENS]
+    tokens = max(1.0, float(np.percentile(lengths, 95)))
+    memory = available_memory_bytes() * memory_fraction / max(1, workers)
+    fit = int(min(BATCH_TOKENS / tokens, memory / (tokens * BYTES_PER_TOKEN)))
+    size = 1 << max(0, fit.bit_length() - 1) if fit > 0 else min_size
+    return max(min_size, min(size, max_size))
+
+class SentenceEmbeddings:
+    """LangChain-compatible embeddings on a selectable CPU backend (see register_langchain)"""
+
+    def __init__(self, model_name: str = EMBED_MODEL, backend: str = "torch",
+                 batch_size: Optional[int] = DEFAULT_BATCH_SIZE, threads: Optional[int] = None,
+                 onnx_file: Optional[str] = None):
+        """batch_size=None picks a batch size per call with auto_batch_size."""
+        if backend not in EMBED_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {backend} (choose from {', '.join(EMBED_BACKENDS)})")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.threads = threads
+        self.onnx_file = onnx_file
+        self.model = self._load(onnx_file)
+
+    @property
+    def quantization(self) -> str:
+        """What the vectors depend on besides model and backend (recorded in the manifest)."""
+        if self.backend == "int8":
+            return "dynamic-qint8"
+        if self.backend == "onnx":
+            return self.onnx_file or "model.onnx"
+        return "fp32"
+
+    def _load(self, onnx_file: Optional[str]):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        if self.backend == "onnx":
+            model_kwargs = {"provider": "CPUExecutionProvider"}
+            if onnx_file:
+                model_kwargs["file_name"] = onnx_file
+            if self.threads:
+                import onnxruntime
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = self.threads
+                model_kwargs["session_options"] = options
+            return SentenceTransformer(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+        model = SentenceTransformer(self.model_name, device="cpu")
+        if self.backend == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.eval()
+        return model
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        # Same newline handling as HuggingFaceEmbeddings, so torch vectors match the index exactly
+        texts = [t.replace("\n", " ") for t in texts]
+        batch_size = self.batch_size or auto_batch_size(texts)
+        vectors = self.model.encode(texts, batch_size=batch_size, show_progress_bar=False,
+                                    convert_to_numpy=True)
+        return vectors.astype(np.float32).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+def register_langchain(*classes):
+    """
+    Make SentenceEmbeddings (and classes, e.g. BackgroundEmbeddings) pass
+    LangChain's isinstance(..., Embeddings) checks in FAISS.load_local /
+    from_embeddings. Registering as a virtual subclass of the ABC, only where
+    LangChain's FAISS is used, keeps langchain_core (and the langsmith and
+    pydantic imports it pulls in, ~0.6 s) out of the app's startup.
+    """
+    from langchain_core.embeddings import Embeddings
+    for cls in (SentenceEmbeddings,) + classes:
+        Embeddings.register(cls)
+
+def make_embeddings(model_name: str = EMBED_MODEL, backend: Optional[str] = None,
+                    batch_size: Optional[int] = None, threads: Optional[int] = None) -> SentenceEmbeddings:
+    """Build the configured backend; arguments override the MEDGPT_EMBED_* env vars."""
+    backend = backend or os.getenv("MEDGPT_EMBED_BACKEND", "torch")
+    batch_size = batch_size or int(os.getenv("MEDGPT_EMBED_BATCH", "0")) or None
+    threads = threads or int(os.getenv("MEDGPT_EMBED_THREADS", "0")) or None
+    emb = SentenceEmbeddings(model_name, backend=backend, batch_size=batch_size, threads=threads,
+                             onnx_file=os.getenv("MEDGPT_ONNX_FILE") or None)
+    print(f"✓ Embeddings: {model_name} on {backend} "
+          f"(batch {batch_size or 'auto'}, threads {threads or 'default'})")
+    return emb
+
+# ---------- multi-process pool ----------
+def core_groups(workers: int) -> List[List[int]]:
+    """Split the cores this process may use into `workers` contiguous groups."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if workers >= len(cores):
+        return [[c] for c in cores]
+    per = len(cores) // workers
+    groups = [cores[i * per:(i + 1) * per] for i in range(workers)]
+    groups[-1].extend(cores[workers * per:])
+    return groups
+
+_worker_model = None
+
+def _init_worker(slots, groups, model_name, backend, onnx_file):
+    """Pin this worker to its core group and load the model once."""
+    global _worker_model
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+    cores = groups[slot % len(groups)]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    _worker_model = SentenceEmbeddings(model_name, backend, batch_size=None, threads=len(cores),
+                                       onnx_file=onnx_file)
+
+def _embed_in_worker(texts: List[str], batch_size: int) -> np.ndarray:
+    _worker_model.batch_size = batch_size
+    return np.asarray(_worker_model.embed_documents(texts), dtype=np.float32)
+
+class EmbeddingPool:
+    """
+    Encodes chunk batches across worker processes, each pinned to its own
+    share of the cores with a matching thread count. Every embed_documents
+    call is split evenly over the workers; submit() starts one without
+    waiting, so the caller can index the previous batch meanwhile.
+    """
+
+    def __init__(self, model_name: str = EMBED_MODEL, backend: Optional[str] = None, workers: int = 2,
+                 batch_size: Optional[int] = None):
+        self.backend = backend or os.getenv("MEDGPT_EMBED_BACKEND", "torch")
+        self.groups = core_groups(workers)
+        self.workers = len(self.groups)
+        self.batch_size = batch_size or int(os.getenv("MEDGPT_EMBED_BATCH", "0")) or None
+        # spawn: forking a parent that already runs torch threads can deadlock
+        ctx = multiprocessing.get_context("spawn")
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=ctx, initializer=_init_worker,
+            initargs=(ctx.Value("i", 0), self.groups, model_name, self.backend,
+                      os.getenv("MEDGPT_ONNX_FILE") or None),
+        )
+        print(f"✓ Embedding pool: {self.workers} workers × {len(self.groups[0])} cores on {self.backend} "
+              f"(batch {self.batch_size or 'auto'})")
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        """Start encoding texts across the workers and return at once; gather() collects the vectors."""
+        texts = list(texts)
+        if not texts:
+            return []
+        batch_size = self.batch_size or auto_batch_size(texts, self.workers)
+        per_worker = math.ceil(len(texts) / self.workers)
+        return [self._pool.submit(_embed_in_worker, texts[i:i + per_worker], batch_size)
+                for i in range(0, len(texts), per_worker)]
+
+    @staticmethod
+    def gather(futures: List[Future]) -> np.ndarray:
+        """Wait for a submit() and return its vectors as one float32 array, in input order."""
+        if not futures:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([f.result() for f in futures])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.gather(self.submit(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+
+# ---------- parity check ----------
+def _sample_chunks(vs_dir, n: int) -> List[str]:
+    db = Path(vs_dir) / "docstore.sqlite"
+    if not db.exists():
+        return []
+    conn = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+    rows = conn.execute("SELECT page_content FROM chunks ORDER BY pos LIMIT ?", (n,)).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+def _timed_encode(emb: SentenceEmbeddings, texts: List[str]):
+    t0 = time.perf_counter()
+    vectors = np.asarray(emb.embed_documents(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - t0
+
+def _cosines(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+
+def parity_check(backend: str, model_name: str = EMBED_MODEL, vs_dir="vectorstore",
+                 queries_file="queries.json", k: int = 5, n_chunks: int = 256,
+                 batch_size: int = DEFAULT_BATCH_SIZE, threads: Optional[int] = None) -> bool:
+    """
+    Compare a backend against fp32 torch: vector cosine, encode speed, and
+    overlap of the top-k neighbours each backend's query vectors find in the
+    existing FAISS index (built with torch vectors).
+    """
+    with open(queries_file, "r", encoding="utf-8") as f:
+        queries = [q["query"] for q in json.load(f) if q.get("query")]
+    chunks = _sample_chunks(vs_dir, n_chunks)
+
+    reference = SentenceEmbeddings(model_name, "torch", batch_size, threads)
+    candidate = SentenceEmbeddings(model_name, backend, batch_size, threads,
+                                   onnx_file=os.getenv("MEDGPT_ONNX_FILE") or None)
+    ref_q, _ = _timed_encode(reference, queries)
+    cand_q, _ = _timed_encode(candidate, queries)
+
+    print(f"\n🔬 Parity: {backend} vs torch ({len(queries)} queries, {len(chunks)} chunks)")
+    cos = _cosines(ref_q, cand_q)
+    print(f"  query cosine      mean {cos.mean():.4f} • min {cos.min():.4f}")
+    if chunks:
+        ref_c, ref_s = _timed_encode(reference, chunks)
+        cand_c, cand_s = _timed_encode(candidate, chunks)
+        cos_c = _cosines(ref_c, cand_c)
+        print(f"  chunk cosine      mean {cos_c.mean():.4f} • min {cos_c.min():.4f}")
+        print(f"  encode speed      torch {len(chunks) / ref_s:.1f} • {backend} {len(chunks) / cand_s:.1f} chunks/s "
+              f"({ref_s / cand_s:.2f}x)")
+
+    index_fp = Path(vs_dir) / "index.faiss"
+    if not index_fp.exists():
+        print("  (no index.faiss; neighbour overlap skipped)")
+        return bool(cos.min() > 0.99)
+    import faiss
+    index = faiss.read_index(str(index_fp))
+    _, ref_ids = index.search(ref_q, k)
+    _, cand_ids = index.search(cand_q, k)
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_ids.tolist(), cand_ids.tolist())])
+    top1 = np.mean(ref_ids[:, 0] == cand_ids[:, 0])
+    passed = overlap >= PARITY_MIN_OVERLAP
+    print(f"  top-{k} overlap     {overlap:.3f} • top-1 agreement {top1:.3f}")
+    print(f"{'✅' if passed else '❌'} {backend} {'matches' if passed else 'does NOT match'} torch "
+          f"(threshold {PARITY_MIN_OVERLAP})")
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a quantized embedding backend against fp32 torch")
+    parser.add_argument("--backend", choices=EMBED_BACKENDS, default="int8")
+    parser.add_argument("--model", default=EMBED_MODEL)
+    parser.add_argument("--vectorstore", default="vectorstore")
+    parser.add_argument("--queries", default="queries.json")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=256, help="Chunks sampled for cosine / speed")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    ok = parity_check(args.backend, args.model, args.vectorstore, args.queries, args.k,
+                      args.chunks, args.batch_size, args.threads)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,7 @@ def main():
     print("\nWhat would you like to extract?")
     print("1. Specific chapters (recommended)")
     print("2. First N pages (for testing)")
-    print("3. Entire book (will take 20-30 minutes!)")
+    print("3. Entire book (slow, but written page by page with progress)")
     
     choice = input("\nEnter choice (1/2/3): ").strip()
     
@@ -35,16 +35,14 @@ def main():
         keywords = [k.strip() for k in keywords_input.split(',')]
         
         print(f"\n🔍 Searching for chapters containing: {keywords}")
-        text = extractor.extract_specific_chapters(harrisons_path, keywords)
         
-        # Save to file
+        # Pages are written as they are found
         output_file = "documents/harrisons_selected_chapters.txt"
-        Path("documents").mkdir(exist_ok=True)
+        stats = extractor.extract_to_file(
+            extractor.iter_chapter_pages(harrisons_path, keywords), output_file, clean=False
+        )
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(text)
-        
-        print(f"\n✅ Extracted {len(text)} characters")
+        print(f"\n✅ Extracted {stats['chars']} characters from {stats['pages']} pages")
         print(f"✅ Saved to: {output_file}")
         print(f"\nYou can now load this in MedGPT!")
     
@@ -52,19 +50,12 @@ def main():
         pages = int(input("\nHow many pages to extract? (e.g., 100): ").strip())
         
         print(f"\n📖 Extracting first {pages} pages...")
-        text = extractor.extract_from_pdf(harrisons_path, max_pages=pages)
-        
-        # Clean text
-        text = extractor.clean_medical_text(text)
         
-        # Save to file
+        # Clean + save page by page
         output_file = f"documents/harrisons_first_{pages}_pages.txt"
-        Path("documents").mkdir(exist_ok=True)
+        stats = extractor.extract_to_file(extractor.iter_pages(harrisons_path, max_pages=pages), output_file)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(text)
-        
-        print(f"\n✅ Extracted {len(text)} characters")
+        print(f"\n✅ Extracted {stats['chars']} characters in {stats['seconds']:.1f}s")
         print(f"✅ Saved to: {output_file}")
     
     elif choice == "3":
@@ -72,16 +63,11 @@ def main():
         
         if confirm == "yes":
             print("\n📖 Extracting entire book... (this will take a while)")
-            text = extractor.extract_from_pdf(harrisons_path)
-            text = extractor.clean_medical_text(text)
             
             output_file = "documents/harrisons_complete.txt"
-            Path("documents").mkdir(exist_ok=True)
-            
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(text)
+            stats = extractor.extract_to_file(extractor.iter_pages(harrisons_path), output_file)
             
-            print(f"\n✅ Extracted {len(text)} characters")
+            print(f"\n✅ Extracted {stats['chars']} characters in {stats['seconds']:.1f}s")
             print(f"✅ Saved to: {output_file}")
         else:
             print("Cancelled.")
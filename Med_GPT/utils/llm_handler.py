@@ -1,6 +1,42 @@
 import os
+import json
+import time
+import asyncio
+import threading
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from typing import Iterator, Optional
+from urllib3.util.retry import Retry
+
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # how long Ollama keeps the model loaded ("-1": forever)
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1") != "0"    # load the model in the background at startup
+WARMUP_TIMEOUT_S = 300.0  # model load from disk can take minutes on CPU
+WARM_WAIT_S = float(os.getenv("OLLAMA_WARM_WAIT_S", "120"))  # a question waits this long for a warm-up in progress
+
+# Fixed part of every Ollama prompt. Keeping it byte-identical and first lets
+# Ollama reuse the cached prompt evaluation for it across questions; only the
+# context and question after it are evaluated per request.
+OLLAMA_PROMPT_PREFIX = """You are a medical information assistant. Provide a concise, evidence-based answer using ONLY the information from the provided medical documents.
+
+CRITICAL RULES:
+1. Answer in 2-3 clear paragraphs maximum
+2. Use ONLY information from the context below
+3. If information is insufficient, state clearly that more guidance is required.
+4. Include specific clinical details (drug names, doses, criteria) when present.
+5. Be precise and clinical in tone.
+
+MEDICAL CONTEXT:
+"""
+
+def keep_alive_seconds(value: str) -> Optional[float]:
+    """Ollama keep_alive ("30m", "1h", "300", "-1") in seconds; None means never unloaded."""
+    value = str(value).strip()
+    units = {"s": 1, "m": 60, "h": 3600}
+    try:
+        seconds = float(value[:-1]) * units[value[-1]] if value[-1:] in units else float(value)
+    except ValueError:
+        return 5 * 60.0  # Ollama's default
+    return None if seconds < 0 else seconds
 
 class LLMHandler:
     """
@@ -9,17 +45,51 @@ class LLMHandler:
     - Anthropic Claude (optional via API key)
     - Fallback (no LLM)
     """
-    def __init__(self):
+    def __init__(self, pool_size: Optional[int] = None, max_retries: Optional[int] = None):
         self.api_key = os.getenv("ANTHROPIC_API_KEY")
         self.ollama_base_url = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+        self.pool_size = pool_size or int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+        self.session = self._build_session()
+        self._async_client = None
+        self._async_loop = None
+        self._available_models = []  # filled by the single /api/tags probe
         self.backend = self._detect_backend()
         self.recommended_models = ["meditron", "llama3.1:8b", "mistral:7b", "llama3.2:3b", "llama2:7b"]
         self.ollama_model = self._find_available_model()
+        # Set once the model is loaded in Ollama (immediately for other backends)
+        self.warm = threading.Event()
+        self.warm_error = None
+        self._keep_alive_s = keep_alive_seconds(OLLAMA_KEEP_ALIVE)
+        self._last_used = time.monotonic()
+        self._warm_lock = threading.Lock()
+        self._warm_thread = None
+        if self.backend == "ollama" and self.ollama_model and OLLAMA_WARMUP:
+            self.start_warmup()
+        else:
+            self.warm.set()
+
+    def _build_session(self) -> requests.Session:
+        """Keep-alive session shared by every request this handler makes."""
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,  # never replay a generation that already reached the model
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     def _detect_backend(self) -> str:
         try:
-            r = requests.get(f"{self.ollama_base_url}/api/tags", timeout=2)
+            r = self.session.get(f"{self.ollama_base_url}/api/tags", timeout=2)
             if r.status_code == 200:
+                self._available_models = [m["name"] for m in r.json().get("models", [])]
                 return "ollama"
         except Exception:
             pass
@@ -30,75 +100,296 @@ class LLMHandler:
     def _find_available_model(self) -> Optional[str]:
         if self.backend != "ollama":
             return None
+        available = self._available_models
+        for model in self.recommended_models:
+            if model in available:
+                print(f"✅ Using Ollama model: {model}")
+                return model
+            for avail in available:
+                if model.split(":")[0] in avail:
+                    print(f"✅ Using Ollama model: {avail}")
+                    return avail
+        if available:
+            print(f"⚠️ Using available model: {available[0]}")
+            return available[0]
+        print("⚠️ Ollama is running but has no models pulled")
+        return None
+
+    # ---------- warm-up / keep-alive ----------
+    def start_warmup(self):
+        """Load the model (and the fixed prompt prefix) in a background thread."""
+        with self._warm_lock:
+            if self._warm_thread is not None and self._warm_thread.is_alive():
+                return
+            self.warm.clear()
+            self._warm_thread = threading.Thread(target=self._warm_up, name="ollama-warmup", daemon=True)
+            self._warm_thread.start()
+
+    def _warm_up(self):
+        t0 = time.perf_counter()
+        payload = self._ollama_payload(OLLAMA_PROMPT_PREFIX, stream=False)
+        payload["options"]["num_predict"] = 1
         try:
-            r = requests.get(f"{self.ollama_base_url}/api/tags", timeout=2)
-            if r.status_code == 200:
-                available = [m["name"] for m in r.json().get("models", [])]
-                for model in self.recommended_models:
-                    if model in available:
-                        print(f"✅ Using Ollama model: {model}")
-                        return model
-                    for avail in available:
-                        if model.split(":")[0] in avail:
-                            print(f"✅ Using Ollama model: {avail}")
-                            return avail
-                if available:
-                    print(f"⚠️ Using available model: {available[0]}")
-                    return available[0]
+            r = self.session.post(f"{self.ollama_base_url}/api/generate", json=payload,
+                                  timeout=(5, WARMUP_TIMEOUT_S))
+            r.raise_for_status()
+            self.warm_error = None
+            print(f"🔥 Ollama model {self.ollama_model} warm in {time.perf_counter() - t0:.1f}s "
+                  f"(keep_alive {OLLAMA_KEEP_ALIVE})")
         except Exception as e:
-            print(f"⚠️ Error detecting Ollama models: {e}")
-        return None
+            self.warm_error = str(e)
+            print(f"⚠️ Ollama warm-up failed: {e}")
+        finally:
+            self._last_used = time.monotonic()
+            self.warm.set()
+
+    def _ensure_warm(self, cancel=None):
+        """Wait for a warm-up in progress; re-warm if keep_alive has likely unloaded the model."""
+        if self.backend != "ollama":
+            return
+        idle = time.monotonic() - self._last_used
+        # keep_alive "0" unloads the model after every request, so re-warming would only double the load
+        if OLLAMA_WARMUP and self._keep_alive_s and idle > self._keep_alive_s:
+            print(f"♻️ Ollama idle {idle / 60:.0f} min (> keep_alive); reloading model")
+            self.start_warmup()
+        give_up = time.monotonic() + WARM_WAIT_S
+        while not self.warm.wait(0.25):
+            if cancel is not None and cancel.cancelled:
+                return
+            if time.monotonic() > give_up:
+                print(f"⚠️ Ollama warm-up still running after {WARM_WAIT_S:.0f}s; sending request anyway")
+                break
+        self._last_used = time.monotonic()
 
-    def generate_answer(self, question: str, context: str, enhanced_mode: bool = True) -> str:
+    async def _aensure_warm(self):
+        """_ensure_warm off the event loop (it may start a warm-up and wait for it)."""
+        if self.backend != "ollama":
+            return
+        await asyncio.to_thread(self._ensure_warm)
+
+    def generate_answer(self, question: str, context: str, enhanced_mode: bool = True,
+                        stats: Optional[dict] = None, cancel=None) -> str:
+        """
+        One-shot answer; stats (if given) gets backend and a fallback flag like stream_answer.
+        With a cancel token (utils/deadline_executor.CancelToken) Ollama is read as a
+        stream, so cancelling closes the request instead of waiting for the full answer.
+        """
+        stats = {} if stats is None else stats
+        stats["backend"] = self.backend
         if self.backend == "ollama":
-            return self._generate_ollama(question, context)
+            self._ensure_warm(cancel)
+            if cancel is not None:
+                return self.clean_answer("".join(self._stream_ollama(question, context, stats, cancel)))
+            return self._generate_ollama(question, context, stats)
         elif self.backend == "claude":
-            return self._generate_claude(question, context)
+            return self._generate_claude(question, context, stats=stats)
         return self._generate_fallback(question, context)
 
-    def _generate_ollama(self, question: str, context: str) -> str:
-        prompt = f"""You are a medical information assistant. Provide a concise, evidence-based answer using ONLY the information from the provided medical documents.
+    async def agenerate_answer(self, question: str, context: str, stats: Optional[dict] = None) -> str:
+        """
+        Async counterpart of generate_answer.
 
-CRITICAL RULES:
-1. Answer in 2-3 clear paragraphs maximum
-2. Use ONLY information from the context below
-3. If information is insufficient, state clearly that more guidance is required.
-4. Include specific clinical details (drug names, doses, criteria) when present.
-5. Be precise and clinical in tone.
+        Ollama requests go through one shared httpx.AsyncClient whose
+        connection limit equals pool_size, so many concurrent questions
+        reuse a handful of keep-alive connections.
+        """
+        stats = {} if stats is None else stats
+        stats["backend"] = self.backend
+        if self.backend == "ollama":
+            await self._aensure_warm()
+            return await self._agenerate_ollama(question, context, stats)
+        elif self.backend == "claude":
+            return await asyncio.to_thread(self._generate_claude, question, context, stats=stats)
+        return self._generate_fallback(question, context)
 
-MEDICAL CONTEXT:
-{context}
+    def _get_async_client(self):
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        # httpx connections are bound to the loop that opened them
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                base_url=self.ollama_base_url,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                transport=httpx.AsyncHTTPTransport(retries=self.max_retries),
+                timeout=httpx.Timeout(30, connect=5),
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    async def _agenerate_ollama(self, question: str, context: str, stats: dict) -> str:
+        prompt = self._build_ollama_prompt(question, context)
+        try:
+            client = self._get_async_client()
+            r = await client.post("/api/generate", json=self._ollama_payload(prompt, stream=False))
+            if r.status_code == 200:
+                data = r.json()
+                self._record_eval(stats, data)
+                ans = self.clean_answer(data.get("response") or "")
+                return ans or "I could not generate an answer."
+            stats["fallback"] = True
+            return self._generate_fallback(question, context)
+        except Exception as e:
+            print(f"⚠️ Ollama error: {e}")
+            stats["error"] = str(e)
+            stats["fallback"] = True
+            return self._generate_fallback(question, context)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_loop = None
+
+    def close(self):
+        self.session.close()
+
+    def stream_answer(self, question: str, context: str, stats: Optional[dict] = None,
+                      cancel=None) -> Iterator[str]:
+        """
+        Yield the answer incrementally as the backend produces it.
+
+        Only Ollama streams token by token; Claude and the fallback yield the
+        whole answer once. If ``stats`` is given it is filled with
+        ttft_s, total_s, tokens and tokens_per_s when the stream ends.
+        Cancelling ``cancel`` closes the Ollama response and ends the stream
+        (stats["cancelled"] is set).
+        """
+        if stats is None:
+            stats = {}
+        stats["backend"] = self.backend
+        if self.backend == "ollama":
+            self._ensure_warm(cancel)
+            yield from self._stream_ollama(question, context, stats, cancel)
+            return
+
+        t0 = time.perf_counter()
+        answer = self.generate_answer(question, context, stats=stats)
+        elapsed = time.perf_counter() - t0
+        stats.update({"ttft_s": elapsed, "total_s": elapsed, "tokens": None, "tokens_per_s": None})
+        yield answer
+
+    def _build_ollama_prompt(self, question: str, context: str) -> str:
+        # Variable parts strictly after the fixed prefix, so its cached evaluation is reused
+        return f"""{OLLAMA_PROMPT_PREFIX}{context}
 
 QUESTION: {question}
 
 ANSWER (2-3 paragraphs):"""
+
+    def _ollama_payload(self, prompt: str, stream: bool) -> dict:
+        return {
+            "model": self.ollama_model or "meditron:latest",
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {
+                "temperature": 0.1,
+                "top_p": 0.9,
+                "top_k": 40,
+                "num_predict": 512,
+                "stop": ["\n\n\n", "QUESTION:", "CONTEXT:"]
+            }
+        }
+
+    @staticmethod
+    def _record_eval(stats: dict, data: dict):
+        """Token counts and rates from Ollama's final response (durations are in nanoseconds)."""
+        if data.get("eval_count") and data.get("eval_duration"):
+            stats["tokens"] = data["eval_count"]
+            stats["tokens_per_s"] = data["eval_count"] / (data["eval_duration"] / 1e9)
+        if data.get("prompt_eval_count") and data.get("prompt_eval_duration"):
+            stats["prompt_tokens"] = data["prompt_eval_count"]
+            stats["prompt_tokens_per_s"] = data["prompt_eval_count"] / (data["prompt_eval_duration"] / 1e9)
+        if data.get("load_duration"):
+            stats["load_s"] = data["load_duration"] / 1e9
+
+    @staticmethod
+    def clean_answer(text: str) -> str:
+        return text.replace("ANSWER:", "").replace("Answer:", "").strip()
+
+    def _generate_ollama(self, question: str, context: str, stats: Optional[dict] = None) -> str:
+        stats = {} if stats is None else stats
+        prompt = self._build_ollama_prompt(question, context)
         try:
-            r = requests.post(
+            r = self.session.post(
                 f"{self.ollama_base_url}/api/generate",
-                json={
-                    "model": self.ollama_model or "meditron:latest",
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,
-                        "top_p": 0.9,
-                        "top_k": 40,
-                        "num_predict": 512,
-                        "stop": ["\n\n\n", "QUESTION:", "CONTEXT:"]
-                    }
-                },
+                json=self._ollama_payload(prompt, stream=False),
                 timeout=30
             )
             if r.status_code == 200:
-                ans = (r.json().get("response") or "").strip()
-                ans = ans.replace("ANSWER:", "").replace("Answer:", "").strip()
+                data = r.json()
+                self._record_eval(stats, data)
+                ans = self.clean_answer(data.get("response") or "")
                 return ans or "I could not generate an answer."
+            stats["fallback"] = True
             return self._generate_fallback(question, context)
         except Exception as e:
             print(f"⚠️ Ollama error: {e}")
+            stats["error"] = str(e)
+            stats["fallback"] = True
             return self._generate_fallback(question, context)
 
-    def _generate_claude(self, question: str, context: str, enhanced_mode: bool = True) -> str:
+    def _stream_ollama(self, question: str, context: str, stats: dict, cancel=None) -> Iterator[str]:
+        if cancel is not None and cancel.cancelled:
+            # Deadline passed during warm-up or in the queue: don't start a generation nobody reads
+            stats["cancelled"] = True
+            return
+        prompt = self._build_ollama_prompt(question, context)
+        t0 = time.perf_counter()
+        first_token_at = None
+        n_chunks = 0
+        try:
+            # Read timeout applies between chunks, not to the whole answer
+            with self.session.post(
+                f"{self.ollama_base_url}/api/generate",
+                json=self._ollama_payload(prompt, stream=True),
+                stream=True,
+                timeout=(5, 30)
+            ) as r:
+                if r.status_code != 200:
+                    stats["fallback"] = True
+                    yield self._generate_fallback(question, context)
+                    return
+                if cancel is not None:
+                    # Closing the socket from the watchdog thread unblocks iter_lines
+                    cancel.on_cancel(r.close)
+                for line in r.iter_lines():
+                    if cancel is not None and cancel.cancelled:
+                        stats["cancelled"] = True
+                        break
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    token = data.get("response") or ""
+                    if token:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        n_chunks += 1
+                        yield token
+                    if data.get("done"):
+                        self._record_eval(stats, data)
+                        break
+        except Exception as e:
+            if cancel is not None and cancel.cancelled:
+                stats["cancelled"] = True
+                return
+            print(f"⚠️ Ollama stream error: {e}")
+            stats["error"] = str(e)
+            if first_token_at is None:
+                stats["fallback"] = True
+                yield self._generate_fallback(question, context)
+        finally:
+            total = time.perf_counter() - t0
+            stats["total_s"] = total
+            stats["ttft_s"] = (first_token_at - t0) if first_token_at is not None else None
+            if "tokens_per_s" not in stats and first_token_at is not None and total > first_token_at - t0:
+                stats["tokens"] = n_chunks
+                stats["tokens_per_s"] = n_chunks / (total - (first_token_at - t0))
+
+    def _generate_claude(self, question: str, context: str, enhanced_mode: bool = True,
+                         stats: Optional[dict] = None) -> str:
+        stats = {} if stats is None else stats
         prompt = f"""You are a medical information assistant. Provide a concise, evidence-based answer using ONLY the provided context.
 
 Context:
@@ -116,11 +407,15 @@ Provide a brief answer (2-3 paragraphs) with specific clinical details. If infor
                 temperature=0.1,
                 messages=[{"role": "user", "content": prompt}],
             )
-            return getattr(msg, "content", [{"text": ""}])[0].get("text", "").strip() or \
-                   "Claude returned no content."
+            text = "".join(getattr(block, "text", "") for block in (getattr(msg, "content", None) or [])).strip()
+            if text:
+                return text
+            stats["error"] = "Claude returned no content"
         except Exception as e:
             print(f"⚠️ Claude error: {e}")
-            return self._generate_fallback(question, context)
+            stats["error"] = str(e)
+        stats["fallback"] = True
+        return self._generate_fallback(question, context)
 
     def _generate_fallback(self, question: str, context: str) -> str:
         lines = [ln.strip() for ln in context.splitlines() if ln.strip()]
@@ -145,4 +440,5 @@ Provide a brief answer (2-3 paragraphs) with specific clinical details. If infor
             "backend": self.backend,
             "model": self.ollama_model if self.backend == "ollama" else self.backend,
             "ready": self.backend in ["ollama", "claude", "fallback"],
+            "warm": self.warm.is_set() and self.warm_error is None,
         }
@@ -0,0 +1,116 @@
+"""
+Request coalescing for concurrent dense lookups.
+
+Every Streamlit session / API request shares one retriever. Without
+batching, N users searching at once cost N single-row encodes and N
+single-row index.search calls. MicroBatcher queues the lookups that arrive
+within a short window (MEDGPT_BATCH_WINDOW_MS, default 5 ms) and runs them
+as one batched encode plus one multi-query index.search, up to
+MEDGPT_MAX_BATCH queries at a time, then hands each caller its own row.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from utils.tracing import record
+
+BATCH_WINDOW_MS = float(os.getenv("MEDGPT_BATCH_WINDOW_MS", "5"))  # 0 disables batching
+MAX_BATCH = int(os.getenv("MEDGPT_MAX_BATCH", "32"))
+
+class MicroBatcher:
+    """Collects (query, k) lookups from many threads into batched encode + search calls"""
+
+    def __init__(self, index_fn: Callable, embed_queries: Callable[[List[str]], List],
+                 window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH):
+        # index_fn returns the current FAISS index (the app may swap in an ANN index)
+        self.index_fn = index_fn
+        self.embed_queries = embed_queries
+        self.window_s = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {"batches": 0, "queries": 0, "largest": 0}
+
+    def submit(self, query: str, k: int = 0, timeout: Optional[float] = None) -> Tuple[List[float], List[int]]:
+        """
+        Block until the batch containing this query has run (TimeoutError after
+        timeout seconds). Returns (query embedding, top-k index positions); k=0 only embeds.
+        """
+        self._ensure_started()
+        future = Future()
+        t0 = time.perf_counter()
+        self._queue.put((query, k, future))
+        vector, hits, timings = future.result(timeout)
+        # The batch ran on another thread: attribute its stages to the caller's trace
+        waited = time.perf_counter() - t0
+        record("query_embed", timings["embed_s"])
+        if k > 0:
+            record("vector_search", timings["search_s"])
+        record("batch_wait", max(0.0, waited - timings["embed_s"] - timings["search_s"]))
+        return vector, hits
+
+    def embed(self, query: str) -> List[float]:
+        return self.submit(query, 0)[0]
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                    self._thread.start()
+
+    def _collect(self) -> list:
+        """First waiting request, plus whatever arrives within the window."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except BaseException as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process(self, batch: list):
+        queries = [q for q, _, _ in batch]
+        t0 = time.perf_counter()
+        vectors = self.embed_queries(queries)  # one encode for every cache miss in the batch
+        t1 = time.perf_counter()
+        k_max = max(k for _, k, _ in batch)
+        positions = None
+        if k_max > 0:
+            rows = [i for i, (_, k, _) in enumerate(batch) if k > 0]
+            matrix = np.asarray([vectors[i] for i in rows], dtype=np.float32)
+            _, ids = self.index_fn().search(matrix, k_max)  # one multi-query search
+            positions = dict(zip(rows, ids))
+        timings = {"embed_s": t1 - t0, "search_s": time.perf_counter() - t1}
+
+        self.stats["batches"] += 1
+        self.stats["queries"] += len(batch)
+        self.stats["largest"] = max(self.stats["largest"], len(batch))
+        for i, (_, k, future) in enumerate(batch):
+            hits = []
+            if k > 0:
+                hits = [int(p) for p in positions[i][:k] if p >= 0]
+            future.set_result((vectors[i], hits, timings))
+
+    def summary(self) -> str:
+        batches = self.stats["batches"]
+        avg = self.stats["queries"] / batches if batches else 0.0
+        return f"{batches} batches • {avg:.1f} queries avg • {self.stats['largest']} max"
@@ -0,0 +1,144 @@
+"""
+Memory-mapped FAISS index + SQLite docstore for fast cold start.
+
+FAISS.load_local reads index.faiss into RAM and unpickles index.pkl (every
+chunk's text and metadata) before the first query. MmapVectorStore maps
+the index file instead and keeps chunks in docstore.sqlite, reading only
+the rows for the top-k hits, so startup time and resident memory stay
+almost flat as the corpus grows. Decoded chunks are kept in a small LRU
+(MEDGPT_DOC_CACHE), so chunks that keep coming up skip SQLite and JSON.
+
+Create docstore.sqlite for an existing vectorstore with:
+    python utils/mmap_store.py vectorstore
+(preprocess_documents.py writes it automatically.)
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+DOCSTORE_FILE = "docstore.sqlite"
+DOC_CACHE_SIZE = int(os.getenv("MEDGPT_DOC_CACHE", "4096"))  # decoded chunks kept in memory; 0 disables
+
+class Document:
+    """Minimal stand-in for LangChain's Document (page_content + metadata)"""
+    __slots__ = ("page_content", "metadata")
+
+    def __init__(self, page_content: str, metadata: Optional[Dict] = None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+
+    def __repr__(self):
+        return f"Document(page_content={self.page_content[:40]!r}..., metadata={self.metadata})"
+
+def export_docstore(vs, vs_dir):
+    """Write the LangChain FAISS docstore to docstore.sqlite in index order."""
+    vs_dir = Path(vs_dir)
+    tmp = vs_dir / (DOCSTORE_FILE + ".tmp")
+    tmp.unlink(missing_ok=True)
+    conn = sqlite3.connect(str(tmp))
+    conn.execute("CREATE TABLE chunks (pos INTEGER PRIMARY KEY, doc_id TEXT, page_content TEXT, metadata TEXT)")
+    rows = []
+    for pos in range(vs.index.ntotal):
+        doc_id = vs.index_to_docstore_id[pos]
+        doc = vs.docstore.search(doc_id)
+        rows.append((pos, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+        if len(rows) >= 5000:
+            conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+            rows = []
+    if rows:
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    os.replace(tmp, vs_dir / DOCSTORE_FILE)
+    print(f"✓ Docstore exported ({vs.index.ntotal} chunks → {DOCSTORE_FILE})")
+
+def read_index_mmap(path):
+    """Map the index file instead of reading it; fall back to a normal read."""
+    import faiss  # imported on first load, not when the app starts
+
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(str(path), flags)
+    except RuntimeError as e:
+        print(f"⚠️ mmap not supported for {Path(path).name} ({e}); reading into memory")
+        return faiss.read_index(str(path))
+
+class MmapVectorStore:
+    """
+    Read-only vector store over a memory-mapped FAISS index and docstore.sqlite.
+
+    Mirrors the parts of LangChain's FAISS API the app uses: embeddings,
+    index, similarity_search(_by_vector) and similarity_search_with_score_by_vector.
+    """
+
+    def __init__(self, vs_dir, embeddings, index_path=None, doc_cache_size: int = DOC_CACHE_SIZE):
+        self.vs_dir = Path(vs_dir)
+        self.embeddings = embeddings
+        self.index = read_index_mmap(index_path or self.vs_dir / "index.faiss")
+        db = self.vs_dir / DOCSTORE_FILE
+        if not db.exists():
+            raise FileNotFoundError(f"{db} not found; run: python utils/mmap_store.py {self.vs_dir}")
+        self._conn = sqlite3.connect(f"file:{db}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._docs = OrderedDict()  # pos -> Document, most recently used last
+        self.doc_cache_size = doc_cache_size
+        n_docs = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        if n_docs != self.index.ntotal:
+            raise ValueError(f"docstore has {n_docs} chunks but index has {self.index.ntotal}; re-run preprocessing")
+
+    def documents_at(self, positions: Sequence[int]) -> List[Document]:
+        """Fetch documents by index position (order preserved, -1 skipped)."""
+        wanted = [int(p) for p in positions if p >= 0]
+        if not wanted:
+            return []
+        with self._lock:
+            by_pos = {}
+            for p in wanted:
+                doc = self._docs.get(p)
+                if doc is not None:
+                    self._docs.move_to_end(p)
+                    by_pos[p] = doc
+            missing = [p for p in wanted if p not in by_pos]
+            if missing:
+                marks = ",".join("?" * len(missing))
+                rows = self._conn.execute(
+                    f"SELECT pos, page_content, metadata FROM chunks WHERE pos IN ({marks})", missing
+                ).fetchall()
+                for pos, text, meta in rows:
+                    by_pos[pos] = self._docs[pos] = Document(text, json.loads(meta))
+                while len(self._docs) > self.doc_cache_size:
+                    self._docs.popitem(last=False)
+        return [by_pos[p] for p in wanted if p in by_pos]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4):
+        query = np.asarray([embedding], dtype=np.float32)
+        scores, positions = self.index.search(query, k)
+        docs = self.documents_at(positions[0])
+        valid = [s for s, p in zip(scores[0], positions[0]) if p >= 0]
+        return list(zip(docs, (float(s) for s in valid)))
+
+    def similarity_search_by_vector(self, embedding, k: int = 4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+def main():
+    """Export docstore.sqlite for an existing vectorstore (needs LangChain once)."""
+    vs_dir = sys.argv[1] if len(sys.argv) > 1 else "vectorstore"
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.embeddings import FakeEmbeddings
+
+    # Embeddings are not needed to read the docstore
+    vs = FAISS.load_local(vs_dir, FakeEmbeddings(size=1), allow_dangerous_deserialization=True)
+    export_docstore(vs, vs_dir)
+
+if __name__ == "__main__":
+    main()
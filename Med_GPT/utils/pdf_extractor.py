@@ -3,17 +3,22 @@ Enhanced PDF extraction for large medical textbooks like Harrison's
 """
 from PyPDF2 import PdfReader
 import re
-from typing import List, Dict
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 class EnhancedPDFExtractor:
     """Better PDF extraction with chapter detection and filtering"""
     
     def __init__(self):
         self.min_text_length = 50  # Skip pages with too little text
+        self.progress_every = 50  # Print progress every N kept pages
     
-    def extract_from_pdf(self, pdf_path: str, max_pages: int = None) -> str:
+    def iter_pages(self, pdf_path: str, max_pages: int = None) -> Iterator[Tuple[int, str]]:
         """
-        Extract text from PDF with optional page limit
+        Yield (page_number, text) one page at a time, skipping near-empty pages
+        
+        Memory stays bounded by a single page no matter how large the book is.
         
         Args:
             pdf_path: Path to PDF file
@@ -21,67 +26,122 @@ class EnhancedPDFExtractor:
         """
         try:
             reader = PdfReader(pdf_path)
-            total_pages = len(reader.pages)
-            
-            print(f"📖 PDF has {total_pages} pages")
-            
-            if max_pages:
-                print(f"⚠️ Limiting to first {max_pages} pages for faster processing")
-                pages_to_process = min(max_pages, total_pages)
-            else:
-                pages_to_process = total_pages
+        except Exception as e:
+            raise Exception(f"Error reading PDF: {str(e)}")
+        total_pages = len(reader.pages)
+        
+        print(f"📖 PDF has {total_pages} pages")
+        
+        if max_pages:
+            print(f"⚠️ Limiting to first {max_pages} pages for faster processing")
+            pages_to_process = min(max_pages, total_pages)
+        else:
+            pages_to_process = total_pages
+        
+        processed = 0
+        t_start = time.perf_counter()
+        slowest = (0.0, 0)
+        
+        for i in range(pages_to_process):
+            t0 = time.perf_counter()
+            page_text = reader.pages[i].extract_text() or ""
+            dt = time.perf_counter() - t0
+            if dt > slowest[0]:
+                slowest = (dt, i + 1)
             
-            text = ""
-            processed = 0
+            # Skip if page has very little text (likely image/diagram)
+            if len(page_text.strip()) < self.min_text_length:
+                continue
             
-            for i in range(pages_to_process):
-                page_text = reader.pages[i].extract_text()
-                
-                # Skip if page has very little text (likely image/diagram)
-                if len(page_text.strip()) < self.min_text_length:
-                    continue
-                
-                text += page_text + "\n\n"
-                processed += 1
-                
-                # Progress indicator
-                if processed % 50 == 0:
-                    print(f"  Processed {processed}/{pages_to_process} pages...")
+            processed += 1
             
-            print(f"✅ Extracted text from {processed} pages")
-            return text
+            # Progress indicator with per-page timing and ETA
+            if processed % self.progress_every == 0:
+                elapsed = time.perf_counter() - t_start
+                per_page = elapsed / (i + 1)
+                eta = per_page * (pages_to_process - i - 1)
+                print(f"  Processed {i + 1}/{pages_to_process} pages "
+                      f"({per_page * 1000:.0f} ms/page, ~{eta:.0f}s left)...")
             
-        except Exception as e:
-            raise Exception(f"Error reading PDF: {str(e)}")
+            yield i + 1, page_text
+        
+        elapsed = time.perf_counter() - t_start
+        print(f"✅ Extracted text from {processed} pages in {elapsed:.1f}s "
+              f"(slowest: page {slowest[1]}, {slowest[0] * 1000:.0f} ms)")
     
-    def extract_specific_chapters(self, pdf_path: str, chapter_keywords: List[str]) -> str:
+    def iter_chapter_pages(self, pdf_path: str, chapter_keywords: List[str]) -> Iterator[Tuple[int, str]]:
         """
-        Extract only specific chapters based on keywords
+        Yield (page_number, text) for pages inside chapters matching the keywords
         
-        Example: extract_specific_chapters(pdf, ['Diabetes', 'Hypertension'])
+        Example: iter_chapter_pages(pdf, ['Diabetes', 'Hypertension'])
         """
         reader = PdfReader(pdf_path)
-        text = ""
         in_target_chapter = False
+        keywords = [k.lower() for k in chapter_keywords]
         
-        for page in reader.pages:
-            page_text = page.extract_text()
+        for i, page in enumerate(reader.pages):
+            page_text = page.extract_text() or ""
+            head = page_text[:200].lower()
             
             # Check if this page starts a target chapter
-            for keyword in chapter_keywords:
-                if keyword.lower() in page_text[:200].lower():  # Check first 200 chars
+            for keyword, original in zip(keywords, chapter_keywords):
+                if keyword in head:  # Check first 200 chars
                     in_target_chapter = True
-                    print(f"📌 Found chapter: {keyword}")
+                    print(f"📌 Found chapter: {original} (page {i + 1})")
                     break
             
             if in_target_chapter:
-                text += page_text + "\n\n"
+                yield i + 1, page_text
                 
                 # Stop if we hit a new non-target chapter
-                if "CHAPTER" in page_text[:100].upper() and not any(k.lower() in page_text[:200].lower() for k in chapter_keywords):
+                if "CHAPTER" in page_text[:100].upper() and not any(k in head for k in keywords):
                     in_target_chapter = False
+    
+    def extract_to_file(self, pages: Iterable[Tuple[int, str]], output_file: str, clean: bool = True) -> Dict:
+        """
+        Write pages to output_file as they are extracted
+        
+        Args:
+            pages: Iterator from iter_pages / iter_chapter_pages
+            output_file: Destination text file (parent folder is created)
+            clean: Apply clean_medical_text per page
+        
+        Returns: {pages, chars, seconds}
+        """
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        t0 = time.perf_counter()
+        n_pages = 0
+        n_chars = 0
+        
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for _, page_text in pages:
+                if clean:
+                    page_text = self.clean_medical_text(page_text)
+                    sep = " " if n_pages else ""
+                else:
+                    sep = "\n\n" if n_pages else ""
+                f.write(sep + page_text)
+                n_pages += 1
+                n_chars += len(sep) + len(page_text)
+        
+        return {"pages": n_pages, "chars": n_chars, "seconds": time.perf_counter() - t0}
+    
+    def extract_from_pdf(self, pdf_path: str, max_pages: int = None) -> str:
+        """
+        Extract text from PDF with optional page limit
+        
+        Prefer iter_pages / extract_to_file for large books; this keeps the
+        whole text in memory.
+        """
+        return "".join(page_text + "\n\n" for _, page_text in self.iter_pages(pdf_path, max_pages))
+    
+    def extract_specific_chapters(self, pdf_path: str, chapter_keywords: List[str]) -> str:
+        """
+        Extract only specific chapters based on keywords
         
-        return text
+        Example: extract_specific_chapters(pdf, ['Diabetes', 'Hypertension'])
+        """
+        return "".join(page_text + "\n\n" for _, page_text in self.iter_chapter_pages(pdf_path, chapter_keywords))
     
     def clean_medical_text(self, text: str) -> str:
         """Clean extracted text for better processing"""
@@ -0,0 +1,208 @@
+"""
+Rendered-page cache for the PDF viewer.
+
+Rendering a page means opening the PDF, searching for the excerpt to
+highlight and rasterizing at 2.5×, which Streamlit would otherwise redo
+on every rerun. PNGs are cached by (file, page, zoom, highlight) in a
+memory LRU backed by a disk tier under .cache/pdf_pages; open documents
+are kept in a small pool; and prefetch() renders pages in the background
+so switching between sources is instant.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+RENDER_ZOOM = 2.5
+CACHE_DIR = ".cache/pdf_pages"
+MAX_MEMORY_BYTES = 64 * 1024 * 1024
+MAX_DISK_BYTES = 512 * 1024 * 1024
+MAX_OPEN_DOCS = 8
+
+class DocumentPool:
+    """Bounded LRU of open fitz.Document handles, reopened when the file changes"""
+
+    def __init__(self, max_open: int = MAX_OPEN_DOCS):
+        self.max_open = max_open
+        self._docs = OrderedDict()
+
+    def get(self, pdf_path: str):
+        path = Path(pdf_path).resolve()
+        key = (str(path), path.stat().st_mtime_ns)
+        doc = self._docs.get(key)
+        if doc is None:
+            import fitz  # PyMuPDF, loaded with the first rendered page rather than at app start
+            doc = fitz.open(str(path))
+            self._docs[key] = doc
+            while len(self._docs) > self.max_open:
+                _, old = self._docs.popitem(last=False)
+                old.close()
+        self._docs.move_to_end(key)
+        return doc
+
+    def close(self):
+        for doc in self._docs.values():
+            doc.close()
+        self._docs.clear()
+
+class PageRenderCache:
+    """Memory + disk LRU of rendered PDF pages"""
+
+    def __init__(self, cache_dir=CACHE_DIR, zoom: float = RENDER_ZOOM,
+                 max_memory_bytes: int = MAX_MEMORY_BYTES, max_disk_bytes: int = MAX_DISK_BYTES,
+                 max_open_docs: int = MAX_OPEN_DOCS):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.zoom = zoom
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        # MuPDF is not thread-safe: every fitz call goes through this lock
+        self._render_lock = threading.Lock()
+        self._docs = DocumentPool(max_open_docs)
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-prefetch")
+        self._queued = set()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "renders": 0, "render_s": 0.0}
+
+    def key(self, pdf_path: str, page_num: int, highlight: Optional[str] = None) -> str:
+        path = Path(pdf_path).resolve()
+        st = path.stat()
+        raw = f"{path}|{st.st_size}|{st.st_mtime_ns}|{page_num}|{self.zoom}|{highlight or ''}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_png(self, pdf_path: str, page_num: int, highlight: Optional[str] = None) -> bytes:
+        key = self.key(pdf_path, page_num, highlight)
+        png = self._from_memory(key)
+        if png is not None:
+            self._count("memory_hits")
+            return png
+        png = self._from_disk(key)
+        if png is not None:
+            self._count("disk_hits")
+        else:
+            with self._render_lock:
+                # A prefetch may have rendered it while we waited for the lock
+                png = self._from_memory(key)
+                if png is None:
+                    png = self._render(pdf_path, page_num, highlight)
+                    self._to_disk(key, png)
+        self._to_memory(key, png)
+        return png
+
+    def prefetch(self, items: Iterable[Tuple[str, int, Optional[str]]]):
+        """Render (pdf_path, page_num, highlight) items in the background if not cached."""
+        for item in items:
+            try:
+                key = self.key(*item)
+            except OSError:
+                continue
+            with self._lock:
+                if key in self._memory or key in self._queued:
+                    continue
+                self._queued.add(key)
+            self._prefetcher.submit(self._prefetch_one, key, item)
+
+    def _prefetch_one(self, key, item):
+        try:
+            self.get_png(*item)
+        except Exception as e:
+            print(f"⚠️ Prefetch failed for {Path(item[0]).name} p{item[1] + 1}: {e}")
+        finally:
+            with self._lock:
+                self._queued.discard(key)
+
+    # ---------- rendering ----------
+    def _render(self, pdf_path: str, page_num: int, highlight: Optional[str]) -> bytes:
+        """Rasterize one page; the caller holds _render_lock."""
+        t0 = time.perf_counter()
+        doc = self._docs.get(pdf_path)
+        if not isinstance(page_num, int) or not (0 <= page_num < len(doc)):
+            page_num = 0
+        page = doc[page_num]
+        search_text = (highlight or "")[:120].strip()
+        added = []
+        if search_text:
+            try:
+                for inst in page.search_for(search_text)[:3]:
+                    added.append(page.add_highlight_annot(inst))
+            except Exception:
+                pass
+        import fitz
+        pix = page.get_pixmap(matrix=fitz.Matrix(self.zoom, self.zoom))
+        png = pix.tobytes("png")
+        # Highlights live on the pooled document: remove ours so later renders stay clean
+        for annot in added:
+            page.delete_annot(annot)
+        self._count("renders")
+        self._count("render_s", time.perf_counter() - t0)
+        return png
+
+    def _count(self, stat: str, amount: float = 1):
+        # Called from the Streamlit thread and the prefetch thread
+        with self._lock:
+            self.stats[stat] += amount
+
+    # ---------- memory tier ----------
+    def _from_memory(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            png = self._memory.get(key)
+            if png is not None:
+                self._memory.move_to_end(key)
+            return png
+
+    def _to_memory(self, key: str, png: bytes):
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = png
+            self._memory_bytes += len(png)
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, old = self._memory.popitem(last=False)
+                self._memory_bytes -= len(old)
+
+    # ---------- disk tier ----------
+    def _from_disk(self, key: str) -> Optional[bytes]:
+        fp = self.cache_dir / f"{key}.png"
+        try:
+            png = fp.read_bytes()
+        except OSError:
+            return None
+        fp.touch()  # mtime doubles as last-used time for eviction
+        return png
+
+    def _to_disk(self, key: str, png: bytes):
+        fp = self.cache_dir / f"{key}.png"
+        tmp = fp.with_suffix(".tmp")
+        try:
+            tmp.write_bytes(png)
+            tmp.replace(fp)
+            self._evict_disk()
+        except OSError as e:
+            print(f"⚠️ Could not write page cache: {e}")
+
+    def _evict_disk(self):
+        files = [(f.stat().st_mtime, f.stat().st_size, f) for f in self.cache_dir.glob("*.png")]
+        total = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            f.unlink(missing_ok=True)
+            total -= size
+
+    def summary(self) -> str:
+        with self._lock:
+            stats, pages = dict(self.stats), len(self._memory)
+        renders = stats["renders"]
+        avg = stats["render_s"] / renders * 1000 if renders else 0.0
+        return (f"{pages} pages in memory • {stats['memory_hits']} memory / "
+                f"{stats['disk_hits']} disk hits • {renders} renders ({avg:.0f} ms avg)")
+
+    def close(self):
+        self._prefetcher.shutdown(wait=False, cancel_futures=True)
+        with self._render_lock:
+            self._docs.close()
@@ -1,69 +1,207 @@
 """
 Preprocess all medical documents → build FAISS vectorstore
-Usage:  python preprocess_documents.py
+Usage:  python preprocess_documents.py          (incremental: only new/changed files)
+        python preprocess_documents.py --full   (rebuild everything)
+        python preprocess_documents.py --index-type hnsw --recall-report
+        python preprocess_documents.py --full --profile   (time/memory per stage, see utils/profiling.py)
+
+Ingestion runs as a pipeline: files are loaded in a process pool, split
+by a chunker thread and embedded in batches, with bounded queues between
+the stages so memory stays flat and the stages overlap.
+
+Extracted PDF pages and computed embeddings are checkpointed under
+vectorstore/.checkpoint, so an interrupted run resumes where it stopped.
 """
 
 import os
+import json
+import time
+import queue
 import pickle
+import hashlib
+import argparse
+import sys
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 
-# ✅ Use the modern embedding import when available
-try:
-    from langchain_huggingface import HuggingFaceEmbeddings
-except ImportError:
-    from langchain_community.embeddings import HuggingFaceEmbeddings  # fallback
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from utils.checkpoint import IngestCheckpoint
+from utils.mmap_store import export_docstore
+from utils.bm25_index import BM25Index, flat_stamp
+from utils.embeddings import EMBED_BACKENDS, EmbeddingPool, make_embeddings, register_langchain
+from utils.profiling import PROFILE_DIR, StageProfiler, active_profiler, profiled, stage
+from utils.ann_index import (INDEX_TYPES, ann_paths, read_ann_config, build_index, flat_vectors,
+                             write_ann_index, recall_report, print_recall_report)
 
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+register_langchain()  # FAISS.from_embeddings / load_local take our SentenceEmbeddings
 
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 DOCS_DIR = "documents"
 VS_DIR = "vectorstore"
+QUERIES_FILE = "queries.json"
+MANIFEST_FILE = "manifest.json"
+SUPPORTED_EXTS = (".pdf", ".txt", ".docx")
+EMBED_BATCH_SIZE = 64
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+CHECKPOINT_DIR = ".checkpoint"  # inside the vectorstore folder
+CHECKPOINT_PAGES_EVERY = 25
+PROGRESS_EVERY_S = 5.0
+
+def _pypdf_metadata(fp) -> dict:
+    """Metadata PyPDFLoader gives the first page of fp (file info, total_pages, page_label, ...)."""
+    first = next(iter(PyPDFLoader(str(fp)).lazy_load()), None)
+    return dict(first.metadata) if first else {}
+
+def load_pdf_pages(fp, checkpoint=None, key=None):
+    """
+    Read a PDF page by page, appending each page to the checkpoint so a
+    restarted run continues after the last saved page instead of page 1.
+    Pages carry the same text and metadata as load_file's PyPDFLoader path.
+    """
+    from pypdf import PdfReader
+
+    fp = Path(fp)
+    saved = checkpoint.load_pages(key) if checkpoint else []
+    texts = {rec["page"]: rec["text"] for rec in saved}
+    reader = PdfReader(str(fp))
+    total = len(reader.pages)
+    if texts:
+        print(f"↻ Resuming {fp.name} at page {len(texts) + 1}/{total}")
+
+    buffer = []
+    for i in range(total):
+        if i in texts:
+            continue
+        texts[i] = reader.pages[i].extract_text() or ""
+        buffer.append({"page": i, "text": texts[i]})
+        if checkpoint and len(buffer) >= CHECKPOINT_PAGES_EVERY:
+            checkpoint.append_pages(key, buffer)
+            buffer = []
+    if checkpoint and buffer:
+        checkpoint.append_pages(key, buffer)
+
+    # Whatever keys this langchain version's PyPDFLoader sets, with load_file's source/file_path
+    base = _pypdf_metadata(fp) if total else {}
+    base.update(source=fp.name, file_path=str(fp))
+    labels = reader.page_labels
+    docs = []
+    for i in range(total):
+        metadata = dict(base, page=i)
+        if "page_label" in base:
+            metadata["page_label"] = labels[i]
+        docs.append(Document(page_content=texts[i].strip(), metadata=metadata))
+    return docs
+
+def load_file(fp, checkpoint_root=None, key=None):
+    """Load one document file into LangChain Documents (one per PDF page)."""
+    fp = Path(fp)
+    ext = fp.suffix.lower()
+    if ext == ".pdf" and checkpoint_root:
+        return load_pdf_pages(fp, IngestCheckpoint(checkpoint_root), key)
+    if ext == ".pdf":
+        loader = PyPDFLoader(str(fp))
+    elif ext == ".txt":
+        loader = TextLoader(str(fp))
+    elif ext == ".docx":
+        loader = Docx2txtLoader(str(fp))
+    else:
+        return []
+    items = loader.load()
+    for d in items:
+        d.metadata["source"] = fp.name
+        d.metadata["file_path"] = str(fp)
+    return items
 
 def load_documents(docs_folder=DOCS_DIR):
     docs = []
     p = Path(docs_folder)
     p.mkdir(exist_ok=True)
     for filename in os.listdir(p):
-        fp = p / filename
+        if not filename.lower().endswith(SUPPORTED_EXTS):
+            continue
         try:
-            if filename.lower().endswith(".pdf"):
-                loader = PyPDFLoader(str(fp))
-            elif filename.lower().endswith(".txt"):
-                loader = TextLoader(str(fp))
-            elif filename.lower().endswith(".docx"):
-                loader = Docx2txtLoader(str(fp))
-            else:
-                continue
-            items = loader.load()
-            for d in items:
-                d.metadata["source"] = filename
-                d.metadata["file_path"] = str(fp)
-            docs.extend(items)
+            docs.extend(load_file(p / filename))
             print(f"✓ Loaded {filename}")
         except Exception as e:
             print(f"✗ Error loading {filename}: {e}")
     return docs
 
-def create_chunks(documents, chunk_size=500, overlap=100):
-    splitter = RecursiveCharacterTextSplitter(
+def file_sha256(fp, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_ids(sha, n):
+    """Stable vector ids: content hash + chunk position."""
+    return [f"{sha[:16]}:{i}" for i in range(n)]
+
+def load_manifest(save_path=VS_DIR):
+    fp = Path(save_path) / MANIFEST_FILE
+    if not fp.exists():
+        return None
+    with open(fp, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def embedding_settings(emb) -> dict:
+    """Manifest fields the stored vectors depend on; a change means a full rebuild."""
+    return {"embed_model": EMBED_MODEL, "embed_backend": emb.backend, "embed_quantization": emb.quantization}
+
+def manifest_matches(manifest, settings) -> bool:
+    # Manifests from before the backend was recorded were built with fp32 torch
+    recorded = {"embed_backend": "torch", "embed_quantization": "fp32", **manifest}
+    return all(recorded.get(k) == v for k, v in settings.items())
+
+def save_manifest(manifest, save_path=VS_DIR):
+    fp = Path(save_path) / MANIFEST_FILE
+    tmp = fp.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, fp)
+
+def make_splitter(chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=overlap,
         separators=["\n\n", "\n", ". ", " ", ""],
     )
-    chunks = splitter.split_documents(documents)
+
+def create_chunks(documents, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    chunks = make_splitter(chunk_size, overlap).split_documents(documents)
     print(f"✓ Created {len(chunks)} chunks from {len(documents)} docs")
     return chunks
 
-def create_vectorstore(chunks, save_path=VS_DIR):
+def create_vectorstore(chunks, save_path=VS_DIR, ids=None):
     os.makedirs(save_path, exist_ok=True)
-    emb = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+    with stage("model_load"):
+        emb = make_embeddings(EMBED_MODEL)
     print("🔧 Building FAISS index ...")
-    vs = FAISS.from_documents(chunks, emb)
+    with stage("embed"):
+        vs = FAISS.from_documents(chunks, emb, ids=ids)
+    save_vectorstore(vs, save_path)
+    return vs
+
+def save_vectorstore(vs, save_path=VS_DIR):
+    with stage("index_write"):
+        _write_vectorstore(vs, save_path)
+    build_bm25_index(vs, save_path)
+
+def _write_vectorstore(vs, save_path):
     vs.save_local(save_path)
-    print(f"✓ Vectorstore saved to '{save_path}'")
+    print(f"✓ Vectorstore saved to '{save_path}' ({vs.index.ntotal} vectors)")
 
+    # Metadata in index order, rebuilt from the docstore so it stays in sync after deletes
+    chunks = [vs.docstore.search(vs.index_to_docstore_id[i]) for i in range(vs.index.ntotal)]
     meta = [{
         "content": ch.page_content[:500],
         "source": ch.metadata.get("source", "unknown"),
@@ -73,17 +211,441 @@ def create_vectorstore(chunks, save_path=VS_DIR):
     with open(Path(save_path) / "chunks_metadata.pkl", "wb") as f:
         pickle.dump(meta, f)
     print(f"✓ Metadata saved ({len(meta)} entries)")
+
+    # Random-access copy of the docstore for the app's mmap load mode
+    export_docstore(vs, save_path)
+
+def build_bm25_index(vs, save_path=VS_DIR):
+    """Lexical first stage for hybrid retrieval (same positions as the FAISS index)."""
+    with stage("bm25_build"):
+        texts = (vs.docstore.search(vs.index_to_docstore_id[i]).page_content for i in range(vs.index.ntotal))
+        BM25Index.build(texts).save(save_path)
+
+def _load_for_pipeline(fp, checkpoint_root=None, key=None, profile=False):
+    """
+    Process-pool task: returns (documents, load seconds, profile export or None).
+    With profile=True the worker profiles its own parse stage for the parent to merge.
+    """
+    profiler = StageProfiler().start() if profile else None
+    t0 = time.perf_counter()
+    try:
+        with stage("parse"):
+            docs = load_file(fp, checkpoint_root, key)
+    finally:
+        if profiler:
+            profiler.stop()
+    return docs, time.perf_counter() - t0, profiler.export() if profiler else None
+
+def _put(q, item, stop):
+    """Blocking put that gives up once the pipeline is stopping."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def run_ingest_pipeline(files, emb, vs=None, on_file_done=None, workers=None, batch_size=EMBED_BATCH_SIZE,
+                        checkpoint=None, encoder=None):
+    """
+    Stream files through load → split → embed with bounded queues.
+
+    files: list of (path, sha256). Loading runs in a process pool with at
+    most 2×workers files in flight; a chunker thread splits documents and
+    the calling thread embeds batches of batch_size chunks and adds them to
+    the FAISS store. on_file_done(filename, sha, ids) is called once every
+    chunk of a file is in the index. Returns (vs, chunks_added, failed_files).
+
+    With a checkpoint, loaders resume PDFs from saved pages and embeddings
+    already computed by an interrupted run are reused instead of recomputed.
+
+    encoder (e.g. an EmbeddingPool) computes the chunk vectors in place of
+    emb; emb stays the store's query embedding function. An encoder with
+    submit()/gather() encodes the next batch while this thread checkpoints
+    and indexes the previous one.
+    """
+    encoder = encoder or emb
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    loaded_q = queue.Queue(maxsize=max(2, workers))
+    chunk_q = queue.Queue(maxsize=batch_size * 4)
+    stop = threading.Event()
+    busy = {"load": 0.0, "split": 0.0, "embed": 0.0, "index": 0.0}
+    failed = []
+    ckpt_root = str(checkpoint.root) if checkpoint else None
+    reused = 0
+    profiler = active_profiler()
+
+    def loader():
+        try:
+            if workers <= 0:
+                for fp, sha in files:
+                    try:
+                        docs, dt, _ = _load_for_pipeline(fp, ckpt_root, sha[:16])
+                        busy["load"] += dt
+                        item = (fp, sha, docs, None)
+                    except Exception as e:
+                        item = (fp, sha, None, e)
+                    if not _put(loaded_q, item, stop):
+                        return
+                return
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = {}
+                todo = list(files)
+                while (todo or pending) and not stop.is_set():
+                    while todo and len(pending) < workers * 2:
+                        fp, sha = todo.pop(0)
+                        pending[pool.submit(_load_for_pipeline, fp, ckpt_root, sha[:16],
+                                            profile=profiler is not None)] = (fp, sha)
+                    done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        fp, sha = pending.pop(fut)
+                        try:
+                            docs, dt, prof = fut.result()
+                            busy["load"] += dt
+                            if prof and profiler:
+                                profiler.merge(prof)
+                            item = (fp, sha, docs, None)
+                        except Exception as e:
+                            item = (fp, sha, None, e)
+                        if not _put(loaded_q, item, stop):
+                            return
+        finally:
+            _put(loaded_q, None, stop)
+
+    def chunker():
+        splitter = make_splitter()
+        try:
+            while not stop.is_set():
+                item = loaded_q.get()
+                if item is None:
+                    break
+                fp, sha, docs, err = item
+                if err is not None:
+                    print(f"✗ Error loading {fp.name}: {err}")
+                    failed.append(fp.name)
+                    continue
+                t0 = time.perf_counter()
+                with stage("split"):
+                    chunks = splitter.split_documents(docs)
+                busy["split"] += time.perf_counter() - t0
+                ids = chunk_ids(sha, len(chunks))
+                saved = checkpoint.load_vectors(sha[:16]) if checkpoint else {}
+                for chunk, cid in zip(chunks, ids):
+                    if not _put(chunk_q, ("chunk", chunk, cid, saved.get(cid)), stop):
+                        return
+                _put(chunk_q, ("file", fp.name, sha, ids), stop)
+        finally:
+            _put(chunk_q, None, stop)
+
+    threads = [threading.Thread(target=loader, daemon=True), threading.Thread(target=chunker, daemon=True)]
+    for t in threads:
+        t.start()
+
+    batch, finished_files = [], []
+    pending = None  # submitted batch, indexed while the encoder works on the next one
+    pooled = hasattr(encoder, "submit")
+    added = 0
+    t_start = time.perf_counter()
+    last_report = t_start
+
+    def start_batch():
+        # Take the current batch and start encoding its new chunks (in the background with a pool)
+        nonlocal reused
+        job = {"items": list(batch), "files": list(finished_files)}
+        batch.clear()
+        finished_files.clear()
+        job["todo"] = [i for i, (_, _, vec) in enumerate(job["items"]) if vec is None]
+        reused += len(job["items"]) - len(job["todo"])
+        texts = [job["items"][i][0].page_content for i in job["todo"]]
+        if texts and pooled:
+            job["futures"] = encoder.submit(texts)
+        elif texts:
+            t0 = time.perf_counter()
+            with stage("embed"):
+                job["fresh"] = np.asarray(encoder.embed_documents(texts), dtype=np.float32)
+            busy["embed"] += time.perf_counter() - t0
+        return job
+
+    def finish_batch(job):
+        nonlocal vs, added, last_report
+        items, todo = job["items"], job["todo"]
+        if items:
+            texts = [c.page_content for c, _, _ in items]
+            ids = [cid for _, cid, _ in items]
+            if "futures" in job:
+                t0 = time.perf_counter()
+                with stage("embed"):  # only the wait for the pool is on this thread
+                    job["fresh"] = encoder.gather(job["futures"])
+                busy["embed"] += time.perf_counter() - t0
+            fresh = job.get("fresh")
+            dim = fresh.shape[1] if fresh is not None else len(items[0][2])
+            vectors = np.empty((len(items), dim), dtype=np.float32)
+            if todo:
+                vectors[todo] = fresh
+            for i, (_, _, vec) in enumerate(items):
+                if vec is not None:
+                    vectors[i] = vec
+            if todo and checkpoint:
+                by_file = {}
+                for i in todo:
+                    by_file.setdefault(ids[i].split(":")[0], []).append(i)
+                with stage("checkpoint"):
+                    for key, idx in by_file.items():
+                        checkpoint.append_vectors(key, [ids[i] for i in idx], vectors[idx])
+            t1 = time.perf_counter()
+            with stage("index_add"):
+                pairs = list(zip(texts, vectors))  # float32 rows; no per-value conversion
+                metas = [c.metadata for c, _, _ in items]
+                if vs is None:
+                    vs = FAISS.from_embeddings(pairs, emb, metadatas=metas, ids=ids)
+                else:
+                    vs.add_embeddings(pairs, metadatas=metas, ids=ids)
+            busy["index"] += time.perf_counter() - t1
+            added += len(items)
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_EVERY_S:
+                last_report = now
+                print(f"📈 {added} chunks indexed • {added / (now - t_start):.1f} chunks/s "
+                      f"(waiting on embeddings {busy['embed']:.1f}s of {now - t_start:.1f}s)")
+        # Every file whose end marker arrived before this batch was taken is now fully indexed
+        for done in job["files"]:
+            if on_file_done:
+                on_file_done(*done)
+
+    def flush():
+        # Submit this batch before indexing the previous one, so the pool never idles on index_add
+        nonlocal pending
+        job = start_batch()
+        if pending is not None:
+            finish_batch(pending)
+        pending = job
+
+    try:
+        while True:
+            item = chunk_q.get()
+            if item is None:
+                break
+            if item[0] == "chunk":
+                batch.append(item[1:])
+                if len(batch) >= batch_size:
+                    flush()
+            else:
+                finished_files.append(item[1:])
+        flush()
+        finish_batch(pending)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
+
+    wall = time.perf_counter() - t_start
+    rate = added / wall if wall > 0 else 0.0
+    print(f"⏱️  Pipeline: {added} chunks in {wall:.1f}s ({rate:.1f} chunks/s) • "
+          + " • ".join(f"{k} {v:.1f}s" for k, v in busy.items()))
+    if reused:
+        print(f"↻ Reused {reused} checkpointed embeddings")
+    return vs, added, failed
+
+def update_vectorstore(docs_folder=DOCS_DIR, save_path=VS_DIR, full=False,
+                       workers=None, batch_size=EMBED_BATCH_SIZE, use_checkpoint=True,
+                       embed_backend=None, embed_threads=None, embed_workers=1):
+    """
+    Incrementally sync the vectorstore with docs_folder.
+
+    The manifest maps each file to its content hash and the ids of its
+    chunks. Only new or changed files are embedded; vectors of deleted or
+    changed files are removed by id. Files whose content is identical to
+    an already indexed file are recorded but not embedded again.
+    New and changed files go through run_ingest_pipeline; with
+    embed_workers > 1 their chunks are encoded by an EmbeddingPool, and
+    batch_size counts chunks per worker (each pool batch is batch_size × workers).
+    """
+    p = Path(docs_folder)
+    p.mkdir(exist_ok=True)
+    current = {f.name: file_sha256(f) for f in sorted(p.iterdir())
+               if f.is_file() and f.name.lower().endswith(SUPPORTED_EXTS)}
+
+    manifest = None if full else load_manifest(save_path)
+    index_exists = (Path(save_path) / "index.faiss").exists()
+    with stage("model_load"):
+        emb = make_embeddings(EMBED_MODEL, backend=embed_backend, threads=embed_threads)
+    settings = embedding_settings(emb)
+    if manifest and index_exists and manifest_matches(manifest, settings):
+        with stage("index_load"):
+            vs = FAISS.load_local(save_path, emb, allow_dangerous_deserialization=True)
+        entries = manifest.get("files", {})
+    else:
+        if manifest and index_exists:
+            print(f"ℹ️  Embedding settings changed ({manifest.get('embed_backend', 'torch')} → {emb.backend}, "
+                  f"{manifest.get('embed_quantization', 'fp32')} → {emb.quantization}), doing a full rebuild")
+        elif not full and index_exists:
+            print("ℹ️  No compatible manifest found, doing a full rebuild")
+        vs, entries = None, {}
+
+    deleted = [f for f in entries if f not in current]
+    changed = [f for f in entries if f in current and entries[f]["sha256"] != current[f]]
+    new = [f for f in current if f not in entries]
+    stale = set(deleted) | set(changed)
+
+    # A duplicate whose original is going away must be indexed in its own right
+    orphans = [f for f, e in entries.items()
+               if f not in stale and e.get("duplicate_of") in stale]
+
+    remove_ids = [cid for f in stale for cid in entries[f].get("chunk_ids", [])]
+    if vs is not None and remove_ids:
+        vs.delete(remove_ids)
+        print(f"🗑️  Removed {len(remove_ids)} vectors from {len(stale)} deleted/changed file(s)")
+    for f in stale | set(orphans):
+        entries.pop(f, None)
+
+    # Plan the work up front so identical files are never loaded twice
+    indexed = {e["sha256"]: f for f, e in entries.items() if not e.get("duplicate_of")}
+    to_index = []
+    for filename in changed + new + orphans:
+        if filename not in current:
+            continue
+        sha = current[filename]
+        if sha in indexed:
+            entries[filename] = {"sha256": sha, "chunk_ids": [], "duplicate_of": indexed[sha]}
+            print(f"= Skipped {filename} (identical to {indexed[sha]})")
+            continue
+        indexed[sha] = filename
+        to_index.append((p / filename, sha))
+
+    def _commit(filename, sha, ids):
+        entries[filename] = {"sha256": sha, "chunk_ids": ids}
+        print(f"✓ Indexed {filename} ({len(ids)} chunks)")
+
+    checkpoint = None
+    if use_checkpoint:
+        checkpoint = IngestCheckpoint(Path(save_path) / CHECKPOINT_DIR, settings={
+            **settings,
+            "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP,
+        })
+
+    added = 0
+    failed = []
+    if to_index:
+        pool = None
+        if embed_workers > 1:
+            with stage("model_load"):
+                pool = EmbeddingPool(EMBED_MODEL, backend=emb.backend, workers=embed_workers)
+            batch_size *= pool.workers  # one batch per worker per flush
+        try:
+            vs, added, failed = run_ingest_pipeline(to_index, emb, vs, on_file_done=_commit,
+                                                    workers=workers, batch_size=batch_size,
+                                                    checkpoint=checkpoint, encoder=pool)
+        finally:
+            if pool:
+                pool.close()
+    # Let duplicates of a file that failed to load be retried with it next run
+    for f, e in list(entries.items()):
+        if e.get("duplicate_of") in failed:
+            entries.pop(f)
+
+    unchanged = len(current) - len(new) - len(changed)
+    print(f"\n📋 {len(new)} new • {len(changed)} changed • {len(deleted)} deleted • {unchanged} unchanged")
+
+    if vs is None:
+        return None
+    if not (remove_ids or added) and index_exists and not full:
+        print("✓ Vectorstore already up to date")
+        if not BM25Index.is_current(save_path, expected_n_docs=vs.index.ntotal):
+            build_bm25_index(vs, save_path)
+        save_manifest({**settings, "files": entries}, save_path)
+        return vs
+
+    os.makedirs(save_path, exist_ok=True)
+    save_vectorstore(vs, save_path)
+    save_manifest({**settings, "files": entries}, save_path)
+    if checkpoint and not failed:
+        checkpoint.clear()  # everything it held is now in the index
     return vs
 
-def main():
-    print("\n=== Medical Document Preprocessing ===\n")
-    documents = load_documents(DOCS_DIR)
-    if not documents:
+def update_ann_index(vs, save_path=VS_DIR, index_type="hnsw", nlist=None, hnsw_m=32, pq_m=None,
+                     report=False, report_k=5):
+    """
+    (Re)build the approximate index next to the flat one when the flat index
+    or the build parameters changed, then optionally print recall vs latency.
+    """
+    params = {"nlist": nlist, "hnsw_m": hnsw_m, "pq_m": pq_m, "flat_stamp": flat_stamp(save_path)}
+    ann_fp, _ = ann_paths(save_path, index_type)
+    cfg = read_ann_config(save_path, index_type)
+
+    if ann_fp.exists() and cfg.get("index_type") == index_type and cfg.get("params") == params:
+        print(f"✓ {index_type.upper()} index already up to date")
+        import faiss
+        ann = faiss.read_index(str(ann_fp))
+    else:
+        print(f"🔧 Building {index_type.upper()} index over {vs.index.ntotal} vectors ...")
+        t0 = time.perf_counter()
+        with stage("ann_build"):
+            ann = build_index(flat_vectors(vs.index), index_type, nlist=nlist, hnsw_m=hnsw_m, pq_m=pq_m)
+            write_ann_index(ann, save_path, index_type, params)
+        print(f"✓ {index_type.upper()} index saved in {time.perf_counter() - t0:.1f}s")
+
+    if report:
+        if not Path(QUERIES_FILE).exists():
+            print(f"⚠️ {QUERIES_FILE} not found, skipping recall report")
+            return ann
+        with open(QUERIES_FILE, "r", encoding="utf-8") as f:
+            queries = [q["query"] for q in json.load(f) if q.get("query")]
+        qvecs = np.asarray(vs.embeddings.embed_documents(queries), dtype=np.float32)
+        print_recall_report(recall_report(vs.index, ann, qvecs, k=report_k), report_k)
+    return ann
+
+def run(args):
+    """The build steps of main(), on parsed arguments."""
+    try:
+        vs = update_vectorstore(DOCS_DIR, VS_DIR, full=args.full, workers=args.workers,
+                                batch_size=args.batch_size, use_checkpoint=not args.no_checkpoint,
+                                embed_backend=args.embed_backend, embed_threads=args.embed_threads,
+                                embed_workers=args.embed_workers)
+    except KeyboardInterrupt:
+        if args.no_checkpoint:
+            print("\n⏹️  Interrupted.")
+        else:
+            print(f"\n⏸️  Interrupted. Progress is saved in {Path(VS_DIR) / CHECKPOINT_DIR}; re-run to resume.")
+        return
+    if vs is None:
         print("⚠️  No documents found in ./documents")
         return
-    chunks = create_chunks(documents)
-    create_vectorstore(chunks)
+    if args.index_type != "flat":
+        update_ann_index(vs, VS_DIR, args.index_type, nlist=args.nlist, hnsw_m=args.hnsw_m,
+                         pq_m=args.pq_m, report=args.recall_report)
+        print(f"ℹ️  Serve it with: MEDGPT_INDEX_TYPE={args.index_type} streamlit run app.py")
     print("\n✅ Done! You can now run:  streamlit run app.py\n")
 
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the FAISS vectorstore")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild everything")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Loader processes (default: CPU count, 0 = load in-process)")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="Chunks per embedding batch, per worker: with --embed-workers N each "
+                             "batch sent to the pool holds N × this many chunks")
+    parser.add_argument("--embed-backend", choices=EMBED_BACKENDS, default=None,
+                        help="Embedding backend (default: $MEDGPT_EMBED_BACKEND or torch)")
+    parser.add_argument("--embed-threads", type=int, default=None, help="CPU threads for embedding")
+    parser.add_argument("--embed-workers", type=int, default=1,
+                        help="Embedding processes, each pinned to cores/N (e.g. 16 on a 64-core host)")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not save or resume from checkpoints")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="Also build an approximate index next to the flat one")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default ~4*sqrt(N))")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW neighbours per node")
+    parser.add_argument("--pq-m", type=int, default=None, help="IVF-PQ sub-quantizers (must divide the dim)")
+    parser.add_argument("--recall-report", action="store_true",
+                        help=f"Print recall/latency of the ANN index vs flat over {QUERIES_FILE}")
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="DIR",
+                        help=f"Record time, CPU samples and peak memory per stage "
+                             f"(report + flamegraph stacks in DIR, default {PROFILE_DIR}/<timestamp>)")
+    args = parser.parse_args()
+
+    print("\n=== Medical Document Preprocessing ===\n")
+    with profiled(args.profile or None, enabled=args.profile is not None):
+        run(args)
+
 if __name__ == "__main__":
     main()
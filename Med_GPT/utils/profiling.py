@@ -0,0 +1,245 @@
+"""
+Stage profiler for the offline build scripts (--profile).
+
+Where does ingest time and memory go on a big corpus? Code marks its
+stages with stage("embed"); while a StageProfiler is running it records,
+per stage:
+  - time spent in the stage (exclusive of nested stages, summed over
+    threads and loader processes)
+  - CPU samples: a sampler thread snapshots every thread's Python stack
+    each MEDGPT_PROFILE_INTERVAL_MS and files it under that thread's
+    current stage. Unlike cProfile this covers the chunker/loader threads
+    too (Python 3.12 allows only one cProfile at a time per process)
+  - peak traced memory (tracemalloc) while the stage was running; native
+    buffers (torch, FAISS) are not traced, so the report also shows the
+    process max RSS
+Outside a profiled run stage() is a no-op.
+
+write() produces, in .cache/profiles/<timestamp>/:
+  report.txt         per-stage table + hottest functions per stage
+  stacks.collapsed   "stage;frame;frame count" lines for flamegraph.pl,
+                     speedscope or inferno
+  profile.json       raw numbers (mergeable, see export()/merge())
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+PROFILE_DIR = os.getenv("MEDGPT_PROFILE_DIR", ".cache/profiles")
+SAMPLE_INTERVAL_S = float(os.getenv("MEDGPT_PROFILE_INTERVAL_MS", "5")) / 1000.0
+TRACEMALLOC_FRAMES = 1
+TOP_FUNCTIONS = 8  # per stage in report.txt
+MB = 1024 * 1024
+
+_active = None  # the running StageProfiler, if any
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+def _max_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # Linux reports KiB
+
+class StageProfiler:
+    """Per-stage time, sampled stacks and peak memory for one build run"""
+
+    def __init__(self, interval_s: float = SAMPLE_INTERVAL_S, memory: bool = True):
+        self.interval_s = interval_s
+        self.memory = memory
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.mem_peak: Dict[str, int] = {}
+        self.samples = Counter()  # (stage, frames root→leaf) -> count
+        self._stacks: Dict[int, list] = {}  # thread id -> [[stage, resumed_at], ...]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._own_tracemalloc = False
+        self._t0 = None
+        self.wall_s = 0.0
+
+    # ---------- lifecycle ----------
+    def start(self) -> "StageProfiler":
+        global _active
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._own_tracemalloc = True
+        self._t0 = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample_loop, name="stage-profiler", daemon=True)
+        self._sampler.start()
+        _active = self
+        return self
+
+    def stop(self):
+        global _active
+        if _active is self:
+            _active = None
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join(timeout=1)
+        self.wall_s += time.perf_counter() - self._t0
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+
+    # ---------- stages ----------
+    @contextmanager
+    def stage(self, name: str):
+        tid = threading.get_ident()
+        with self._lock:
+            self._memory_boundary()
+            stack = self._stacks.setdefault(tid, [])
+            now = time.perf_counter()
+            if stack:
+                self._add_time(stack[-1], now)  # pause the enclosing stage
+            stack.append([name, now])
+            self.calls[name] = self.calls.get(name, 0) + 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._memory_boundary()
+                now = time.perf_counter()
+                self._add_time(stack.pop(), now)
+                if stack:
+                    stack[-1][1] = now  # resume it
+                else:
+                    self._stacks.pop(tid, None)
+
+    def _add_time(self, entry, now):
+        self.seconds[entry[0]] = self.seconds.get(entry[0], 0.0) + now - entry[1]
+
+    def _memory_boundary(self):
+        # The peak since the last boundary happened while every open stage was open
+        if not (self.memory and tracemalloc.is_tracing()):
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        for stack in self._stacks.values():
+            for name, _ in stack:
+                self.mem_peak[name] = max(self.mem_peak.get(name, 0), peak)
+        tracemalloc.reset_peak()
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            with self._lock:
+                current = {tid: stack[-1][0] for tid, stack in self._stacks.items() if stack}
+            if not current:
+                continue
+            frames = sys._current_frames()
+            for tid, name in current.items():
+                frame = frames.get(tid)
+                if frame is None or tid == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.samples[(name, tuple(reversed(labels)))] += 1
+
+    # ---------- results ----------
+    def export(self) -> Dict:
+        """JSON-friendly results; merge() adds them into another profiler."""
+        return {
+            "wall_s": self.wall_s,
+            "interval_s": self.interval_s,
+            "seconds": dict(self.seconds),
+            "calls": dict(self.calls),
+            "mem_peak": dict(self.mem_peak),
+            "samples": {";".join((name,) + frames): n for (name, frames), n in self.samples.items()},
+        }
+
+    def merge(self, data: Dict):
+        """Add another profiler's export(), e.g. from a loader process."""
+        with self._lock:
+            for name, s in data["seconds"].items():
+                self.seconds[name] = self.seconds.get(name, 0.0) + s
+            for name, n in data["calls"].items():
+                self.calls[name] = self.calls.get(name, 0) + n
+            for name, peak in data["mem_peak"].items():
+                self.mem_peak[name] = max(self.mem_peak.get(name, 0), peak)
+            for line, n in data["samples"].items():
+                name, *frames = line.split(";")
+                self.samples[(name, tuple(frames))] += n
+
+    def report(self) -> str:
+        stage_samples = Counter()
+        leaf = Counter()       # (stage, function) -> self samples
+        inclusive = Counter()  # (stage, function) -> samples with it on the stack
+        for (name, frames), n in self.samples.items():
+            stage_samples[name] += n
+            if frames:
+                leaf[(name, frames[-1])] += n
+            for fn in set(frames):
+                inclusive[(name, fn)] += n
+
+        total = sum(self.seconds.values()) or 1.0
+        lines = [f"Profiled run: {self.wall_s:.1f}s wall • sampled every {self.interval_s * 1000:.0f} ms", "",
+                 f"{'stage':<16}{'time s':>10}{'share':>8}{'calls':>9}{'samples':>9}{'peak MB':>10}"]
+        for name, s in sorted(self.seconds.items(), key=lambda kv: -kv[1]):
+            peak = self.mem_peak.get(name)
+            lines.append(f"{name:<16}{s:>10.2f}{s / total:>8.0%}{self.calls.get(name, 0):>9}"
+                         f"{stage_samples[name]:>9}{(peak / MB if peak else 0):>10.1f}")
+        lines.append("(time is exclusive of nested stages and summed over threads/processes; "
+                     "peak MB is traced Python memory)")
+        rss = _max_rss_bytes()
+        if rss:
+            lines.append(f"Process max RSS: {rss / MB:.0f} MB")
+
+        for name, _ in stage_samples.most_common():
+            n = stage_samples[name]
+            lines += ["", f"== {name} ({n} samples) ==", f"{'self':>7}{'total':>7}  function"]
+            hot = sorted(((fn, c) for (st, fn), c in leaf.items() if st == name), key=lambda kv: -kv[1])
+            for fn, c in hot[:TOP_FUNCTIONS]:
+                lines.append(f"{c / n:>7.0%}{inclusive[(name, fn)] / n:>7.0%}  {fn}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, out_dir=None) -> Path:
+        out = Path(out_dir or Path(PROFILE_DIR) / time.strftime("%Y%m%d-%H%M%S"))
+        out.mkdir(parents=True, exist_ok=True)
+        (out / "report.txt").write_text(self.report(), encoding="utf-8")
+        with open(out / "stacks.collapsed", "w", encoding="utf-8") as f:
+            for (name, frames), n in sorted(self.samples.items()):
+                f.write(";".join((name,) + frames) + f" {n}\n")
+        with open(out / "profile.json", "w", encoding="utf-8") as f:
+            json.dump(self.export(), f)
+        return out
+
+def active_profiler() -> Optional[StageProfiler]:
+    return _active
+
+@contextmanager
+def stage(name: str):
+    """Attribute the enclosed work to a stage of the running profile; a no-op otherwise."""
+    profiler = _active
+    if profiler is None:
+        yield None
+        return
+    with profiler.stage(name):
+        yield profiler
+
+@contextmanager
+def profiled(out_dir=None, enabled: bool = True):
+    """Profile the enclosed run and write the report when it ends (even on Ctrl-C)."""
+    if not enabled:
+        yield None
+        return
+    profiler = StageProfiler().start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        path = profiler.write(out_dir)
+        print("\n" + profiler.report())
+        print(f"🔬 Profile written to {path} (flamegraph: flamegraph.pl {path / 'stacks.collapsed'} > flame.svg)")
@@ -0,0 +1,286 @@
+"""
+Retrieval + generation pipeline shared by the Streamlit app and api_server.py.
+
+Owns the vectorstore, retriever, answer cache and LLMHandler so every
+front end answers a question the same way:
+  answer cache (exact, then similar) → retrieval → context packing → LLM → cache the answer
+prepare() and finish() hold the steps around the LLM call; front ends only
+differ in how they run generation (aanswer() awaits it, app.py streams it
+through the deadline executor).
+Settings come from the MEDGPT_* environment variables below.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.llm_handler import LLMHandler
+from utils.answer_cache import AnswerCache, vectorstore_fingerprint
+from utils.retriever import CachedRetriever, BackgroundEmbeddings
+from utils.bm25_index import BM25Index
+from utils.mmap_store import DOCSTORE_FILE
+from utils.embeddings import make_embeddings, register_langchain
+from utils.micro_batcher import BATCH_WINDOW_MS, MAX_BATCH
+from utils.deadline_executor import DeadlineExceeded
+from utils.context_builder import ContextBuilder, CANDIDATE_K, CONTEXT_TOKEN_BUDGET
+from utils.tracing import span, start_trace
+
+# ---------- Constants ----------
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  # must match preprocessing
+EMBED_BACKEND = os.getenv("MEDGPT_EMBED_BACKEND", "torch")  # torch | int8 | onnx (check with utils/embeddings.py)
+VECTORSTORE_DIR = os.getenv("MEDGPT_VECTORSTORE_DIR", "vectorstore")
+TOP_K = CANDIDATE_K  # chunks retrieved per question; ContextBuilder packs them into the prompt
+INDEX_TYPE = os.getenv("MEDGPT_INDEX_TYPE", "flat")   # flat | ivf | hnsw | ivfpq (built by preprocess_documents.py)
+IVF_NPROBE = int(os.getenv("MEDGPT_NPROBE", "16"))     # IVF lists scanned per query
+HNSW_EF_SEARCH = int(os.getenv("MEDGPT_EF_SEARCH", "64"))  # HNSW candidate list size
+LOAD_MODE = os.getenv("MEDGPT_LOAD_MODE", "mmap")  # mmap: mapped index + SQLite docstore | full: FAISS.load_local
+RETRIEVAL_MODE = os.getenv("MEDGPT_RETRIEVAL_MODE", "hybrid")  # dense | hybrid (BM25 + dense rescoring) | lexical
+HYBRID_CANDIDATES = int(os.getenv("MEDGPT_HYBRID_CANDIDATES", "200"))  # BM25 candidates rescored per query
+ANSWER_CACHE_PATH = ".cache/answer_cache.sqlite"
+ANSWER_CACHE_MAX_ENTRIES = 2000
+ANSWER_CACHE_TTL_S = 7 * 24 * 3600
+SEMANTIC_CACHE_THRESHOLD = 0.95  # cosine similarity needed to reuse a paraphrased question
+NO_CONTEXT_ANSWER = "I couldn’t find relevant context in the indexed documents."
+
+def load_vectorstore(vs_dir=VECTORSTORE_DIR):
+    """
+    Load the pre-processed store (mmap or full) with the configured ANN index.
+    faiss, and LangChain for the full mode, are imported here rather than at
+    module import so the app renders before they load.
+    """
+    from utils.mmap_store import MmapVectorStore, export_docstore
+    from utils.ann_index import load_ann_index, set_search_params
+
+    path = Path(vs_dir)
+    if not path.exists():
+        raise FileNotFoundError(f"Vectorstore not found at {path}; run: python preprocess_documents.py")
+    # Model loads in the background; hybrid retrieval serves BM25 results until it is ready
+    embeddings = BackgroundEmbeddings(lambda: make_embeddings(EMBED_MODEL, backend=EMBED_BACKEND))
+    vs = None
+    if LOAD_MODE == "mmap" and (path / DOCSTORE_FILE).exists():
+        try:
+            vs = MmapVectorStore(path, embeddings)
+        except Exception as e:
+            print(f"⚠️ mmap load failed ({e}); loading full vectorstore")
+    if vs is None:
+        from langchain_community.vectorstores import FAISS
+        register_langchain(BackgroundEmbeddings)
+        vs = FAISS.load_local(str(path), embeddings, allow_dangerous_deserialization=True)
+        if LOAD_MODE == "mmap" and not (path / DOCSTORE_FILE).exists():
+            # Store built before docstore.sqlite existed: write it once so later starts skip LangChain
+            try:
+                export_docstore(vs, path)
+            except (OSError, sqlite3.Error) as e:
+                print(f"⚠️ Could not write {DOCSTORE_FILE} ({e}); staying on the full load")
+    if INDEX_TYPE != "flat":
+        # Same vector order as the flat index, so the docstore mapping still applies
+        ann = load_ann_index(path, INDEX_TYPE, expected_ntotal=vs.index.ntotal,
+                             mmap=isinstance(vs, MmapVectorStore))
+        if ann is not None:
+            vs.index = set_search_params(ann, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH)
+    return vs
+
+def _stop_if_cancelled(cancel, stage: str):
+    if cancel is not None and cancel.cancelled:
+        raise DeadlineExceeded(f"cancelled before {stage}")
+
+def source_dict(doc) -> Optional[Dict]:
+    """JSON-friendly form of a retrieved chunk (also what the answer cache stores)."""
+    if doc is None:
+        return None
+    return {"page_content": doc.page_content, "metadata": doc.metadata}
+
+class RAGPipeline:
+    """Vectorstore + retriever + answer cache + LLM, loaded once per process"""
+
+    def __init__(self, vs_dir=VECTORSTORE_DIR, handler: Optional[LLMHandler] = None):
+        self.vs_dir = Path(vs_dir)
+        # One LLMHandler per process (detects Ollama/Claude/fallback once)
+        self.handler = handler or LLMHandler()
+        self.answer_cache = AnswerCache(
+            ANSWER_CACHE_PATH,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ttl_s=ANSWER_CACHE_TTL_S,
+            similarity_threshold=SEMANTIC_CACHE_THRESHOLD,
+        )
+        self.context_builder = ContextBuilder(CONTEXT_TOKEN_BUDGET)
+        self.vs = None
+        self.retriever = None
+        self._load_lock = threading.Lock()
+
+    # ---------- loading ----------
+    def load(self):
+        """Load the vectorstore and retriever on first use; returns (vs, retriever)."""
+        with self._load_lock:
+            if self.retriever is None:
+                trace = start_trace("startup", vectorstore=str(self.vs_dir), load_mode=LOAD_MODE,
+                                    index_type=INDEX_TYPE)
+                with trace.span("index_load"):
+                    vs = load_vectorstore(self.vs_dir)
+                    bm25 = None
+                    if RETRIEVAL_MODE != "dense":
+                        bm25 = BM25Index.load(self.vs_dir, expected_n_docs=vs.index.ntotal)
+                trace.finish()
+                # Memoizes query embeddings + hits per index build
+                self.retriever = CachedRetriever(vs, k=TOP_K, index_version=vectorstore_fingerprint(self.vs_dir),
+                                                 bm25=bm25, mode=RETRIEVAL_MODE, candidates=HYBRID_CANDIDATES,
+                                                 batch_window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH)
+                self.vs = vs
+        return self.vs, self.retriever
+
+    @property
+    def loaded(self) -> bool:
+        return self.retriever is not None
+
+    def cache_fingerprint(self) -> str:
+        """Cached answers are only valid for this exact index + embedding model + LLM."""
+        return "|".join([vectorstore_fingerprint(self.vs_dir), EMBED_MODEL, EMBED_BACKEND,
+                         self.handler.backend, self.handler.ollama_model or ""])
+
+    # ---------- stages ----------
+    def cached_answer(self, query: str, cancel=None):
+        """Return (cached entry or None, query embedding or None)."""
+        _, retriever = self.load()
+        self.answer_cache.validate(self.cache_fingerprint())
+        cached = self.answer_cache.get_exact(query)
+        qvec = None
+        if cached is None and retriever.embeddings_ready:
+            _stop_if_cancelled(cancel, "the similar-question lookup")
+            qvec = retriever.embed_query(query)
+            cached = self.answer_cache.get_similar(qvec)
+        elif cached is None:
+            self.answer_cache.record_miss()  # model still loading: no similar-question lookup
+        return cached, qvec
+
+    def retrieve(self, query: str, k: Optional[int] = None, cancel=None) -> List:
+        """Top-k chunks; cancel (a CancelToken) bounds any wait for the embedding model."""
+        _, retriever = self.load()
+        return retriever.get_relevant_documents(query, k, cancel=cancel)
+
+    def build_context(self, query: str, docs: List) -> Dict:
+        """Pack the retrieved chunks into the prompt token budget (see ContextBuilder)."""
+        return self.context_builder.build(query, docs)
+
+    def remember(self, query: str, answer: str, qvec, source_doc, stats: Optional[dict] = None):
+        """Cache a real model answer; fallback or failed generations are not worth replaying."""
+        stats = stats or {}
+        if (self.handler.backend == "fallback" or not answer
+                or stats.get("fallback") or stats.get("error") or stats.get("cancelled")
+                or stats.get("timed_out")):
+            return
+        self.answer_cache.put(query, answer, embedding=qvec, source=source_dict(source_doc))
+
+    # ---------- request flow ----------
+    # Front ends call prepare(), generate however suits them, then finish()
+    def prepare(self, query: str, cancel=None) -> Dict:
+        """
+        Everything before generation, recorded into the active trace: answer
+        cache, then retrieval and context packing. Returns {"cached", "qvec",
+        "docs", "packed"}; packed is None when there is nothing to generate
+        (a cache hit, or no matching chunks). Once cancel (a CancelToken) is
+        cancelled the next stage raises DeadlineExceeded instead of running.
+        """
+        with span("cache_lookup"):
+            cached, qvec = self.cached_answer(query, cancel)
+        prep = {"cached": cached, "qvec": qvec, "docs": [], "packed": None}
+        if cached is None:
+            _stop_if_cancelled(cancel, "retrieval")
+            with span("retrieve"):
+                prep["docs"] = self.retrieve(query, cancel=cancel)
+            if prep["docs"]:
+                _stop_if_cancelled(cancel, "context packing")
+                with span("context_build"):
+                    prep["packed"] = self.build_context(query, prep["docs"])
+        return prep
+
+    def finish(self, query: str, prep: Dict, trace, answer: Optional[str] = None,
+               stats: Optional[dict] = None) -> Dict:
+        """Cache a real answer, finish the trace with its outcome and return the result."""
+        if prep["cached"] is not None:
+            return self._cached_result(query, prep["cached"], trace)
+        if prep["packed"] is None:
+            return self._result(query, NO_CONTEXT_ANSWER, None, trace)
+        stats = stats if stats is not None else {}
+        stats.setdefault("context_tokens", prep["packed"]["tokens"])
+        self.remember(query, answer, prep["qvec"], prep["docs"][0], stats)
+        return self._result(query, answer, prep["docs"][0], trace, stats)
+
+    async def aanswer(self, query: str) -> Dict:
+        """Answer one question; retrieval runs in a worker thread, generation on the event loop."""
+        trace = start_trace("query", mode=RETRIEVAL_MODE)
+        try:
+            # to_thread copies the context, so spans in the worker thread land in this trace
+            with trace.activate():
+                prep = await asyncio.to_thread(self.prepare, query)
+                if prep["packed"] is None:
+                    return self.finish(query, prep, trace)
+                stats = {}
+                t0 = time.perf_counter()
+                answer = await self.handler.agenerate_answer(query, prep["packed"]["text"], stats=stats)
+                stats.setdefault("total_s", time.perf_counter() - t0)
+                return self.finish(query, prep, trace, answer, stats)
+        except BaseException:
+            # includes cancellation by an API deadline
+            trace.finish("error")
+            raise
+
+    def _result(self, query, answer, source_doc, trace, stats=None) -> Dict:
+        stats = stats or {}
+        trace.record_llm(stats)
+        if source_doc is None:
+            outcome = "no_context"
+        elif stats.get("timed_out"):
+            outcome = "timeout"
+        elif not answer:
+            outcome = "empty"
+        else:
+            outcome = "fallback" if stats.get("fallback") else "ok"
+        done = trace.finish(outcome)
+        spans = done.get("spans", {})
+        return {
+            "query": query,
+            "answer": answer,
+            "source": source_dict(source_doc),
+            "cached": None,
+            "backend": self.handler.backend,
+            "model": self.handler.ollama_model,
+            "fallback": bool(stats.get("fallback")),
+            "context_tokens": stats.get("context_tokens"),
+            "trace_id": trace.trace_id,
+            "timings": {stage: round(seconds, 4) for stage, seconds in spans.items()},
+        }
+
+    def _cached_result(self, query, cached, trace) -> Dict:
+        trace.set(cached=cached["match"])
+        done = trace.finish("cached")
+        return {
+            "query": query,
+            "answer": cached["answer"],
+            "source": cached["source"],
+            "cached": cached["match"],
+            "backend": self.handler.backend,
+            "model": self.handler.ollama_model,
+            "fallback": False,
+            "context_tokens": None,
+            "trace_id": trace.trace_id,
+            "timings": {stage: round(seconds, 4) for stage, seconds in done.get("spans", {}).items()},
+        }
+
+    def health(self) -> Dict:
+        status = self.handler.get_status()
+        status.update({
+            "vectorstore": str(self.vs_dir),
+            "loaded": self.loaded,
+            "chunks": int(self.vs.index.ntotal) if self.loaded else None,
+            "embeddings_ready": self.retriever.embeddings_ready if self.loaded else False,
+            "retrieval_mode": RETRIEVAL_MODE,
+            "index_type": INDEX_TYPE,
+            "answer_cache": self.answer_cache.stats(),
+        })
+        return status
+
+    async def aclose(self):
+        await self.handler.aclose()
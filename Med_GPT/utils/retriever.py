@@ -0,0 +1,273 @@
+"""
+Retriever with memoized query embeddings and top-k results.
+
+Retrieval modes:
+  dense    FAISS search over the whole index
+  hybrid   BM25 picks a few hundred candidates, which are rescored with
+           exact dense distance and merged with the BM25 ranking by
+           reciprocal-rank fusion
+  lexical  BM25 only (no embedding model needed)
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.micro_batcher import MicroBatcher
+from utils.tracing import span
+
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
+RRF_K = 60  # standard reciprocal-rank fusion constant
+
+class LRUCache:
+    """Small thread-safe LRU map"""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def documents_at(vectorstore, positions) -> List:
+    """Documents for FAISS index positions, for LangChain FAISS or MmapVectorStore."""
+    if hasattr(vectorstore, "documents_at"):
+        return vectorstore.documents_at(positions)
+    return [vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(p)]) for p in positions if p >= 0]
+
+def rrf_fuse(rankings: List[List[int]], k: int, rrf_k: int = RRF_K) -> List[int]:
+    """Merge rankings by reciprocal-rank fusion; returns the top-k ids."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+class BackgroundEmbeddings:
+    """Builds the embedding model in a background thread; embed calls wait for it"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._model = None
+        self._error = None
+        self._loaded = threading.Event()
+        threading.Thread(target=self._load, daemon=True).start()
+
+    def _load(self):
+        try:
+            self._model = self._factory()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._loaded.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded.is_set() and self._error is None
+
+    def wait(self, timeout: Optional[float] = None):
+        if not self._loaded.wait(timeout):
+            raise TimeoutError("Embedding model is still loading")
+        if self._error is not None:
+            raise self._error
+        return self._model
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.wait().embed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.wait().embed_documents(texts)
+
+class CachedRetriever:
+    """
+    Wraps a FAISS vectorstore and memoizes per (index_version, query):
+    - the query embedding (skips the sentence-transformers forward pass)
+    - the top-k hit list (skips the index search as well)
+    With batch_window_ms > 0, cache misses from concurrent callers are
+    coalesced into batched encodes and index searches (see MicroBatcher).
+    """
+
+    def __init__(self, vectorstore, k: int = 1, index_version: str = "",
+                 max_embeddings: int = 2048, max_results: int = 1024,
+                 bm25=None, mode: str = "dense", candidates: int = 200,
+                 batch_window_ms: float = 0, max_batch: int = 32):
+        self.vectorstore = vectorstore
+        self.embeddings = vectorstore.embeddings
+        self.k = k
+        self.index_version = index_version
+        self._embedding_cache = LRUCache(max_embeddings)
+        self._result_cache = LRUCache(max_results)
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode} (choose from {', '.join(RETRIEVAL_MODES)})")
+        if mode != "dense" and bm25 is None:
+            print(f"⚠️ {mode} retrieval needs a BM25 index; using dense")
+            mode = "dense"
+        self.bm25 = bm25
+        self.mode = mode
+        self.candidates = candidates
+        self._direct_map_lock = threading.Lock()
+        self._direct_map_ready = False
+        self.batcher = None
+        if batch_window_ms > 0:
+            # Index looked up per batch: the app may replace it with an ANN index
+            self.batcher = MicroBatcher(lambda: self.vectorstore.index, self.embed_queries,
+                                        window_ms=batch_window_ms, max_batch=max_batch)
+
+    @property
+    def embeddings_ready(self) -> bool:
+        """False while a BackgroundEmbeddings model is still loading."""
+        return getattr(self.embeddings, "ready", True)
+
+    def _key(self, query: str):
+        return (self.index_version, query.strip())
+
+    def embed_query(self, query: str) -> List[float]:
+        key = self._key(query)
+        vec = self._embedding_cache.get(key)
+        if vec is None:
+            if self.batcher is not None:
+                return self.batcher.embed(query)  # embed_queries memoizes it
+            with span("query_embed"):
+                vec = self.embeddings.embed_query(query)
+            self._embedding_cache.put(key, vec)
+        return vec
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed many queries, encoding all cache misses in a single batched call."""
+        keys = [self._key(q) for q in queries]
+        vectors: List[Optional[List[float]]] = [self._embedding_cache.get(k) for k in keys]
+
+        missing: Dict[tuple, List[int]] = {}
+        for i, (key, vec) in enumerate(zip(keys, vectors)):
+            if vec is None:
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            texts = [queries[positions[0]] for positions in missing.values()]
+            encoded = self.embeddings.embed_documents(texts)
+            for (key, positions), vec in zip(missing.items(), encoded):
+                self._embedding_cache.put(key, vec)
+                for i in positions:
+                    vectors[i] = vec
+        return vectors
+
+    def wait_for_embeddings(self, cancel=None):
+        """
+        Block until a loading model is ready, no longer than cancel's deadline
+        (utils/deadline_executor.CancelToken); raises TimeoutError past it.
+        """
+        if cancel is None or self.embeddings_ready:
+            return
+        wait = getattr(self.embeddings, "wait", None)
+        if wait is not None:
+            wait(cancel.remaining())
+
+    def get_relevant_documents(self, query: str, k: Optional[int] = None, cancel=None):
+        """Top-k chunks; with cancel, waiting for a loading model stops at its deadline."""
+        k = k or self.k
+        mode = self.mode
+        if mode == "hybrid" and not self.embeddings_ready:
+            mode = "lexical"  # model still loading: answer from BM25 alone
+        key = self._key(query) + (k, mode)
+        docs = self._result_cache.get(key)
+        if docs is None:
+            if mode == "lexical":
+                with span("bm25_search"):
+                    positions, _ = self.bm25.search(query, k)
+                with span("doc_fetch"):
+                    docs = documents_at(self.vectorstore, positions.tolist())
+            elif mode == "hybrid":
+                docs = self._hybrid_search(query, k, cancel)
+            else:
+                docs = self._dense_search(query, k, cancel)
+            self._result_cache.put(key, docs)
+        return docs
+
+    def _dense_search(self, query: str, k: int, cancel=None):
+        self.wait_for_embeddings(cancel)
+        if self.batcher is not None:
+            _, positions = self.batcher.submit(query, k, timeout=cancel.remaining() if cancel else None)
+            with span("doc_fetch"):
+                return documents_at(self.vectorstore, positions)
+        vector = self.embed_query(query)
+        with span("vector_search"):
+            return self.vectorstore.similarity_search_by_vector(vector, k=k)
+
+    def _hybrid_search(self, query: str, k: int, cancel=None):
+        with span("bm25_search"):
+            candidates, _ = self.bm25.search(query, max(self.candidates, k))
+        if len(candidates) < k:
+            # Too few lexical matches (paraphrase, typo): full dense search
+            return self._dense_search(query, k, cancel)
+        vector = self.embed_query(query)
+        with span("rescore"):
+            dense_ranking = self._rescore(candidates, vector)
+        if dense_ranking is None:
+            return self._dense_search(query, k, cancel)
+        fused = rrf_fuse([candidates.tolist(), dense_ranking], k)
+        with span("doc_fetch"):
+            return documents_at(self.vectorstore, fused)
+
+    def _rescore(self, positions: np.ndarray, query_vector) -> Optional[List[int]]:
+        """
+        Candidate positions ordered by L2 distance to the query, computed from
+        the stored vectors (exact for flat/HNSW/IVF, approximate for IVF-PQ).
+        Returns None if the index cannot reconstruct vectors.
+        """
+        index = self.vectorstore.index
+        try:
+            if hasattr(index, "make_direct_map"):
+                with self._direct_map_lock:
+                    if not self._direct_map_ready:
+                        index.make_direct_map()  # IVF: id -> list offset lookup
+                        self._direct_map_ready = True
+            vectors = index.reconstruct_batch(np.ascontiguousarray(positions, dtype=np.int64))
+        except RuntimeError as e:
+            print(f"⚠️ Dense rescoring unavailable ({e}); using dense search")
+            return None
+        q = np.asarray(query_vector, dtype=np.float32)
+        dists = ((vectors - q) ** 2).sum(axis=1)
+        return positions[np.argsort(dists, kind="stable")].tolist()
+
+    def invoke(self, query: str):
+        return self.get_relevant_documents(query)
+
+    def clear(self):
+        self._embedding_cache.clear()
+        self._result_cache.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "embeddings_cached": len(self._embedding_cache),
+            "embedding_hits": self._embedding_cache.hits,
+            "embedding_misses": self._embedding_cache.misses,
+            "results_cached": len(self._result_cache),
+            "result_hits": self._result_cache.hits,
+            "result_misses": self._result_cache.misses,
+            "mode": self.mode,
+            "batches": self.batcher.summary() if self.batcher is not None else "off",
+        }
@@ -0,0 +1,282 @@
+"""
+Per-stage latency tracing with JSON-lines logs and Prometheus metrics.
+
+A trace covers one question (or one startup step). Code anywhere below it
+marks stages with span("vector_search"); spans find the active trace
+through a ContextVar, so retriever and LLM code do not take a trace
+argument and record nothing when no trace is active. On finish() a trace:
+  - appends one JSON line to MEDGPT_TRACE_LOG (default .cache/traces.jsonl),
+    which is rotated to traces.jsonl.1 … .N once it passes
+    MEDGPT_TRACE_LOG_MAX_MB
+  - feeds every stage into the medgpt_stage_seconds{stage=...} histogram
+    and Ollama token rates into medgpt_llm_tokens_per_second{phase=...}
+
+metrics_text() renders all metrics in the Prometheus text format. The API
+serves it on /metrics; for Streamlit, set MEDGPT_METRICS_PORT to start a
+small stdlib server with the same endpoint.
+
+Stages: index_load, cache_lookup, query_embed, vector_search, bm25_search, doc_fetch,
+rescore, batch_wait, context_build, llm_ttft, llm_total, total
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+TRACE_LOG_PATH = os.getenv("MEDGPT_TRACE_LOG", ".cache/traces.jsonl")  # empty: no log file
+TRACE_LOG_MAX_BYTES = int(float(os.getenv("MEDGPT_TRACE_LOG_MAX_MB", "20")) * 1024 * 1024)  # 0: never rotate
+TRACE_LOG_BACKUPS = int(os.getenv("MEDGPT_TRACE_LOG_BACKUPS", "3"))  # rotated files kept
+METRICS_PORT = int(os.getenv("MEDGPT_METRICS_PORT", "0"))  # Streamlit: 0 disables the /metrics server
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+_current = contextvars.ContextVar("medgpt_trace", default=None)
+
+# ---------- metrics ----------
+def _labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+class Histogram:
+    """Prometheus-style cumulative histogram with labels"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series: Dict[Tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + (f'{bound:g}',))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}")
+        return "\n".join(lines)
+
+    def summary(self) -> Dict[str, Dict]:
+        """{label: {"count", "avg"}} for quick display."""
+        with self._lock:
+            return {",".join(map(str, labels)): {"count": s[-1], "avg": s[-2] / s[-1] if s[-1] else 0.0}
+                    for labels, s in self._series.items()}
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value:g}")
+        return "\n".join(lines)
+
+_registry: Dict[str, object] = {}
+_registry_lock = threading.Lock()
+
+def _register(metric):
+    # Same name → same metric, even if a module is imported twice (e.g. as __main__)
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+def histogram(name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS, labels: Sequence[str] = ()):
+    return _register(Histogram(name, help_text, buckets, labels))
+
+def counter(name: str, help_text: str, labels: Sequence[str] = ()):
+    return _register(Counter(name, help_text, labels))
+
+def metrics_text() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(m.render() for m in metrics) + "\n"
+
+STAGE_SECONDS = histogram("medgpt_stage_seconds", "Latency of each pipeline stage", labels=("stage",))
+LLM_TOKEN_RATE = histogram("medgpt_llm_tokens_per_second", "Ollama token throughput (eval_count / eval_duration)",
+                           RATE_BUCKETS, labels=("phase",))
+TRACES = counter("medgpt_traces_total", "Finished traces by name and outcome", labels=("name", "outcome"))
+
+# ---------- traces ----------
+class Trace:
+    """Stage durations and attributes for one unit of work"""
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attrs = dict(attrs)
+        self.spans: Dict[str, float] = {}
+        self.rates: Dict[str, float] = {}
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def record(self, stage: str, seconds: Optional[float]):
+        """Add a stage duration measured elsewhere (repeated stages are summed)."""
+        if seconds is None:
+            return
+        with self._lock:
+            self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.record(stage, time.perf_counter() - t0)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record_llm(self, stats: Dict):
+        """Copy LLMHandler stats: time to first token, total and Ollama eval rates."""
+        self.record("llm_ttft", stats.get("ttft_s"))
+        self.record("llm_total", stats.get("total_s"))
+        for phase, key in (("eval", "tokens_per_s"), ("prompt_eval", "prompt_tokens_per_s")):
+            if stats.get(key):
+                self.rates[phase] = float(stats[key])
+        for key in ("tokens", "prompt_tokens", "context_tokens", "fallback", "cancelled"):
+            if stats.get(key) is not None:
+                self.attrs[key] = stats[key]
+
+    @contextmanager
+    def activate(self):
+        """Make this the trace that span() calls record into (in this context)."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def finish(self, outcome: str = "ok") -> Dict:
+        if self._finished:
+            return {}
+        self._finished = True
+        total = time.perf_counter() - self._t0
+        with self._lock:
+            spans = dict(self.spans)
+        spans["total"] = total
+        for stage, seconds in spans.items():
+            STAGE_SECONDS.observe(seconds, stage)
+        for phase, rate in self.rates.items():
+            LLM_TOKEN_RATE.observe(rate, phase)
+        TRACES.inc(self.name, outcome)
+        record = {
+            "ts": time.time(),
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "outcome": outcome,
+            "spans": {k: round(v, 6) for k, v in spans.items()},
+            "rates": {k: round(v, 2) for k, v in self.rates.items()},
+            "attrs": self.attrs,
+        }
+        _write_log(record)
+        return record
+
+def start_trace(name: str, **attrs) -> Trace:
+    return Trace(name, **attrs)
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+@contextmanager
+def span(stage: str):
+    """Time a stage into the active trace; a no-op without one."""
+    trace = _current.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(stage):
+        yield trace
+
+def record(stage: str, seconds: Optional[float]):
+    trace = _current.get()
+    if trace is not None:
+        trace.record(stage, seconds)
+
+_log_lock = threading.Lock()
+
+def _rotate_log(path: Path, backups: int):
+    """traces.jsonl → traces.jsonl.1 → … → .N; the oldest is dropped."""
+    if backups <= 0:
+        path.unlink()
+        return
+    for i in range(backups - 1, 0, -1):
+        older = path.with_name(f"{path.name}.{i}")
+        if older.exists():
+            os.replace(older, path.with_name(f"{path.name}.{i + 1}"))
+    os.replace(path, path.with_name(f"{path.name}.1"))
+
+def _write_log(record: Dict):
+    if not TRACE_LOG_PATH:
+        return
+    try:
+        path = Path(TRACE_LOG_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with _log_lock:
+            if TRACE_LOG_MAX_BYTES and path.exists() and path.stat().st_size + len(line) > TRACE_LOG_MAX_BYTES:
+                _rotate_log(path, TRACE_LOG_BACKUPS)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError as e:
+        print(f"⚠️ Could not write trace log: {e}")
+
+# ---------- /metrics server (for Streamlit) ----------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "0.0.0.0"):
+    """Serve /metrics from a daemon thread; returns the server, or None if port is 0."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"📈 Metrics at http://{host}:{port}/metrics")
+    return server
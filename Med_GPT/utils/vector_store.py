@@ -1,7 +1,45 @@
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence, Tuple, Union
+
+SEARCH_BLOCK_SIZE = 256  # queries scored per dense block in batch_top_k
+
+def batch_top_k(query_vectors, doc_vectors, k: int,
+                min_score: Optional[Union[float, Sequence[float]]] = None,
+                block_size: int = SEARCH_BLOCK_SIZE) -> List[List[Tuple[int, float]]]:
+    """
+    Top-k (doc index, score) pairs for every query row, best first.
+
+    TF-IDF rows are L2-normalized, so a sparse dot product is the cosine
+    similarity. Each block of queries costs one sparse product, and
+    argpartition picks the k candidates in O(N) before sorting only those.
+    min_score is one threshold for all queries or one per query.
+    """
+    n_queries, n_docs = query_vectors.shape[0], doc_vectors.shape[0]
+    k = min(k, n_docs)
+    if k <= 0:
+        return [[] for _ in range(n_queries)]
+    thresholds = np.broadcast_to(
+        np.asarray(-np.inf if min_score is None else min_score, dtype=np.float64), (n_queries,)
+    )
+
+    results = []
+    for start in range(0, n_queries, block_size):
+        block = query_vectors[start:start + block_size]
+        # docs x queries keeps the large matrix in its stored CSR layout
+        scores = (doc_vectors @ block.T).T.toarray()
+        if k < n_docs:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n_docs), (scores.shape[0], 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        for row_ids, row_scores, threshold in zip(top, top_scores, thresholds[start:start + block_size]):
+            keep = row_scores >= threshold
+            results.append(list(zip(row_ids[keep].tolist(), row_scores[keep].tolist())))
+    return results
 
 class VectorStore:
     """Simple vector store using TF-IDF (no complex dependencies)"""
@@ -28,26 +66,31 @@ class VectorStore:
         
         print(f"✅ Added {len(documents)} documents to vector store")
     
-    def search(self, query: str, k: int = 5) -> List[Dict]:
+    def search(self, query: str, k: int = 5, min_score: Optional[float] = None) -> List[Dict]:
         """Search for most relevant documents using TF-IDF similarity"""
+        return self.search_batch([query], k, min_score)[0]
+    
+    def search_batch(self, queries: List[str], k: int = 5,
+                     min_score: Optional[Union[float, Sequence[float]]] = None) -> List[List[Dict]]:
+        """Search many queries at once; returns one result list per query"""
         if self.vectors is None:
             raise ValueError("No documents in vector store. Call add_documents first.")
+        if not queries:
+            return []
         
-        # Vectorize query
-        query_vector = self.vectorizer.transform([query])
-        
-        # Calculate cosine similarity
-        similarities = cosine_similarity(query_vector, self.vectors)[0]
-        
-        # Get top k indices
-        top_indices = np.argsort(similarities)[::-1][:k]
+        # Vectorize all queries and score them against every document
+        query_vectors = self.vectorizer.transform(queries)
+        hits = batch_top_k(query_vectors, self.vectors, k, min_score)
         
         # Format results
         results = []
-        for idx in top_indices:
-            if idx < len(self.documents):
-                result = self.documents[idx].copy()
-                result['score'] = float(similarities[idx])
-                results.append(result)
+        for query_hits in hits:
+            query_results = []
+            for idx, score in query_hits:
+                if idx < len(self.documents):
+                    result = self.documents[idx].copy()
+                    result['score'] = score
+                    query_results.append(result)
+            results.append(query_results)
         
         return results
\ No newline at end of file
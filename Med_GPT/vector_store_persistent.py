@@ -1,8 +1,62 @@
+"""
+TF-IDF vector store with a pickle-free, memory-mappable cache format.
+
+A saved store is a directory (vector_cache/<name>/) of plain columnar files:
+  header.json          format version, shapes and vectorizer parameters
+  vectors_data.npy     CSR matrix arrays (data / indices / indptr)
+  vectors_indices.npy
+  vectors_indptr.npy
+  idf.npy              fitted idf weights
+  vocabulary.json      terms in column order
+  documents.jsonl      one chunk record per line
+  documents_offsets.npy  byte offset of every line (n_docs + 1 entries)
+
+Arrays are opened with mmap_mode="r" and documents are decoded on access,
+so loading does not scale with corpus size, never executes pickled code,
+and several processes can share one cache read-only through the page cache.
+"""
+import json
+import mmap
+import os
+import shutil
+from pathlib import Path
+
 import numpy as np
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import pickle
-from pathlib import Path
+
+from utils.vector_store import batch_top_k
+
+CACHE_FORMAT = "medgpt-tfidf"
+CACHE_VERSION = 1
+VECTORIZER_PARAMS = ("max_features", "stop_words", "ngram_range", "lowercase",
+                     "norm", "use_idf", "smooth_idf", "sublinear_tf")
+
+class DocumentRecords:
+    """Read-only sequence over documents.jsonl, decoding one record per access"""
+
+    def __init__(self, jsonl_path, offsets):
+        self.offsets = offsets
+        self._file = open(jsonl_path, "rb")
+        # mmap cannot map an empty file
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if len(offsets) > 1 else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("document index out of range")
+        return json.loads(self._buf[int(self.offsets[idx]):int(self.offsets[idx + 1])])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
 class VectorStore:
     def __init__(self, cache_path="vector_cache"):
@@ -22,62 +76,119 @@ class VectorStore:
         texts = [doc['text'] for doc in documents]
         self.vectors = self.vectorizer.fit_transform(texts)
         
-    def search(self, query, k=5):
+    def search(self, query, k=5, min_score=None):
         """Search for most relevant documents"""
-        if self.vectors is None:
-            return []
-            
-        query_vector = self.vectorizer.transform([query])
-        similarities = cosine_similarity(query_vector, self.vectors)[0]
-        
-        top_indices = np.argsort(similarities)[-k:][::-1]
-        
+        return self.search_batch([query], k, min_score)[0]
+
+    def search_batch(self, queries, k=5, min_score=None):
+        """Search many queries with one sparse product per block (see batch_top_k)"""
+        if self.vectors is None or not queries:
+            return [[] for _ in queries]
+
+        query_vectors = self.vectorizer.transform(queries)
         results = []
-        for idx in top_indices:
-            result = self.documents[idx].copy()
-            result['score'] = float(similarities[idx])
-            results.append(result)
-            
+        for hits in batch_top_k(query_vectors, self.vectors, k, min_score):
+            query_results = []
+            for idx, score in hits:
+                result = self.documents[idx].copy()
+                result['score'] = score
+                query_results.append(result)
+            results.append(query_results)
+
         return results
     
     def save(self, name="default"):
-        """Save vector store to disk"""
-        cache_file = self.cache_path / f"{name}.pkl"
-        
-        cache_data = {
-            'documents': self.documents,
-            'vectorizer': self.vectorizer,
-            'vectors': self.vectors
+        """Save vector store to disk as a cache directory"""
+        cache_dir = self.cache_path / name
+        tmp_dir = self.cache_path / f"{name}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        vectors = sparse.csr_matrix(self.vectors)
+        np.save(tmp_dir / "vectors_data.npy", vectors.data)
+        np.save(tmp_dir / "vectors_indices.npy", vectors.indices)
+        np.save(tmp_dir / "vectors_indptr.npy", vectors.indptr)
+        np.save(tmp_dir / "idf.npy", self.vectorizer.idf_)
+
+        vocab = self.vectorizer.vocabulary_
+        terms = [None] * len(vocab)
+        for term, col in vocab.items():
+            terms[col] = term
+        with open(tmp_dir / "vocabulary.json", "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+
+        offsets = [0]
+        with open(tmp_dir / "documents.jsonl", "wb") as f:
+            for doc in self.documents:
+                f.write(json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n")
+                offsets.append(f.tell())
+        np.save(tmp_dir / "documents_offsets.npy", np.asarray(offsets, dtype=np.int64))
+
+        params = self.vectorizer.get_params()
+        header = {
+            "format": CACHE_FORMAT,
+            "version": CACHE_VERSION,
+            "n_docs": len(self.documents),
+            "shape": list(vectors.shape),
+            "nnz": int(vectors.nnz),
+            "vectorizer": {p: params[p] for p in VECTORIZER_PARAMS},
         }
-        
-        with open(cache_file, 'wb') as f:
-            pickle.dump(cache_data, f)
-        
-        print(f"✅ Vector store saved to {cache_file}")
-        return cache_file
-    
+        # Header last: a directory without one is an incomplete write
+        with open(tmp_dir / "header.json", "w", encoding="utf-8") as f:
+            json.dump(header, f, indent=2)
+
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, cache_dir)
+
+        print(f"✅ Vector store saved to {cache_dir}")
+        return cache_dir
+
     def load(self, name="default"):
-        """Load vector store from disk"""
-        cache_file = self.cache_path / f"{name}.pkl"
-        
-        if not cache_file.exists():
+        """Load vector store from disk (arrays are memory-mapped, read-only)"""
+        cache_dir = self.cache_path / name
+        header_file = cache_dir / "header.json"
+
+        if not header_file.exists():
+            if (self.cache_path / f"{name}.pkl").exists():
+                print(f"⚠️ {name}.pkl uses the old pickle format and is no longer loaded; "
+                      f"rebuild it with: python build_cache.py")
             return False
-        
+
         try:
-            with open(cache_file, 'rb') as f:
-                cache_data = pickle.load(f)
-            
-            self.documents = cache_data['documents']
-            self.vectorizer = cache_data['vectorizer']
-            self.vectors = cache_data['vectors']
-            
-            print(f"✅ Loaded vector store from {cache_file}")
+            with open(header_file, "r", encoding="utf-8") as f:
+                header = json.load(f)
+            if header.get("format") != CACHE_FORMAT or header.get("version") != CACHE_VERSION:
+                print(f"⚠️ Cache {cache_dir} has format {header.get('format')} v{header.get('version')}, "
+                      f"expected {CACHE_FORMAT} v{CACHE_VERSION}; rebuild with: python build_cache.py")
+                return False
+
+            data = np.load(cache_dir / "vectors_data.npy", mmap_mode="r")
+            indices = np.load(cache_dir / "vectors_indices.npy", mmap_mode="r")
+            indptr = np.load(cache_dir / "vectors_indptr.npy", mmap_mode="r")
+            self.vectors = sparse.csr_matrix((data, indices, indptr), shape=tuple(header["shape"]), copy=False)
+
+            params = dict(header["vectorizer"])
+            params["ngram_range"] = tuple(params["ngram_range"])
+            with open(cache_dir / "vocabulary.json", "r", encoding="utf-8") as f:
+                terms = json.load(f)
+            self.vectorizer = TfidfVectorizer(**params)
+            self.vectorizer.vocabulary_ = {term: col for col, term in enumerate(terms)}
+            self.vectorizer.idf_ = np.load(cache_dir / "idf.npy")
+
+            offsets = np.load(cache_dir / "documents_offsets.npy", mmap_mode="r")
+            self.documents = DocumentRecords(cache_dir / "documents.jsonl", offsets)
+
+            print(f"✅ Loaded vector store from {cache_dir}")
             return True
         except Exception as e:
             print(f"❌ Error loading cache: {e}")
             return False
-    
+
     def cache_exists(self, name="default"):
-        """Check if cache file exists"""
-        cache_file = self.cache_path / f"{name}.pkl"
-        return cache_file.exists()
\ No newline at end of file
+        """Check if a complete cache directory exists"""
+        return (self.cache_path / name / "header.json").exists()
+
+    def cache_size(self, name="default"):
+        """Total size of the cache directory in bytes"""
+        cache_dir = self.cache_path / name
+        return sum(f.stat().st_size for f in cache_dir.iterdir() if f.is_file()) if cache_dir.exists() else 0